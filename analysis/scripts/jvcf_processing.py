@@ -3,10 +3,14 @@ Helper code to process JSON VCFs made by gramtools
 """
 from typing import NamedTuple, Optional, Dict, Set, List, Union
 import re
+from bisect import bisect_left, bisect_right
 from collections import namedtuple
 
 import click
-import edlib
+
+from lazy_imports import lazy_import
+
+edlib = lazy_import("edlib")
 
 JVCF = Dict
 SiteJson = Dict
@@ -72,6 +76,41 @@ def first_idx_in_region(sites_json: SiteJsons, region: Region) -> int:
 
     return result
 
+
+class SitesIndex:
+    """
+    Positional index of a jVCF's sites, for finding the first site in many regions
+    without scanning the sites from the start for each region.
+    """
+
+    def __init__(self, sites_json: SiteJsons):
+        segment_sites: Dict[str, List] = dict()
+        for site_idx, site_json in enumerate(sites_json):
+            segment_sites.setdefault(site_json["SEG"], list()).append(
+                (int(site_json["POS"]), site_idx)
+            )
+        self.num_sites = len(sites_json)
+        self.positions: Dict[str, List[int]] = dict()
+        self.site_indices: Dict[str, List[int]] = dict()
+        for segment, sites in segment_sites.items():
+            sites.sort()
+            self.positions[segment] = [pos for pos, _ in sites]
+            self.site_indices[segment] = [site_idx for _, site_idx in sites]
+
+    def first_idx_in_region(self, region: Region) -> int:
+        """Same as `first_idx_in_region` on the indexed sites"""
+        if region.segment == "" and self.num_sites > 0:
+            return 0
+        positions = self.positions.get(region.segment, list())
+        # Nested sites can be out of POS order, so take the smallest index of all sites in region
+        lo = bisect_left(positions, region.start)
+        hi = bisect_right(positions, region.end)
+        if lo == hi:
+            print(f"ERROR: No sites fall within specified region {region}")
+            raise IndexError
+        return min(self.site_indices[region.segment][lo:hi])
+
+
 def first_idx_in_region_non_nested(jvcf, region):
     first_idx = first_idx_in_region(jvcf["Sites"], region)
     # If the first idx is not at lvl1, we can get a site following the first one which has a smaller POS and that is not in target region
@@ -157,6 +196,21 @@ def num_sites_under(child_map: Dict, site_idx: str) -> int:
     return result
 
 
+def site_nesting_depths(jvcf: JVCF) -> List[int]:
+    """
+    Nesting depth of each site: 0 for Lvl1 sites, 1 for sites directly under them, etc.
+    """
+    child_map = jvcf["Child_Map"]
+    depths = [0] * len(jvcf["Sites"])
+    to_visit: List[int] = list(jvcf["Lvl1_Sites"])
+    while len(to_visit) > 0:
+        site_idx = to_visit.pop()
+        for children in child_map.get(str(site_idx), dict()).values():
+            for child_idx in children:
+                depths[child_idx] = depths[site_idx] + 1
+                to_visit.append(child_idx)
+    return depths
+
 ### Convert a jVCF to a VCF ###
 class jVCF_to_VCF:
     def __init__(self):
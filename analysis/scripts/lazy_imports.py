@@ -0,0 +1,37 @@
+"""
+Deferred imports of heavy dependencies (pandas, numpy, edlib, pysam, varifier...), so that
+scripts can start quickly when a command does not need them, e.g. to print output headers.
+
+Usage, in place of `import pandas as pd`:
+    pd = lazy_import("pandas")
+The module is imported on first attribute access, e.g. `pd.DataFrame`.
+"""
+
+import importlib
+from types import ModuleType
+
+
+class LazyModule:
+    """Stands in for a module, which is only imported on first attribute access"""
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def _load(self) -> ModuleType:
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr: str):
+        if attr in ("_name", "_module"):  # Not yet set, e.g. when copied
+            raise AttributeError(attr)
+        return getattr(self._load(), attr)
+
+    def __repr__(self) -> str:
+        status = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module '{self._name}' ({status})>"
+
+
+def lazy_import(name: str) -> LazyModule:
+    return LazyModule(name)
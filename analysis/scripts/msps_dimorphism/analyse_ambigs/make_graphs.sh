@@ -1,5 +1,6 @@
 usage(){
 	echo "usage: $0 input.tsv visualise_prg_script coverage_graph output_dir"
+	echo "input.tsv: made by msps_dimorphism/site_summary_stats.py"
 	exit 1
 }
 
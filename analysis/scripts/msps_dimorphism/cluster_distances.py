@@ -1,53 +1,91 @@
-import sys
-from typing import Dict
+from typing import List
 from random import choice
 
 import click
-from scipy.cluster.hierarchy import linkage, to_tree, ClusterNode
-from Bio import SeqIO
-import edlib
 from numpy import mean
 
-from common import get_partition
+from common import (
+    get_partition,
+    PARTITION_MODES,
+    SeqMap,
+    load_sequences,
+    seq_hash_pair,
+    get_edit_distances,
+)
 
 NUM_SAMPLED_SEQS = 10000
 
-SeqName = str
-Seq = str
-SeqMap = Dict[SeqName, Seq]
 
+def sample_pairs(cluster_1: List[str], cluster_2: List[str]):
+    return [(choice(cluster_1), choice(cluster_2)) for _ in range(NUM_SAMPLED_SEQS)]
 
-def get_seqmap(input_sequences: click.Path) -> SeqMap:
-    result = dict()
-    for record in SeqIO.parse(input_sequences, "fasta"):
-        result[record.id] = str(record.seq)
-    return result
 
-
-def average_sampled_distance(cluster_1, cluster_2, seqmap: SeqMap):
-    distances = list()
-    for _ in range(NUM_SAMPLED_SEQS):
-        seq1 = seqmap[choice(cluster_1)]
-        seq2 = seqmap[choice(cluster_2)]
-        distance = edlib.align(seq1, seq2, task="distance")["editDistance"] / len(seq1)
-        distances.append(distance)
-    return mean(distances)
+def average_sampled_distance(sampled_pairs, seqmap: SeqMap, distances) -> float:
+    """Mean edit distance of the pairs of samples, relative to the length of the first sequence"""
+    relative_distances = list()
+    for sname1, sname2 in sampled_pairs:
+        seq1, seq2 = seqmap[sname1], seqmap[sname2]
+        distance = distances[seq_hash_pair(seq1, seq2)]
+        relative_distances.append(distance / len(seq1))
+    return mean(relative_distances)
 
 
 @click.command()
+@click.option(
+    "--partition_mode",
+    help="How to cluster samples: 'auto' switches from exact to scalable clustering for large cohorts",
+    type=click.Choice(PARTITION_MODES),
+    default="auto",
+    show_default=True,
+)
+@click.option(
+    "--threads",
+    "-t",
+    help="Number of worker processes computing edit distances",
+    type=int,
+    default=1,
+    show_default=True,
+)
+@click.option(
+    "--distance_cache",
+    help="sqlite file caching edit distances by sequence hash across runs. Use one file per concurrent job",
+    type=click.Path(),
+    default=None,
+)
 @click.argument("hapg_matrix", type=click.Path(exists=True))
 @click.argument("input_sequences", type=click.Path(exists=True))
 @click.argument("output_prefix", type=str)
-def main(hapg_matrix: click.Path, input_sequences: click.Path, output_prefix: str):
-    clusters = get_partition(hapg_matrix)
-    seqmap = get_seqmap(input_sequences)
+def main(
+    partition_mode: str,
+    threads: int,
+    distance_cache: click.Path,
+    hapg_matrix: click.Path,
+    input_sequences: click.Path,
+    output_prefix: str,
+):
+    clusters = get_partition(hapg_matrix, mode=partition_mode)
+    seqmap = load_sequences(input_sequences)
+    sampled_pairs = dict()
+    for i in range(len(clusters)):
+        for j in range(i, len(clusters)):
+            sampled_pairs[(i, j)] = sample_pairs(clusters[i], clusters[j])
+    distances = get_edit_distances(
+        (
+            (seqmap[sname1], seqmap[sname2])
+            for pairs in sampled_pairs.values()
+            for sname1, sname2 in pairs
+        ),
+        threads=threads,
+        cache_path=distance_cache,
+    )
+
     ofile = open(f"{output_prefix}_cluster_distmatrix.tsv", "w")
     for i in range(len(clusters)):
         row = list()
         for j in range(0, i):
             row.append("-")
         for j in range(i, len(clusters)):
-            dist = average_sampled_distance(clusters[i], clusters[j], seqmap)
+            dist = average_sampled_distance(sampled_pairs[(i, j)], seqmap, distances)
             row.append(str(dist))
         ofile.write("\t".join(row) + "\n")
     ofile.close()
@@ -1,43 +1,362 @@
-from typing import List
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
 from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+import hashlib
+import os
+import sqlite3
 
 import click
+import numpy as np
 import pandas as pd
-from scipy.cluster.hierarchy import linkage, to_tree, ClusterNode
+import edlib
+from Bio import SeqIO
+from scipy import sparse
+from scipy.cluster.hierarchy import leaves_list
+
+from jvcf_processing import Region, is_in_region, first_idx_in_region_non_nested
+from msps_dimorphism.linkage import (
+    NUM_REPRESENTATIVES,
+    SEED,
+    exact_linkage,
+    partition_from_linkage,
+    scalable_linkage,
+)
 
 country_to_colour = {"Ghana": "Gold", "Laos": "FireBrick", "Cambodia": "RoyalBlue"}
 cluster_dimorphic_to_colour = {"form1": "Chocolate", "form2": "RosyBrown"}
 nested_colour_mapping = {True: "gray", False: "navajowhite"}
 marker_colours = {"Low": "Black", "High": "red"}
 
-def get_partition(hapg_matrix: click.Path) -> List[str]:
-    df = pd.read_csv(hapg_matrix, sep="\t", index_col=0)
-    cl = linkage(df, method="average", metric="euclidean")
-    root: ClusterNode = to_tree(cl)
-    cur_node = root
-    while True:
-        cl_size = cur_node.get_count()
-        child_sizes = [cur_node.left.get_count(), cur_node.right.get_count()]
-        if sum(child_sizes) == 2:
-            raise ValueError("No suitable partition of the cluster found")
-        if min(child_sizes) < (cl_size / 10):
-            largest = (
-                cur_node.left if child_sizes[0] > child_sizes[1] else cur_node.right
+class RegionCalls(NamedTuple):
+    """
+    Calls of every sample at the sites of a region, as samples x sites matrices.
+    Null calls are -1 by convention.
+    """
+
+    hapgs: np.ndarray
+    gts: np.ndarray
+    nested: np.ndarray
+    site_indices: np.ndarray
+
+
+def get_region_calls(jvcf, region: Region) -> RegionCalls:
+    """
+    Extracts haplogroup (HAPG) and genotype (GT) calls in one pass over the sites in :param: region,
+    starting from its first non-nested site.
+    """
+    sites = jvcf["Sites"]
+    num_samples = len(jvcf["Samples"])
+    lvl1_sites = set(jvcf["Lvl1_Sites"])
+
+    first_idx = first_idx_in_region_non_nested(jvcf, region)
+    last_idx = first_idx
+    while last_idx < len(sites) and is_in_region(sites[last_idx], region):
+        last_idx += 1
+    site_indices = np.arange(first_idx, last_idx)
+
+    hapgs = np.full((num_samples, len(site_indices)), -1, dtype=np.int16)
+    gts = np.full((num_samples, len(site_indices)), -1, dtype=np.int16)
+    for col, site_idx in enumerate(site_indices):
+        site = sites[site_idx]
+        gts[:, col] = [-1 if gt[0] is None else gt[0] for gt in site["GT"]]
+        hapgs[:, col] = [
+            -1 if gt[0] is None or len(hapg) == 0 or hapg[0] is None else hapg[0]
+            for gt, hapg in zip(site["GT"], site["HAPG"])
+        ]
+    nested = np.array([idx not in lvl1_sites for idx in site_indices], dtype=bool)
+
+    return RegionCalls(hapgs, gts, nested, site_indices)
+
+
+class SparseCalls(NamedTuple):
+    """
+    Samples x sites calls, for cohorts where most calls are 0 (the majority haplogroup/allele) or null.
+    """
+
+    values: sparse.csr_matrix  # Non-zero, non-null calls
+    null: sparse.csr_matrix  # True where the call is null
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    def encoded(self) -> sparse.csr_matrix:
+        """Single sparse matrix of calls, with null calls as -1 like the dense matrices"""
+        return (self.values - self.null.astype(self.values.dtype)).tocsr()
+
+    def to_dense(self) -> np.ndarray:
+        return self.encoded().toarray()
+
+
+def sparse_calls_from_columns(columns: List[List[Optional[int]]], num_samples: int):
+    """Builds SparseCalls from one list of calls per site, without allocating the dense matrix"""
+    value_rows, value_cols, values = list(), list(), list()
+    null_rows, null_cols = list(), list()
+    for col, calls in enumerate(columns):
+        for row, call in enumerate(calls):
+            if call is None:
+                null_rows.append(row)
+                null_cols.append(col)
+            elif call != 0:
+                value_rows.append(row)
+                value_cols.append(col)
+                values.append(call)
+    shape = (num_samples, len(columns))
+    return SparseCalls(
+        sparse.csr_matrix(
+            (np.array(values, dtype=np.int16), (value_rows, value_cols)), shape=shape
+        ),
+        sparse.csr_matrix(
+            (np.ones(len(null_rows), dtype=bool), (null_rows, null_cols)), shape=shape
+        ),
+    )
+
+
+class SparseRegionCalls(NamedTuple):
+    """As RegionCalls, with sparse calls"""
+
+    hapgs: SparseCalls
+    gts: SparseCalls
+    nested: np.ndarray
+    site_indices: np.ndarray
+
+
+def get_sparse_region_calls(jvcf, region: Region) -> SparseRegionCalls:
+    """As `get_region_calls`, without materialising the dense samples x sites matrices"""
+    sites = jvcf["Sites"]
+    num_samples = len(jvcf["Samples"])
+    lvl1_sites = set(jvcf["Lvl1_Sites"])
+
+    first_idx = first_idx_in_region_non_nested(jvcf, region)
+    last_idx = first_idx
+    while last_idx < len(sites) and is_in_region(sites[last_idx], region):
+        last_idx += 1
+    site_indices = np.arange(first_idx, last_idx)
+
+    gt_columns, hapg_columns = list(), list()
+    for site_idx in site_indices:
+        site = sites[site_idx]
+        gt_columns.append([gt[0] for gt in site["GT"]])
+        hapg_columns.append(
+            [
+                None if gt[0] is None or len(hapg) == 0 else hapg[0]
+                for gt, hapg in zip(site["GT"], site["HAPG"])
+            ]
+        )
+    nested = np.array([idx not in lvl1_sites for idx in site_indices], dtype=bool)
+    return SparseRegionCalls(
+        sparse_calls_from_columns(hapg_columns, num_samples),
+        sparse_calls_from_columns(gt_columns, num_samples),
+        nested,
+        site_indices,
+    )
+
+
+def save_sparse_calls(fname: click.Path, calls: SparseCalls, sample_names: List[str]):
+    """Saves sparse calls in one .npz file, the sparse counterpart of a hapg matrix TSV"""
+    with open(fname, "wb") as fout:
+        np.savez_compressed(
+            fout,
+            shape=np.array(calls.shape),
+            values_data=calls.values.data,
+            values_indices=calls.values.indices,
+            values_indptr=calls.values.indptr,
+            null_indices=calls.null.indices,
+            null_indptr=calls.null.indptr,
+            sample_names=np.array(sample_names, dtype=str),
+        )
+
+
+def load_sparse_calls(fname: click.Path):
+    """Returns the SparseCalls and sample names saved by `save_sparse_calls`"""
+    with np.load(fname) as saved:
+        shape = tuple(saved["shape"])
+        values = sparse.csr_matrix(
+            (saved["values_data"], saved["values_indices"], saved["values_indptr"]),
+            shape=shape,
+        )
+        null = sparse.csr_matrix(
+            (
+                np.ones(len(saved["null_indices"]), dtype=bool),
+                saved["null_indices"],
+                saved["null_indptr"],
+            ),
+            shape=shape,
+        )
+        return SparseCalls(values, null), saved["sample_names"].tolist()
+
+
+def is_sparse_matrix_file(hapg_matrix: click.Path) -> bool:
+    return str(hapg_matrix).endswith(".npz")
+
+
+class Clustering(NamedTuple):
+    """Hierarchical clustering of the samples (rows) of a hapg matrix"""
+
+    linkage: np.ndarray
+    leaves: np.ndarray  # Dendrogram leaf order, as row indices
+    groups: List[List[str]]  # The dimorphic partition, as sample names
+
+
+CLUSTERING_CACHE_VERSION = 2
+PARTITION_MODES = ["auto", "exact", "scalable", "approximate"]
+# Above this many samples, 'auto' mode avoids scipy's full condensed distance matrix
+MAX_EXACT_SAMPLES = 5000
+# Above this many distinct rows, 'auto' mode clusters this many representatives (about 250MB of distances)
+MAX_SCALABLE_POINTS = 8000
+
+
+def clustering_cache_path(hapg_matrix: click.Path) -> Path:
+    return Path(hapg_matrix).with_suffix(".linkage.npz")
+
+
+def clustering_cache_key(
+    hapg_matrix: click.Path,
+    method: str,
+    metric: str,
+    mode: str,
+    max_points: Optional[int] = None,
+) -> str:
+    content_hash = hashlib.sha256(Path(hapg_matrix).read_bytes()).hexdigest()
+    if mode == "approximate":
+        mode = f"{mode}:{NUM_REPRESENTATIVES}:{SEED}"
+    elif max_points is not None:
+        mode = f"{mode}:max_points={max_points}:{SEED}"
+    return f"v{CLUSTERING_CACHE_VERSION}:{method}:{metric}:{mode}:{content_hash}"
+
+
+def load_cached_clustering(cache_path: Path, key: str) -> Optional[Clustering]:
+    if not cache_path.exists():
+        return None
+    with np.load(cache_path) as cached:
+        if str(cached["key"]) != key:
+            return None
+        sample_names = cached["sample_names"].tolist()
+        groups = [
+            [sample_names[idx] for idx in cached[group_name]]
+            for group_name in ["group1", "group2"]
+        ]
+        return Clustering(cached["linkage"], cached["leaves"], groups)
+
+
+def num_matrix_samples(hapg_matrix: click.Path) -> int:
+    """Number of samples (rows) of a hapg matrix, without loading it"""
+    if is_sparse_matrix_file(hapg_matrix):
+        with np.load(hapg_matrix) as saved:
+            return int(saved["shape"][0])
+    with open(hapg_matrix) as fin:
+        return sum(1 for line in fin if line.strip() != "") - 1  # Minus the header
+
+
+def matrix_sample_names(hapg_matrix: click.Path) -> List[str]:
+    """Sample names of the rows of a hapg matrix, without loading its calls"""
+    if is_sparse_matrix_file(hapg_matrix):
+        with np.load(hapg_matrix) as saved:
+            return saved["sample_names"].tolist()
+    return list(pd.read_csv(hapg_matrix, sep="\t", index_col=0, usecols=[0]).index)
+
+
+def save_clustering(cache_path: Path, key: str, clustering: Clustering, sample_names):
+    """
+    Writes to a temporary file then renames it, so that jobs reading the cache
+    concurrently never see a partially written file
+    """
+    sample_indices = {name: idx for idx, name in enumerate(sample_names)}
+    tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+    try:
+        with tmp_path.open("wb") as fout:
+            np.savez(
+                fout,
+                key=np.array(key),
+                linkage=clustering.linkage,
+                leaves=clustering.leaves,
+                sample_names=np.array(sample_names, dtype=str),
+                group1=np.array(
+                    [sample_indices[name] for name in clustering.groups[0]], dtype=int
+                ),
+                group2=np.array(
+                    [sample_indices[name] for name in clustering.groups[1]], dtype=int
+                ),
             )
-            cur_node = largest
-        else:
-            groups = [cur_node.left.pre_order(), cur_node.right.pre_order()]
-            break
-    sample_groups = []
-    for group in groups:
-        sample_names = [df.index[sample_idx] for sample_idx in group]
-        sample_groups.append(sample_names)
+        os.replace(tmp_path, cache_path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+def load_hapg_matrix(hapg_matrix: click.Path):
+    """
+    Loads a hapg matrix as an array, or as a sparse matrix if saved by `save_sparse_calls` (.npz).
+    Returns the matrix and the sample names of its rows.
+    """
+    if is_sparse_matrix_file(hapg_matrix):
+        calls, sample_names = load_sparse_calls(hapg_matrix)
+        return calls.encoded(), sample_names
+    df = pd.read_csv(hapg_matrix, sep="\t", index_col=0)
+    return df.to_numpy(), list(df.index)
+
+
+def get_clustering(
+    hapg_matrix: click.Path,
+    method: str = "average",
+    metric: str = "euclidean",
+    mode: str = "auto",
+) -> Clustering:
+    """
+    Clusters the samples of :param: hapg_matrix, a TSV or a sparse .npz file.
+    The result is cached in a binary file next to the hapg matrix, keyed by the matrix
+    content and linkage parameters, so all scripts of the workflow reuse a single clustering.
+
+    :param: mode: 'exact' uses scipy, 'scalable' and 'approximate' use `scalable_linkage` (average method only),
+    'auto' picks 'exact' unless there are more than MAX_EXACT_SAMPLES samples, and then 'scalable'
+    unless there are more than MAX_SCALABLE_POINTS distinct rows, and then 'approximate' with
+    MAX_SCALABLE_POINTS representatives.
+    """
+    if mode not in PARTITION_MODES:
+        raise ValueError(f"Unknown partition mode {mode}: use one of {PARTITION_MODES}")
+    max_points = None
+    if mode == "auto":
+        num_samples = num_matrix_samples(hapg_matrix)
+        mode = "exact" if num_samples <= MAX_EXACT_SAMPLES else "scalable"
+        if mode == "scalable":
+            max_points = MAX_SCALABLE_POINTS
+    if mode != "exact" and method != "average":
+        raise ValueError(f"Partition mode {mode} only supports the average method")
+
+    cache_path = clustering_cache_path(hapg_matrix)
+    key = clustering_cache_key(hapg_matrix, method, metric, mode, max_points)
+    cached = load_cached_clustering(cache_path, key)
+    if cached is not None:
+        return cached
+
+    matrix, sample_names = load_hapg_matrix(hapg_matrix)
+    if mode == "exact":
+        cl = exact_linkage(matrix, method, metric)
+    else:
+        cl = scalable_linkage(
+            matrix, metric, approximate=mode == "approximate", max_points=max_points
+        )
+    groups = partition_from_linkage(cl, sample_names)
+    result = Clustering(cl, leaves_list(cl), groups)
+    save_clustering(cache_path, key, result, sample_names)
+    return result
+
+
+def get_partition(hapg_matrix: click.Path, mode: str = "auto") -> List[List[str]]:
+    sample_groups = get_clustering(hapg_matrix, mode=mode).groups
     print(f"Found partition of sizes: {len(sample_groups[0])}, {len(sample_groups[1])}")
-    assert len(set(sample_groups[0]).intersection(sample_groups[1])) == 0
     return sample_groups
 
 not_none = lambda x: x is not None
 
+
+def to_gt_list(gts: np.ndarray) -> List:
+    """Converts a vector of genotype calls to a list, with None for null calls"""
+    return [None if gt < 0 else int(gt) for gt in gts]
+
+
 def get_complete_counts(gts1, gts2):
     """Express the genotype sets at the union of genotypes in the sets"""
     gt1_counts = Counter(filter(not_none,gts1))
@@ -70,3 +389,321 @@ def allelic_specificity(gts1, gts2) -> float:
     nonull_gts2 = list(filter(not_none,gts2))
     post_none_ratio = len(nonull_gts1)/(len(nonull_gts1) + len(nonull_gts2))
     return pre_none_ratio - post_none_ratio
+
+
+### Per-site metrics over all sites at once ###
+class DimorphismMetrics(NamedTuple):
+    """Per-site measures of dimorphism between two sample groups; one entry per site"""
+
+    distinguishability: np.ndarray
+    specificity: np.ndarray
+    kl_divergence: np.ndarray
+    js_divergence: np.ndarray
+    heterozygosity: np.ndarray  # groups x sites
+
+
+def group_index_vector(sample_names: List[str], groups: List[List[str]]) -> np.ndarray:
+    """Index of the group of each sample in :param: sample_names, -1 if the sample is in no group"""
+    sample_to_group = {
+        sample_name: group_idx
+        for group_idx, group in enumerate(groups)
+        for sample_name in group
+    }
+    return np.array(
+        [sample_to_group.get(sample_name, -1) for sample_name in sample_names],
+        dtype=int,
+    )
+
+
+def group_gt_counts(
+    gts: np.ndarray, group_indices: np.ndarray, num_groups: Optional[int] = None
+) -> np.ndarray:
+    """
+    Counts the genotypes called in each group at each site, in a single bincount.
+
+    :param: gts: samples x sites matrix, null calls are -1
+    :param: group_indices: group of each sample, -1 for samples to ignore
+    :returns: groups x sites x genotypes array of counts
+    """
+    if num_groups is None:
+        num_groups = int(group_indices.max()) + 1
+    num_sites = gts.shape[1]
+    num_gts = max(int(gts.max()) + 1, 1)
+    used = (gts >= 0) & (group_indices >= 0)[:, None]
+    sample_rows, site_cols = np.nonzero(used)
+    group_site_idx = group_indices[sample_rows] * num_sites + site_cols
+    flat_idx = group_site_idx * num_gts + gts[sample_rows, site_cols]
+    counts = np.bincount(flat_idx, minlength=num_groups * num_sites * num_gts)
+    return counts.reshape(num_groups, num_sites, num_gts)
+
+
+def sparse_group_gt_counts(
+    calls: SparseCalls, group_indices: np.ndarray, num_groups: Optional[int] = None
+) -> np.ndarray:
+    """
+    As `group_gt_counts`, from sparse calls: the counts of genotype 0 are derived
+    from group sizes, null and non-zero counts, so the dense matrix is never built.
+    """
+    if num_groups is None:
+        num_groups = int(group_indices.max()) + 1
+    num_sites = calls.shape[1]
+    values = calls.values.tocoo()
+    num_gts = max(int(values.data.max()) + 1 if values.nnz > 0 else 1, 1)
+    counts = np.zeros((num_groups, num_sites, num_gts), dtype=np.int64)
+
+    in_group = group_indices[values.row] >= 0
+    rows, cols = values.row[in_group], values.col[in_group]
+    flat_idx = (group_indices[rows] * num_sites + cols) * num_gts + values.data[in_group]
+    counts += np.bincount(flat_idx, minlength=counts.size).reshape(counts.shape)
+
+    # One-hot group membership, to sum the null mask per group and site
+    grouped = group_indices >= 0
+    membership = sparse.csr_matrix(
+        (
+            np.ones(grouped.sum(), dtype=np.int64),
+            (group_indices[grouped], np.flatnonzero(grouped)),
+        ),
+        shape=(num_groups, len(group_indices)),
+    )
+    null_counts = (membership @ calls.null.astype(np.int64)).toarray()
+    group_sizes = np.bincount(group_indices[grouped], minlength=num_groups)
+    counts[:, :, 0] = group_sizes[:, None] - null_counts - counts[:, :, 1:].sum(axis=-1)
+    return counts
+
+
+def counts_to_distribs(counts: np.ndarray):
+    """Normalises counts along the last axis; all-zero rows stay zero"""
+    totals = counts.sum(axis=-1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        distribs = np.where(totals[..., None] > 0, counts / totals[..., None], 0.0)
+    return distribs, totals
+
+
+def heterozygosity_from_counts(counts: np.ndarray) -> np.ndarray:
+    """
+    Probability that two randomly chosen genotypes differ, along the last axis of :param: counts.
+    NaN where there are no calls.
+    """
+    distribs, totals = counts_to_distribs(counts)
+    return np.where(totals > 0, 1 - (distribs**2).sum(axis=-1), np.nan)
+
+
+def distinguishability_from_counts(
+    counts1: np.ndarray, counts2: np.ndarray
+) -> np.ndarray:
+    """Vectorised `allelic_distinguishability`: 0 where either group has no calls"""
+    distribs1, totals1 = counts_to_distribs(counts1)
+    distribs2, totals2 = counts_to_distribs(counts2)
+    prob_same = (distribs1 * distribs2).sum(axis=-1)
+    return np.where((totals1 > 0) & (totals2 > 0), 1 - prob_same, 0.0)
+
+
+def specificity_from_counts(
+    counts1: np.ndarray, counts2: np.ndarray, num_samples1: int, num_samples2: int
+) -> np.ndarray:
+    """
+    Vectorised `allelic_specificity`: change in the proportion of group 1 samples
+    once null calls are removed. NaN where there are no calls.
+    """
+    pre_none_ratio = num_samples1 / (num_samples1 + num_samples2)
+    non_null1, non_null2 = counts1.sum(axis=-1), counts2.sum(axis=-1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        post_none_ratio = non_null1 / (non_null1 + non_null2)
+    return pre_none_ratio - post_none_ratio
+
+
+def kl_divergence_from_counts(counts1: np.ndarray, counts2: np.ndarray) -> np.ndarray:
+    """
+    Kullback-Leibler divergence (natural log, as scipy.stats.entropy) from the second
+    to the first genotype distribution. Infinite where either group has no calls.
+    """
+    distribs1, totals1 = counts_to_distribs(counts1)
+    distribs2, totals2 = counts_to_distribs(counts2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        terms = np.where(distribs1 > 0, distribs1 * np.log(distribs1 / distribs2), 0.0)
+    result = terms.sum(axis=-1)
+    return np.where((totals1 > 0) & (totals2 > 0), result, np.inf)
+
+
+def js_divergence_from_counts(counts1: np.ndarray, counts2: np.ndarray) -> np.ndarray:
+    """Jensen-Shannon divergence (log base 2, so in [0, 1]) between the genotype distributions"""
+    distribs1, _ = counts_to_distribs(counts1)
+    distribs2, _ = counts_to_distribs(counts2)
+    middle = (distribs1 + distribs2) / 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        kl1 = np.where(distribs1 > 0, distribs1 * np.log2(distribs1 / middle), 0.0)
+        kl2 = np.where(distribs2 > 0, distribs2 * np.log2(distribs2 / middle), 0.0)
+    return (kl1.sum(axis=-1) + kl2.sum(axis=-1)) / 2
+
+
+def gt_counts_by_group(
+    gts, group_indices: np.ndarray, num_groups: Optional[int] = None
+) -> np.ndarray:
+    """`group_gt_counts` of :param: gts, an array or SparseCalls"""
+    if isinstance(gts, SparseCalls):
+        return sparse_group_gt_counts(gts, group_indices, num_groups)
+    return group_gt_counts(gts, group_indices, num_groups)
+
+
+def get_dimorphism_metrics(gts, group_indices: np.ndarray) -> DimorphismMetrics:
+    """
+    Computes per-site dimorphism metrics between groups 0 and 1 of :param: group_indices,
+    for all sites (columns) of :param: gts (an array or SparseCalls) at once.
+    """
+    counts = gt_counts_by_group(gts, group_indices, num_groups=2)
+    num_samples1 = int((group_indices == 0).sum())
+    num_samples2 = int((group_indices == 1).sum())
+    return DimorphismMetrics(
+        distinguishability=distinguishability_from_counts(counts[0], counts[1]),
+        specificity=specificity_from_counts(
+            counts[0], counts[1], num_samples1, num_samples2
+        ),
+        kl_divergence=kl_divergence_from_counts(counts[0], counts[1]),
+        js_divergence=js_divergence_from_counts(counts[0], counts[1]),
+        heterozygosity=heterozygosity_from_counts(counts),
+    )
+
+
+class CountryFormCounts(NamedTuple):
+    """Genotype counts of the samples of each country and dimorphic form, per site"""
+
+    countries: List[str]
+    country_counts: np.ndarray  # countries x sites x genotypes
+    form_counts: np.ndarray  # forms x sites x genotypes
+    country_form_calls: np.ndarray  # countries x forms x sites: numbers of non-null calls
+    form_sizes: np.ndarray  # Number of samples in each form
+
+
+def get_country_form_counts(
+    gts,
+    sample_names: List[str],
+    sample_to_country: Dict[str, str],
+    forms: List[List[str]],
+) -> CountryFormCounts:
+    """
+    Aggregates the genotype calls :param: gts (an array or SparseCalls) by country and by
+    dimorphic form (:param: forms, lists of sample names). Sparse calls are never densified.
+    Countries are in order of first appearance in :param: sample_names.
+    """
+    countries = list(dict.fromkeys(sample_to_country[name] for name in sample_names))
+    country_indices = np.array(
+        [countries.index(sample_to_country[name]) for name in sample_names], dtype=int
+    )
+    form_indices = group_index_vector(sample_names, forms)
+    num_countries, num_forms = len(countries), len(forms)
+
+    country_counts = gt_counts_by_group(gts, country_indices, num_countries)
+    form_counts = gt_counts_by_group(gts, form_indices, num_forms)
+    country_form_indices = np.where(
+        form_indices >= 0, country_indices * num_forms + form_indices, -1
+    )
+    country_form_counts = gt_counts_by_group(
+        gts, country_form_indices, num_countries * num_forms
+    )
+    country_form_calls = country_form_counts.sum(axis=-1).reshape(
+        num_countries, num_forms, -1
+    )
+    form_sizes = np.bincount(form_indices[form_indices >= 0], minlength=num_forms)
+    return CountryFormCounts(
+        countries, country_counts, form_counts, country_form_calls, form_sizes
+    )
+
+
+### Edit distances between sample sequences ###
+SeqName = str
+Seq = str
+SeqMap = Dict[SeqName, Seq]
+SeqHashPair = Tuple[str, str]
+EDIT_DISTANCE_CHUNK_SIZE = 64
+
+
+def load_sequences(multi_fasta: click.Path) -> SeqMap:
+    """Loads all sequences of a (packed) multi-FASTA, keyed by record ID"""
+    result = dict()
+    for record in SeqIO.parse(multi_fasta, "fasta"):
+        result[record.id] = str(record.seq)
+    return result
+
+
+@lru_cache(maxsize=None)
+def seq_hash(seq: Seq) -> str:
+    return hashlib.sha1(seq.encode()).hexdigest()
+
+
+def seq_hash_pair(seq1: Seq, seq2: Seq) -> SeqHashPair:
+    """Edit distance is symmetric, so pairs are keyed in sorted order"""
+    return tuple(sorted((seq_hash(seq1), seq_hash(seq2))))
+
+
+class EditDistanceCache:
+    """
+    Persistent map from pairs of sequence hashes to their global edit distance, in a sqlite file.
+    A cache file must be written by one job at a time: sqlite's file locking is unreliable
+    on network filesystems (e.g. NFS on a cluster), so give each concurrent job its own file.
+    """
+
+    def __init__(self, cache_path: click.Path):
+        self.connection = sqlite3.connect(str(cache_path), timeout=600)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS edit_distances "
+                "(hash1 TEXT, hash2 TEXT, distance INTEGER, PRIMARY KEY (hash1, hash2))"
+            )
+
+    def get(self, hash_pairs: Iterable[SeqHashPair]) -> Dict[SeqHashPair, int]:
+        result = dict()
+        query = "SELECT distance FROM edit_distances WHERE hash1 = ? AND hash2 = ?"
+        for hash_pair in hash_pairs:
+            found = self.connection.execute(query, hash_pair).fetchone()
+            if found is not None:
+                result[hash_pair] = found[0]
+        return result
+
+    def put(self, distances: Dict[SeqHashPair, int]) -> None:
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO edit_distances VALUES (?, ?, ?)",
+                [(hash1, hash2, dist) for (hash1, hash2), dist in distances.items()],
+            )
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+def edit_distance(seqs: Tuple[Seq, Seq]) -> int:
+    return edlib.align(seqs[0], seqs[1], task="distance")["editDistance"]
+
+
+def get_edit_distances(
+    seq_pairs: Iterable[Tuple[Seq, Seq]],
+    threads: int = 1,
+    cache_path: Optional[click.Path] = None,
+) -> Dict[SeqHashPair, int]:
+    """
+    Global edit distances of :param: seq_pairs, keyed by `seq_hash_pair`.
+    Each distinct pair of sequences is aligned once, in a process pool,
+    and only if not already in the cache at :param: cache_path.
+    """
+    to_compute = dict()
+    for seq1, seq2 in seq_pairs:
+        to_compute.setdefault(seq_hash_pair(seq1, seq2), (seq1, seq2))
+
+    cache = EditDistanceCache(cache_path) if cache_path is not None else None
+    result = cache.get(to_compute) if cache is not None else dict()
+    missing = [hash_pair for hash_pair in to_compute if hash_pair not in result]
+    missing_seqs = [to_compute[hash_pair] for hash_pair in missing]
+    if threads > 1 and len(missing) > 1:
+        with ProcessPoolExecutor(max_workers=threads) as executor:
+            computed = list(
+                executor.map(
+                    edit_distance, missing_seqs, chunksize=EDIT_DISTANCE_CHUNK_SIZE
+                )
+            )
+    else:
+        computed = list(map(edit_distance, missing_seqs))
+    new_distances = dict(zip(missing, computed))
+    result.update(new_distances)
+    if cache is not None:
+        cache.put(new_distances)
+        cache.close()
+    return result
@@ -2,8 +2,10 @@
 # coding: utf-8
 
 
+from pathlib import Path
 from typing import List
 
+import numpy as np
 import pandas as pd
 from scipy.cluster.hierarchy import linkage, to_tree, ClusterNode
 from scipy.stats import entropy
@@ -17,13 +19,25 @@ import matplotlib.pyplot as plt
 from jvcf_processing import (
     Region,
     click_get_region,
-    is_in_region,
-    first_idx_in_region,
 )
-from common import get_partition, allelic_distinguishability, allelic_specificity
-
+from common import (
+    get_partition,
+    get_region_calls,
+    get_sparse_region_calls,
+    get_country_form_counts,
+    heterozygosity_from_counts,
+    distinguishability_from_counts,
+    is_sparse_matrix_file,
+    specificity_from_counts,
+)
 
-groups=get_partition("heatmaps/DBL_DBLMSP2_hapgs.tsv")
+# The workflow writes the hapg matrix as sparse calls (.npz) when run with `sparse: True`,
+# else as a TSV: use whichever it wrote last. With sparse calls, for large cohorts,
+# the samples x sites matrices are never densified.
+hapg_matrix_candidates = [Path("heatmaps/DBL_DBLMSP2_hapgs.npz"), Path("heatmaps/DBL_DBLMSP2_hapgs.tsv")]
+hapg_matrix_file = max(filter(Path.exists, hapg_matrix_candidates), key=lambda fname: fname.stat().st_mtime)
+SPARSE = is_sparse_matrix_file(hapg_matrix_file)
+groups=get_partition(hapg_matrix_file)
 
 
 # In[36]:
@@ -92,11 +106,8 @@ with open("combined.json") as fin:
 
 
 region=Region("Pf3D7_10_v3",1432803,1434147)
-lvl1_sites = set(jvcf["Lvl1_Sites"])
-first_idx = first_idx_in_region(jvcf["Sites"], region)
-
-while first_idx not in lvl1_sites:
-    first_idx += 1
+region_calls = get_sparse_region_calls(jvcf, region) if SPARSE else get_region_calls(jvcf, region)
+sample_names = [sample["Name"] for sample in jvcf["Samples"]]
 
 
 # In[42]:
@@ -161,52 +172,15 @@ cross_het
 # In[46]:
 
 
-dimorphism_calls = defaultdict(list)
-country_calls = defaultdict(list)
-country_dimorphism_counts = defaultdict(list)
-site_is_nested = list()
+## Genotype counts per site, by country and by dimorphic form
+counts = get_country_form_counts(region_calls.gts, sample_names, sample_to_country, groups)
 
-cur_idx = first_idx
-num_sites = 0
-
-while is_in_region(jvcf["Sites"][cur_idx], region):
-    dimorphism_site_calls = defaultdict(list)
-    country_site_calls = defaultdict(list)
-    country_dimo_site_counts = defaultdict(lambda: {"form1":0,"form2":0})
-    site = jvcf["Sites"][cur_idx]
-    gts = [gt[0] for gt in site["GT"]]
-    if len(set(filter(not_none,gts))) < 2:
-        cur_idx +=1
-        continue
-    for sample_idx, gt in enumerate(gts):
-        sample_name = jvcf["Samples"][sample_idx]["Name"]
-        country = sample_to_country[sample_name]
-        country_site_calls[country].append(gt)
-        try:
-            form = sample_to_dimorphic[sample_name]
-            dimorphism_site_calls[form].append(gt)
-            if gt is not None:
-                country_dimo_site_counts[country][form] += 1
-        except KeyError:
-            pass
-
-    # Skip a site if it has too many null calls
-    skip_site = False
-    for country_gts in country_site_calls.values():
-        if len(list(filter(not_none, country_gts))) < 5:
-            skip_site = True
-    if skip_site:
-        cur_idx += 1
-        continue
-    for key,val in country_site_calls.items():
-        country_calls[key].append(val)
-    for key,val in dimorphism_site_calls.items():
-        dimorphism_calls[key].append(val)
-    for key, val in country_dimo_site_counts.items():
-        country_dimorphism_counts[key].append(list(val.values()))
-    site_is_nested.append(False if cur_idx in lvl1_sites else True)
-    cur_idx += 1
-    num_sites += 1
+# Skip sites with fewer than two called genotypes, or with too many null calls in a country
+num_called_gts = (counts.country_counts.sum(axis=0) > 0).sum(axis=-1)
+num_country_calls = counts.country_counts.sum(axis=-1)
+kept_sites = (num_called_gts >= 2) & (num_country_calls >= 5).all(axis=0)
+num_sites = int(kept_sites.sum())
+site_is_nested = list(region_calls.nested[kept_sites])
 
 
 # In[47]:
@@ -219,27 +193,26 @@ num_sites
 
 
 ## Compute genotype heterozygosity for each site in each country
-for country in country_calls:
-    heterozygosities = map(gt_heterozygosity,country_calls[country])
-    country_calls[country] = list(heterozygosities)
-    
+country_calls = dict(
+    zip(counts.countries, heterozygosity_from_counts(counts.country_counts[:, kept_sites]).tolist())
+)
+
 ## Compute inter-form heterozygosity for each site in each country
-for country in country_dimorphism_counts:
-    heterozygosities = map(get_heterozygosity,country_dimorphism_counts[country])
-    country_dimorphism_counts[country] = list(heterozygosities)
+country_form_calls = np.moveaxis(counts.country_form_calls[:, :, kept_sites], 1, -1)
+country_dimorphism_counts = dict(
+    zip(counts.countries, heterozygosity_from_counts(country_form_calls).tolist())
+)
 
 
 # In[49]:
 
 
 ## Compute measures of per-site dimorphism
-dimorphism_sensitivity = []
-dimorphism_specificity = []
-for site_idx in range(num_sites):
-    form1_gts = dimorphism_calls["form1"][site_idx]
-    form2_gts = dimorphism_calls["form2"][site_idx]
-    dimorphism_sensitivity.append(allelic_distinguishability(form1_gts,form2_gts))
-    dimorphism_specificity.append(allelic_specificity(form1_gts,form2_gts))
+form1_counts, form2_counts = counts.form_counts[:, kept_sites]
+dimorphism_sensitivity = distinguishability_from_counts(form1_counts, form2_counts).tolist()
+dimorphism_specificity = specificity_from_counts(
+    form1_counts, form2_counts, *counts.form_sizes
+).tolist()
 
 
 # In[50]:
@@ -1,8 +1,15 @@
-import pandas as pd
-from scipy.cluster.hierarchy import linkage, to_tree, ClusterNode, dendrogram
-from common import get_partition, country_to_colour, cluster_dimorphic_to_colour
+from scipy.cluster.hierarchy import dendrogram
+from common import (
+    get_clustering,
+    matrix_sample_names,
+    PARTITION_MODES,
+    country_to_colour,
+    cluster_dimorphic_to_colour,
+    load_sequences,
+    seq_hash_pair,
+    get_edit_distances,
+)
 from Bio import SeqIO
-import edlib
 import click
 
 import matplotlib.pyplot as plt
@@ -12,29 +19,53 @@ def get_seq(fname):
         return str(seq_record.seq)
 
 @click.command()
-@click.argument("3d7_seq_fname",type=click.Path(exists=True))
-@click.argument("sample_seq_dirname",type=click.Path(exists=True))
-@click.argument("hapg_matrix_fname",type=click.Path(exists=True))
+@click.argument("ref_seq_fname",type=click.Path(exists=True))
+@click.argument("sample_sequences",type=click.Path(exists=True))
+@click.argument("hapg_matrix_fname",type=click.Path(exists=True)) # .tsv, or sparse .npz
 @click.argument("output_dirname",type=click.Path(exists=True))
+@click.option(
+    "--partition_mode",
+    help="How to cluster samples: 'auto' switches from exact to scalable clustering for large cohorts",
+    type=click.Choice(PARTITION_MODES),
+    default="auto",
+    show_default=True,
+)
+@click.option("--threads", "-t", help="Number of worker processes computing edit distances", type=int, default=1)
+@click.option(
+    "--distance_cache",
+    help="sqlite file caching edit distances by sequence hash across runs. Use one file per concurrent job",
+    type=click.Path(),
+    default=None,
+)
 def main(
-        3d7_seq_fname,
-        sample_seq_dirname,
+        ref_seq_fname,
+        sample_sequences,
         hapg_matrix_fname,
-        output_dirname
+        output_dirname,
+        partition_mode,
+        threads,
+        distance_cache,
 ):
-    ref = get_seq(3d7_seq_fname)
+    """:param: sample_sequences: multi-FASTA of all sample sequences, with sample names as record IDs"""
+    ref = get_seq(ref_seq_fname)
     #ref = get_seq(f"../../../tmp_work/heatmaps/3D7_DBL_DBLMSP2.fa")
     #hapg_matrix="../../../tmp_work/heatmaps/DBL_DBLMSP2_hapgs.tsv"
 
-    groups=get_partition(hapg_matrix_fname)
+    clustering = get_clustering(hapg_matrix_fname, mode=partition_mode)
+    groups = clustering.groups
 
-    distances = dict()
     group1=set(groups[0])
     group2=set(groups[1])
-    for sname in groups[0] + groups[1]:
-        seq = get_seq(f"{sample_seq_dirname}/{sname}.fa")
-        distance = edlib.align(ref, seq)["editDistance"]
-        distances[sname] = distance
+    seqmap = load_sequences(sample_sequences)
+    snames = groups[0] + groups[1]
+    pair_distances = get_edit_distances(
+        [(ref, seqmap[sname]) for sname in snames],
+        threads=threads,
+        cache_path=distance_cache,
+    )
+    distances = {
+        sname: pair_distances[seq_hash_pair(ref, seqmap[sname])] for sname in snames
+    }
 
     form1_dists = [distances[sname] for sname in distances if sname in group1]
     form2_dists = [distances[sname] for sname in distances if sname in group2]
@@ -45,22 +76,21 @@ def main(
     print(f'Min 3D7 distance to form1 samples: {min_form1}')
     print(f'Min 3D7 distance to form2 samples: {min_form2}')
 
-    df = pd.read_csv(hapg_matrix_fname, sep="\t", index_col=0)
-    cl = linkage(df, method="average", metric="euclidean")
-    dn = dendrogram(cl)
+    sample_names = matrix_sample_names(hapg_matrix_fname)
+    cl = clustering.linkage
 
-    ## The dendrogram stores leaf labels as the index in the original data (df),
+    ## The dendrogram leaves are indices in the original data (the hapg matrix rows),
     ## left-to-right along it.
     ## Below goes from leaf label to sample name to distance, and if the distance is the closest to 3d7
     ## of the whole set, we give their corresponding dendrogram leaf a label saying so
     global_min = min(min_form1, min_form2)
     belongings = []
     original_positions = dict()
-    for i, sname in enumerate(df.index):
+    for i, sname in enumerate(sample_names):
         original_positions[sname] = i
-    leaf_labels = ["" for _ in range(len(df.index))]
-    for idx in dn["ivl"]: # traverses dendrogram leaves
-        sname = df.index[int(idx)]
+    leaf_labels = ["" for _ in range(len(sample_names))]
+    for idx in clustering.leaves: # traverses dendrogram leaves
+        sname = sample_names[int(idx)]
         assert sname in group1 or sname in group2
         if sname in group1:
             belongings.append("group1")
@@ -76,4 +106,7 @@ def main(
     # Note: dendrogram must look the same as that in seaborn heatmap, confirm this visually
     fig = plt.figure(figsize=(25, 12))
     dn = dendrogram(cl,labels=leaf_labels)
-    plt.savefig("{output_dirname}/dendrogram_ref_closest.pdf")
+    plt.savefig(f"{output_dirname}/dendrogram_ref_closest.pdf")
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,10 @@
-from typing import Dict, List
+from typing import List, Optional
 from pathlib import Path
-from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 import json
 
 import click
+import numpy as np
 import pandas as pd
 import seaborn as sns
 from matplotlib.colors import ListedColormap
@@ -13,92 +14,24 @@ from matplotlib.pyplot import gcf
 from jvcf_processing import (
     Region,
     click_get_region,
-    is_in_region,
-    first_idx_in_region_non_nested,
 )
 from common import (
-        get_partition, 
+        get_clustering,
+        PARTITION_MODES,
+        get_region_calls,
+        get_sparse_region_calls,
+        save_sparse_calls,
         country_to_colour, 
         nested_colour_mapping,
         marker_colours,
-        allelic_distinguishability,
-        allelic_specificity
+        group_index_vector,
+        get_dimorphism_metrics,
 )
 
-SiteIdx = int
-Hapgs = List[int]
-Hapg_Dict = Dict[SiteIdx, Hapgs]
-
 country_to_colour = {key: val.lower() for key, val in country_to_colour.items()}
+CBAR_POS = (1.04, 0.55, 0.05, 0.18)
 
 
-def get_hapgs_one_site(site_json, num_samples: int) -> Hapgs:
-    """
-    If a sample has a null genotype, the return haplogroup (hapg)
-    is -1 by convention.
-    """
-    result: Hapgs = [-1] * num_samples
-    for sample_idx, gt in enumerate(site_json["GT"]):
-        if gt[0] is not None:
-            sample_hapg = site_json["HAPG"][sample_idx][0]
-            result[sample_idx] = sample_hapg
-    return result
-
-
-def get_hapgs_all_sites(jvcf, region: Region) -> Hapg_Dict:
-    num_sites = len(jvcf["Sites"])
-    num_samples = len(jvcf["Samples"])
-    lvl1_sites = set(jvcf["Lvl1_Sites"])
-    result: Hapg_Dict = dict()
-
-    site_is_nested = list()
-
-    first_idx = first_idx_in_region_non_nested(jvcf, region)
-    cur_idx = first_idx
-    while is_in_region(jvcf["Sites"][cur_idx], region):
-        result[cur_idx - first_idx] = get_hapgs_one_site(
-            jvcf["Sites"][cur_idx], num_samples
-        )
-        if cur_idx in lvl1_sites:
-            site_is_nested.append(False)
-        else:
-            site_is_nested.append(True)
-
-        cur_idx += 1
-        if cur_idx == num_sites:
-            break
-
-    result["nested"] = site_is_nested
-    return result
-
-
-def get_dimorphism_calls(hapg_matrix_file, region, jvcf):
-    """ Partition genotype calls based on dimorphic form """
-    groups=get_partition(hapg_matrix_file)
-    sample_to_dimorphic = {sample_name: "form1" for sample_name in groups[0]}
-    sample_to_dimorphic.update({sample_name: "form2" for sample_name in groups[1]})
-    
-    first_idx = first_idx_in_region_non_nested(jvcf, region)
-        
-    dimorphism_calls = defaultdict(list)
-    cur_idx = first_idx
-    while is_in_region(jvcf["Sites"][cur_idx], region):
-        dimorphism_site_calls = defaultdict(list)
-        site = jvcf["Sites"][cur_idx]
-        gts = [gt[0] for gt in site["GT"]]
-        for sample_idx, gt in enumerate(gts):
-            sample_name = jvcf["Samples"][sample_idx]["Name"]
-            try:
-                form = sample_to_dimorphic[sample_name]
-                dimorphism_site_calls[form].append(gt)
-            except KeyError:
-                pass
-
-        for key,val in dimorphism_site_calls.items():
-            dimorphism_calls[key].append(val)
-        cur_idx += 1
-    return dimorphism_calls
-
 def get_country_colouring(metadata_fname, df):
     """Loads sample metadata and assigns country colouring"""
     metadata = pd.read_csv(metadata_fname,sep="\t")
@@ -158,6 +91,53 @@ def add_clustermap_legends(hmap, num_colours, countries = True):
     hmap.ax_heatmap.set(xlabel="Variant sites",ylabel="Samples")
 
 
+def plot_heatmap(
+    df: pd.DataFrame,
+    row_linkage: Optional[np.ndarray],
+    cell_colourmap,
+    col_colours,
+    country_colours: Optional[List],
+    output_fnames: List[str],
+):
+    """
+    Renders one haplogroup clustermap. Rows are only clustered if :param: row_linkage is given,
+    and are coloured by sample country if :param: country_colours is given,
+    by dimorphism markers otherwise.
+    """
+    hmap = sns.clustermap(
+        df,
+        row_cluster=row_linkage is not None,
+        row_linkage=row_linkage,
+        col_cluster=False,
+        yticklabels=False,
+        cmap=cell_colourmap,
+        col_colors=col_colours,
+        row_colors=country_colours,
+        cbar_kws={"label": "haplogroup"},
+        cbar_pos=CBAR_POS,
+    )
+    add_clustermap_legends(
+        hmap, len(cell_colourmap), countries=country_colours is not None
+    )
+    for output_fname in output_fnames:
+        hmap.savefig(output_fname)
+    plt.close(hmap.fig)
+
+
+def plot_marker_histogram(
+    dimorphism_sensitivity: List[float],
+    dimorphism_specificity: List[float],
+    output_fname: str,
+):
+    fig, axs = plt.subplots(1, 2, sharey=True, tight_layout=True)
+    axs[0].hist(dimorphism_sensitivity)
+    axs[0].set(title="Dimorphism sensitivity", xlabel="value",ylabel="Number of sites")
+    axs[1].hist(dimorphism_specificity)
+    axs[1].set(title="Dimorphism specificity", xlabel="value")
+    fig.savefig(output_fname)
+    plt.close(fig)
+
+
 @click.command()
 @click.option(
     "--region",
@@ -173,29 +153,61 @@ def add_clustermap_legends(hmap, num_colours, countries = True):
     required=False,
     type=click.Path(exists=True),
 )
+@click.option(
+    "--partition_mode",
+    help="How to cluster samples: 'auto' switches from exact to scalable clustering for large cohorts",
+    type=click.Choice(PARTITION_MODES),
+    default="auto",
+    show_default=True,
+)
+@click.option(
+    "--threads",
+    "-t",
+    help="Number of worker processes rendering the figures",
+    type=int,
+    default=1,
+    show_default=True,
+)
+@click.option(
+    "--sparse",
+    help="Extract and cluster sparse calls, saving the hapg matrix as .npz rather than .tsv",
+    is_flag=True,
+)
 @click.argument("jvcf_input", type=click.Path(exists=True))
 @click.argument("metadata_file", type=click.Path(exists=True))
 @click.argument("output_prefix", type=str)
 def main(
     region: Region,
     partition_file: click.Path,
+    partition_mode: str,
+    threads: int,
+    sparse: bool,
     jvcf_input: click.Path,
     metadata_file: click.Path,
     output_prefix: str,
 ):
-    CBAR_POS = (1.04, 0.55, 0.05, 0.18)
     output_prefix = Path(output_prefix)
 
     with open(jvcf_input) as fin:
         jvcf = json.load(fin)
 
 
-    hapgs_all_sites = get_hapgs_all_sites(jvcf, region)
-    site_is_nested = hapgs_all_sites.pop("nested")
     sample_names = [sample["Name"] for sample in jvcf["Samples"]]
-    df = pd.DataFrame(hapgs_all_sites, index=sample_names)
-    hapg_matrix_file = f"{output_prefix}_hapgs.tsv" 
-    df.to_csv(hapg_matrix_file, sep="\t")
+    if sparse:
+        region_calls = get_sparse_region_calls(jvcf, region)
+        hapg_matrix_file = f"{output_prefix}_hapgs.npz"
+        save_sparse_calls(hapg_matrix_file, region_calls.hapgs, sample_names)
+        # Only the figures need the dense matrix
+        df = pd.DataFrame(region_calls.hapgs.to_dense(), index=sample_names)
+    else:
+        region_calls = get_region_calls(jvcf, region)
+        df = pd.DataFrame(region_calls.hapgs, index=sample_names)
+        hapg_matrix_file = f"{output_prefix}_hapgs.tsv" 
+        df.to_csv(hapg_matrix_file, sep="\t")
+    # Cached: the scripts downstream reuse this clustering
+    clustering = get_clustering(hapg_matrix_file, mode=partition_mode)
+    groups = clustering.groups
+    print(f"Found partition of sizes: {len(groups[0])}, {len(groups[1])}")
 
     #### Get colourings ####
     ## Cell colouring: according to haplogroup
@@ -205,61 +217,15 @@ def main(
     country_colours = get_country_colouring(metadata_file, df)
 
     ## Column colouring: colour sites by whether they are nested
-    site_is_nested = pd.Series(site_is_nested)
+    site_is_nested = pd.Series(region_calls.nested)
     nested_colours = site_is_nested.map(nested_colour_mapping)
 
-    ## row-clustered clustermap
-    hmap_clustered = sns.clustermap(
-    df,
-    method="average",
-    metric="euclidean",
-    col_cluster=False,
-    yticklabels=False,
-    cmap=cell_colourmap,
-    col_colors=nested_colours,
-    row_colors=country_colours,
-    cbar_kws={"label":"haplogroup"},
-    cbar_pos=CBAR_POS,
-)
-    add_clustermap_legends(hmap_clustered, len(cell_colourmap))
-    hmap_clustered.savefig(f"{output_prefix}_hmap_clustered.pdf")
-    hmap_clustered.savefig(f"{output_prefix}_hmap_clustered.svg")
-
-    ## non-row-clustered clustermap, for comparison with above
-    hmap = sns.clustermap(
-    df,
-    method="average",
-    metric="euclidean",
-    col_cluster=False,
-    row_cluster=False,
-    yticklabels=False,
-    cmap=cell_colourmap,
-    col_colors=nested_colours,
-    row_colors=country_colours,
-    cbar_kws={"label":"haplogroup"},
-    cbar_pos=CBAR_POS,
-    )
-    add_clustermap_legends(hmap, len(cell_colourmap))
-    hmap.savefig(f"{output_prefix}_hmap.pdf")
-
-    ## clustermap with site-level dimorphism sensitivity and specificity ###
-    dimorphism_calls = get_dimorphism_calls(hapg_matrix_file, region, jvcf)
     ## Compute measures of per-site dimorphism
-    dimorphism_sensitivity = []
-    dimorphism_specificity = []
-    num_sites = len(list(dimorphism_calls.values())[0])
-    for site_idx in range(num_sites):
-        form1_gts = dimorphism_calls["form1"][site_idx]
-        form2_gts = dimorphism_calls["form2"][site_idx]
-        dimorphism_sensitivity.append(allelic_distinguishability(form1_gts,form2_gts))
-        dimorphism_specificity.append(allelic_specificity(form1_gts,form2_gts))
-
-    fig, axs = plt.subplots(1, 2, sharey=True, tight_layout=True)
-    axs[0].hist(dimorphism_sensitivity)
-    axs[0].set(title="Dimorphism sensitivity", xlabel="value",ylabel="Number of sites")
-    axs[1].hist(dimorphism_specificity)
-    axs[1].set(title="Dimorphism specificity", xlabel="value")
-    fig.savefig(f"{output_prefix}_marker_histogram.pdf")
+    dimorphism_metrics = get_dimorphism_metrics(
+        region_calls.gts, group_index_vector(sample_names, groups)
+    )
+    dimorphism_sensitivity = dimorphism_metrics.distinguishability.tolist()
+    dimorphism_specificity = dimorphism_metrics.specificity.tolist()
 
     dimo_sensi_colour = [marker_colours["High"] if val > 0.8 else marker_colours["Low"] for val in dimorphism_sensitivity]
     dimo_speci_colour = list()
@@ -269,19 +235,50 @@ def main(
         else:
             dimo_speci_colour.append(marker_colours["Low"])   
 
-    hmap_with_markers = sns.clustermap(
-        df,
-        method="average",
-        metric="euclidean",
-        col_cluster=False,
-        yticklabels=False,
-        cmap=cell_colourmap,
-        col_colors=[dimo_speci_colour, nested_colours, dimo_sensi_colour],
-        cbar_kws={"label":"haplogroup"},
-        cbar_pos=(1.04, 0.55, 0.05, 0.18)
-    )
-    add_clustermap_legends(hmap_with_markers, len(cell_colourmap), countries=False)
-    hmap_with_markers.savefig(f"{output_prefix}_hmap_with_markers.pdf")
+    #### Render figures ####
+    ## All clustered heatmaps share the single row linkage above
+    row_linkage = clustering.linkage
+    figures = [
+        (
+            plot_heatmap,
+            df,
+            row_linkage,
+            cell_colourmap,
+            nested_colours,
+            country_colours,
+            [f"{output_prefix}_hmap_clustered.pdf", f"{output_prefix}_hmap_clustered.svg"],
+        ),
+        ## non-row-clustered clustermap, for comparison with above
+        (
+            plot_heatmap,
+            df,
+            None,
+            cell_colourmap,
+            nested_colours,
+            country_colours,
+            [f"{output_prefix}_hmap.pdf"],
+        ),
+        ## clustermap with site-level dimorphism sensitivity and specificity ###
+        (
+            plot_heatmap,
+            df,
+            row_linkage,
+            cell_colourmap,
+            [dimo_speci_colour, nested_colours, dimo_sensi_colour],
+            None,
+            [f"{output_prefix}_hmap_with_markers.pdf"],
+        ),
+        (
+            plot_marker_histogram,
+            dimorphism_sensitivity,
+            dimorphism_specificity,
+            f"{output_prefix}_marker_histogram.pdf",
+        ),
+    ]
+    with ProcessPoolExecutor(max_workers=threads) as executor:
+        futures = [executor.submit(*figure) for figure in figures]
+        for future in futures:
+            future.result()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,332 @@
+"""
+Average-linkage clustering of the samples (rows) of hapg matrices, scaling to large cohorts:
+identical rows are clustered once and weighted by their multiplicity, distances are computed
+a chunk of rows at a time, and sparse matrices are never densified.
+"""
+
+from typing import List, Optional
+
+import numpy as np
+from scipy import sparse
+from scipy.cluster.hierarchy import linkage, to_tree, ClusterNode
+from scipy.spatial.distance import squareform
+
+NUM_REPRESENTATIVES = 2000
+DISTANCE_CHUNK_SIZE = 1024
+SEED = 42
+
+
+def sparse_row_keys(matrix: sparse.csr_matrix) -> List[bytes]:
+    matrix = matrix.tocsr()
+    matrix.sum_duplicates()
+    matrix.eliminate_zeros()
+    return [
+        matrix.indices[start:stop].tobytes() + b"|" + matrix.data[start:stop].tobytes()
+        for start, stop in zip(matrix.indptr[:-1], matrix.indptr[1:])
+    ]
+
+
+def dedup_rows(matrix):
+    """
+    Returns the unique rows of :param: matrix (dense or sparse), the row indices of the samples
+    each unique row stands for, and the multiplicity of each unique row.
+    """
+    if sparse.issparse(matrix):
+        keys = sparse_row_keys(matrix)
+        key_ids = dict()
+        inverse = np.array([key_ids.setdefault(key, len(key_ids)) for key in keys])
+        first_rows = np.unique(inverse, return_index=True)[1]
+        unique_rows = matrix.tocsr()[first_rows]
+        counts = np.bincount(inverse)
+    else:
+        unique_rows, inverse, counts = np.unique(
+            matrix, axis=0, return_inverse=True, return_counts=True
+        )
+    inverse = inverse.reshape(-1)
+    order = np.argsort(inverse, kind="stable")
+    members = np.split(order, np.cumsum(counts)[:-1])
+    return unique_rows, members, counts
+
+
+def one_hot_codes(matrix: np.ndarray) -> np.ndarray:
+    """One column per (site, haplogroup code) pair, so that Hamming matches are dot products"""
+    shifted = matrix.astype(np.int64) - matrix.min(axis=0)
+    offsets = np.concatenate([[0], np.cumsum(shifted.max(axis=0) + 1)[:-1]])
+    result = np.zeros(
+        (matrix.shape[0], int(shifted.max(axis=0).sum() + matrix.shape[1])),
+        dtype=np.float32,
+    )
+    rows = np.repeat(np.arange(matrix.shape[0]), matrix.shape[1])
+    result[rows, (shifted + offsets).reshape(-1)] = 1
+    return result
+
+
+def sparse_one_hot_codes(matrix: sparse.csr_matrix) -> sparse.csr_matrix:
+    """As `one_hot_codes`, for the non-zero entries of a sparse matrix only"""
+    coo = matrix.tocoo()
+    num_values = int(abs(coo.data).max()) * 2 + 1 if coo.nnz > 0 else 1
+    pair_keys = coo.col.astype(np.int64) * num_values + (coo.data + num_values // 2)
+    _, columns = np.unique(pair_keys, return_inverse=True)
+    return sparse.csr_matrix(
+        (np.ones(coo.nnz, dtype=np.float32), (coo.row, columns.reshape(-1))),
+        shape=(matrix.shape[0], int(columns.max()) + 1 if coo.nnz > 0 else 1),
+    )
+
+
+def sparse_chunked_distances(
+    rows: sparse.csr_matrix,
+    targets: sparse.csr_matrix,
+    metric: str,
+    chunk_size: int = DISTANCE_CHUNK_SIZE,
+) -> np.ndarray:
+    """
+    As `chunked_distances`, for sparse matrices of haplogroup codes: zero entries (haplogroup 0)
+    are never materialised.
+    """
+    num_rows, num_sites = rows.shape
+    result = np.empty((num_rows, targets.shape[0]), dtype=np.float32)
+    if metric == "hamming":
+        both = sparse.vstack([rows, targets]).tocsr()
+        both.eliminate_zeros()
+        encoded = sparse_one_hot_codes(both)
+        support = (both != 0).astype(np.float32)
+        rows_enc, targets_enc = encoded[:num_rows], encoded[num_rows:]
+        rows_support, targets_support = support[:num_rows], support[num_rows:]
+        targets_nnz = np.asarray(targets_support.sum(axis=1)).reshape(-1)
+        for start in range(0, num_rows, chunk_size):
+            stop = start + chunk_size
+            equal = (rows_enc[start:stop] @ targets_enc.T).toarray()
+            shared = (rows_support[start:stop] @ targets_support.T).toarray()
+            rows_nnz = np.asarray(rows_support[start:stop].sum(axis=1))
+            # Sites where either row is non-zero, minus those where both hold the same value
+            result[start:stop] = (rows_nnz + targets_nnz - shared - equal) / num_sites
+    elif metric == "euclidean":
+        rows_f, targets_f = rows.astype(np.float64), targets.astype(np.float64)
+        targets_sq = np.asarray(targets_f.multiply(targets_f).sum(axis=1)).reshape(-1)
+        for start in range(0, num_rows, chunk_size):
+            chunk = rows_f[start : start + chunk_size]
+            chunk_sq = np.asarray(chunk.multiply(chunk).sum(axis=1))
+            sq_dists = chunk_sq + targets_sq - 2 * (chunk @ targets_f.T).toarray()
+            result[start : start + chunk_size] = np.sqrt(np.maximum(sq_dists, 0))
+    else:
+        raise ValueError(f"Unsupported metric {metric}: use one of hamming, euclidean")
+    return result
+
+
+def chunked_distances(
+    rows: np.ndarray,
+    targets: np.ndarray,
+    metric: str,
+    chunk_size: int = DISTANCE_CHUNK_SIZE,
+) -> np.ndarray:
+    """
+    Dense float32 distance matrix between :param: rows and :param: targets (int haplogroup codes),
+    computed a chunk of rows at a time. Sparse inputs are supported.
+    Hamming distance is the proportion of sites that differ, as in scipy.
+    """
+    if sparse.issparse(rows):
+        return sparse_chunked_distances(rows, targets, metric, chunk_size)
+    num_sites = rows.shape[1]
+    result = np.empty((len(rows), len(targets)), dtype=np.float32)
+    if metric == "hamming":
+        encoded = one_hot_codes(np.concatenate([rows, targets]))
+        rows_enc, targets_enc = encoded[: len(rows)], encoded[len(rows) :]
+        for start in range(0, len(rows), chunk_size):
+            matches = rows_enc[start : start + chunk_size] @ targets_enc.T
+            result[start : start + chunk_size] = (num_sites - matches) / num_sites
+    elif metric == "euclidean":
+        rows_f, targets_f = rows.astype(np.float64), targets.astype(np.float64)
+        targets_sq = (targets_f**2).sum(axis=1)
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows_f[start : start + chunk_size]
+            sq_dists = (
+                (chunk**2).sum(axis=1)[:, None] + targets_sq - 2 * chunk @ targets_f.T
+            )
+            result[start : start + chunk_size] = np.sqrt(np.maximum(sq_dists, 0))
+    else:
+        raise ValueError(f"Unsupported metric {metric}: use one of hamming, euclidean")
+    return result
+
+
+def weighted_average_linkage(dists: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """
+    Average linkage (UPGMA) of points carrying :param: weights, by the nearest-neighbour chain algorithm.
+    A point of weight w behaves as w identical samples.
+    :param: dists is a square distance matrix; it is overwritten.
+    Returns a linkage matrix in scipy's format, over the points.
+    """
+    num_points = len(weights)
+    sizes = weights.astype(np.float64)
+    np.fill_diagonal(dists, np.inf)
+    merges = list()
+    chain = list()
+    remaining = list(range(num_points))
+    while len(merges) < num_points - 1:
+        if len(chain) == 0:
+            while np.isinf(sizes[remaining[-1]]):
+                remaining.pop()
+            chain.append(remaining[-1])
+        while True:
+            cur = chain[-1]
+            nearest = int(np.argmin(dists[cur]))
+            if len(chain) > 1 and dists[cur, chain[-2]] <= dists[cur, nearest]:
+                nearest = chain[-2]
+            if len(chain) > 1 and nearest == chain[-2]:
+                break
+            chain.append(nearest)
+        second, first = chain.pop(), chain.pop()
+        merges.append((first, second, float(dists[first, second])))
+        # Merged cluster takes the slot of 'first'; Lance-Williams update for average linkage
+        size_first, size_second = sizes[first], sizes[second]
+        merged = (size_first * dists[first] + size_second * dists[second]) / (
+            size_first + size_second
+        )
+        dists[first], dists[:, first] = merged, merged
+        dists[first, first] = np.inf
+        dists[second], dists[:, second] = np.inf, np.inf
+        sizes[first] += size_second
+        sizes[second] = np.inf  # Marks the slot as used up
+
+    # Label clusters as scipy does: merges in order of increasing distance
+    merges.sort(key=lambda merge: merge[2])
+    slot_cluster = np.arange(num_points)
+    cluster_sizes = list(weights.astype(np.float64)) + [0.0] * (num_points - 1)
+    result = np.zeros((num_points - 1, 4))
+    parents = list(range(num_points))
+
+    def find(slot):
+        while parents[slot] != slot:
+            parents[slot] = parents[parents[slot]]
+            slot = parents[slot]
+        return slot
+
+    for i, (first, second, dist) in enumerate(merges):
+        root_first, root_second = find(first), find(second)
+        id_first, id_second = slot_cluster[root_first], slot_cluster[root_second]
+        new_size = cluster_sizes[id_first] + cluster_sizes[id_second]
+        result[i] = [min(id_first, id_second), max(id_first, id_second), dist, new_size]
+        parents[root_second] = root_first
+        slot_cluster[root_first] = num_points + i
+        cluster_sizes[num_points + i] = new_size
+    return result
+
+
+def expand_linkage(
+    point_linkage: np.ndarray, members: List[np.ndarray], num_samples: int
+) -> np.ndarray:
+    """
+    Turns a linkage over weighted points into a linkage over all :param: num_samples samples,
+    by first joining the samples each point stands for (:param: members) at distance 0.
+    """
+    result = np.zeros((num_samples - 1, 4))
+    row = 0
+    point_ids = np.zeros(len(members), dtype=np.int64)
+    for point, point_members in enumerate(members):
+        cur_id, cur_size = int(point_members[0]), 1
+        for member in point_members[1:]:
+            result[row] = [min(cur_id, member), max(cur_id, member), 0.0, cur_size + 1]
+            cur_id, cur_size = num_samples + row, cur_size + 1
+            row += 1
+        point_ids[point] = cur_id
+
+    num_points = len(members)
+    merged_ids = dict()
+    for i, (first, second, dist, size) in enumerate(point_linkage):
+        ids = [
+            point_ids[int(cl)] if cl < num_points else merged_ids[int(cl)]
+            for cl in (first, second)
+        ]
+        result[row] = [min(ids), max(ids), dist, size]
+        merged_ids[num_points + i] = num_samples + row
+        row += 1
+    return result
+
+
+def scalable_linkage(
+    matrix,
+    metric: str,
+    approximate: bool = False,
+    num_representatives: int = NUM_REPRESENTATIVES,
+    seed: int = SEED,
+    max_points: Optional[int] = None,
+) -> np.ndarray:
+    """
+    Average linkage of the rows of :param: matrix (dense or sparse).
+    Identical rows are clustered once, weighted by their multiplicity, which gives an average linkage of all samples.
+    This takes a dense float32 distance matrix over the d distinct rows: O(d^2) memory rather than
+    scipy's O(n^2) over all n samples, which only helps if many samples share their row.
+    If :param: approximate, only a weighted sample of :param: num_representatives distinct rows is clustered,
+    and every other row joins its nearest representative.
+    :param: max_points: if there are more distinct rows than this, cluster as if :param: approximate,
+    with this many representatives, bounding memory use.
+    """
+    unique_rows, members, counts = dedup_rows(matrix)
+    if max_points is not None and unique_rows.shape[0] > max_points:
+        approximate, num_representatives = True, max_points
+    if approximate and unique_rows.shape[0] > num_representatives:
+        rng = np.random.default_rng(seed)
+        representatives = np.sort(
+            rng.choice(
+                unique_rows.shape[0],
+                size=num_representatives,
+                replace=False,
+                p=counts / counts.sum(),
+            )
+        )
+        nearest = np.empty(unique_rows.shape[0], dtype=np.int64)
+        for start in range(0, unique_rows.shape[0], DISTANCE_CHUNK_SIZE):
+            chunk = unique_rows[start : start + DISTANCE_CHUNK_SIZE]
+            dists = chunked_distances(chunk, unique_rows[representatives], metric)
+            nearest[start : start + DISTANCE_CHUNK_SIZE] = np.argmin(dists, axis=1)
+        nearest[representatives] = np.arange(num_representatives)
+        members = [
+            np.sort(
+                np.concatenate([members[row] for row in np.flatnonzero(nearest == rep)])
+            )
+            for rep in range(num_representatives)
+        ]
+        counts = np.array([len(rep_members) for rep_members in members])
+        unique_rows = unique_rows[representatives]
+
+    if unique_rows.shape[0] == 1:
+        point_linkage = np.zeros((0, 4))
+    else:
+        dists = chunked_distances(unique_rows, unique_rows, metric)
+        point_linkage = weighted_average_linkage(dists, counts)
+    return expand_linkage(point_linkage, members, matrix.shape[0])
+
+
+def partition_from_linkage(cl: np.ndarray, sample_names: List[str]) -> List[List[str]]:
+    """
+    Finds the dimorphic partition: the most basal split of the dendrogram
+    whose smallest side holds at least 10% of the samples below it.
+    """
+    root: ClusterNode = to_tree(cl)
+    cur_node = root
+    while True:
+        cl_size = cur_node.get_count()
+        child_sizes = [cur_node.left.get_count(), cur_node.right.get_count()]
+        if sum(child_sizes) == 2:
+            raise ValueError("No suitable partition of the cluster found")
+        if min(child_sizes) < (cl_size / 10):
+            largest = (
+                cur_node.left if child_sizes[0] > child_sizes[1] else cur_node.right
+            )
+            cur_node = largest
+        else:
+            groups = [cur_node.left.pre_order(), cur_node.right.pre_order()]
+            break
+    sample_groups = []
+    for group in groups:
+        sample_names_in_group = [sample_names[sample_idx] for sample_idx in group]
+        sample_groups.append(sample_names_in_group)
+    assert len(set(sample_groups[0]).intersection(sample_groups[1])) == 0
+    return sample_groups
+
+
+def exact_linkage(matrix, method: str, metric: str) -> np.ndarray:
+    if not sparse.issparse(matrix):
+        return linkage(matrix, method=method, metric=metric)
+    dists = chunked_distances(matrix, matrix, metric).astype(np.float64)
+    np.fill_diagonal(dists, 0)
+    return linkage(squareform(dists, checks=False), method=method)
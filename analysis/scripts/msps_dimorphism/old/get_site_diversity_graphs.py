@@ -1,26 +1,22 @@
-from typing import Union, List, Optional, Dict
+from typing import Union, List, Optional, Dict, NamedTuple, Tuple
 import sys
 from pathlib import Path
 import json
-from math import log
 from bisect import bisect_right
-from collections import defaultdict
 from itertools import combinations
 
 import click
+import numpy as np
 from igraph import Graph
 
 from jvcf_processing import (
     Region,
-    get_region,
+    click_get_region,
     is_in_region,
     first_idx_in_region,
 )
 
-
 Sample_Indices = List[int]
-FreqDict = Dict[str, float]
-Distrib = List[float]
 
 
 def get_sample_indices(jvcf, samples: List[str] = None) -> Sample_Indices:
@@ -35,40 +31,48 @@ def get_sample_indices(jvcf, samples: List[str] = None) -> Sample_Indices:
     return result
 
 
-def wire(cur_idx: int, next_idx: int, nesting_lvl: int, jvcf, result: Graph) -> None:
-    """
-    Add vertices and edges to the :param: result graph using the nesting structure of :param: jvcf.
-    Is a recursive function, calling itself to wire child(=nested) sites whenever they are encountered.
-    """
-    if not result.vs["populated"][cur_idx]:
-        result.vs[cur_idx]["POS"] = jvcf["Sites"][cur_idx]["POS"]
-        result.vs[cur_idx]["nesting_lvl"] = nesting_lvl
-        result.vs[cur_idx]["populated"] = True
+Edge = Tuple[int, int]
 
-    if next_idx <= 0:
-        return
 
+def wire(
+    cur_idx: int, next_idx: int, nesting_lvl: int, jvcf, nesting_lvls: Dict[int, int]
+) -> List[Edge]:
+    """
+    Collects the edges below and after site :param: cur_idx using the nesting structure of :param: jvcf,
+    and records the nesting level of each visited site in :param: nesting_lvls.
+    Nested sites are wired through an explicit stack, in the order a depth-first recursion would visit them,
+    so deep nesting does not hit Python's recursion limit.
+    """
     child_map = jvcf["Child_Map"]
-    if str(cur_idx) not in child_map:
-        result.add_edges([(cur_idx, next_idx)])
-    else:
-        children = jvcf["Child_Map"][str(cur_idx)]
-        for child_indices in children.values():
+    edges: List[Edge] = list()
+    # Entries are either ("edge", source, target) or ("wire", site, next site, nesting level)
+    to_visit = [("wire", cur_idx, next_idx, nesting_lvl)]
+    while len(to_visit) > 0:
+        entry = to_visit.pop()
+        if entry[0] == "edge":
+            edges.append((entry[1], entry[2]))
+            continue
+        _, cur_idx, next_idx, nesting_lvl = entry
+        nesting_lvls.setdefault(cur_idx, nesting_lvl)
+        if next_idx <= 0:
+            continue
+
+        if str(cur_idx) not in child_map:
+            edges.append((cur_idx, next_idx))
+            continue
+        operations = list()
+        for child_indices in child_map[str(cur_idx)].values():
             # it is vital to sort the child indices, as they are numbered according to their POS (lowest first), and we want graph topology to reflect POS
             sorted_child_indices = sorted(child_indices)
+            operations.append(("edge", cur_idx, sorted_child_indices[0]))
             for array_idx, child_idx in enumerate(sorted_child_indices):
-                if array_idx == 0:
-                    result.add_edges([(cur_idx, child_idx)])
-                if array_idx < len(child_indices) - 1:
-                    wire(
-                        child_idx,
-                        sorted_child_indices[array_idx + 1],
-                        nesting_lvl + 1,
-                        jvcf,
-                        result,
-                    )
+                if array_idx < len(sorted_child_indices) - 1:
+                    following_idx = sorted_child_indices[array_idx + 1]
                 else:
-                    wire(child_idx, next_idx, nesting_lvl + 1, jvcf, result)
+                    following_idx = next_idx
+                operations.append(("wire", child_idx, following_idx, nesting_lvl + 1))
+        to_visit.extend(reversed(operations))
+    return edges
 
 
 def get_next_greater(idx: int, idx_list: List[int], max_val: int) -> int:
@@ -79,40 +83,16 @@ def get_next_greater(idx: int, idx_list: List[int], max_val: int) -> int:
         return idx_list[insertion_point]
 
 
-def new_site_graph(num_sites) -> Graph:
-    result = Graph(directed=True)
-    # Reserve vertices
-    result.add_vertices(num_sites)
-    result.vs["POS"] = [0] * num_sites
-    result.vs["populated"] = [False] * num_sites
-    result.vs["nesting_lvl"] = [0] * num_sites
-
-    return result
-
-
-def site_graph_copy(other: Graph) -> Graph:
-    result = new_site_graph(len(other.vs))
-    for attr in result.vs[0].attributes():
-        result.vs[attr] = other.vs[attr]
-    for edge in other.es:
-        result.add_edges([(edge.source, edge.target)])
-    result["idxs_in_prg"] = other["idxs_in_prg"]
-    result.vs["idx_in_prg"] = other.vs[
-        "idx_in_prg"
-    ]  # To keep info on absolute site index
-    return result
-
-
 def make_site_graph(jvcf, region: Region) -> Graph:
     """
+    Builds the graph of the sites in :param: region in one call, with vertices only for those sites,
+    ordered by site index.
     Assumptions:
         - There is at least one site in the jvcf (by definition, that site must be a lvl1 site)
     """
     num_sites = len(jvcf["Sites"])
     nesting_lvl = 1
 
-    result = new_site_graph(num_sites)
-
     lvl1_indices: List[int] = list()
     if jvcf["Lvl1_Sites"] == "all":
         lvl1_indices = list(range(num_sites))
@@ -125,31 +105,42 @@ def make_site_graph(jvcf, region: Region) -> Graph:
     if next_idx == num_sites:
         next_idx = -1
 
+    nesting_lvls: Dict[int, int] = dict()
+    edges: List[Edge] = list()
     while True:
-        wire(cur_idx, next_idx, nesting_lvl, jvcf, result)
+        edges.extend(wire(cur_idx, next_idx, nesting_lvl, jvcf, nesting_lvls))
+        if next_idx < 0:
+            break
         cur_idx = next_idx
         next_idx = get_next_greater(cur_idx, lvl1_indices, num_sites)
         if next_idx == num_sites:
             # Mark the last site as processed
-            wire(cur_idx, -1, nesting_lvl, jvcf, result)
+            wire(cur_idx, -1, nesting_lvl, jvcf, nesting_lvls)
             break
         if not is_in_region(jvcf["Sites"][cur_idx], region):
             break
 
-    # Clear out non-populated vertices
-    to_delete = list()
-    to_keep = list()
-    for idx, node in enumerate(result.vs):
-        if not node["populated"]:
-            to_delete.append(idx)
-        else:
-            to_keep.append(idx)
-    result.delete_vertices(to_delete)
-    result.vs["idx_in_prg"] = to_keep
-
-    result["idxs_in_prg"] = set(to_keep)
-
-    return result
+    # Only the visited sites become vertices; edges to other sites are dropped
+    to_keep = sorted(nesting_lvls)
+    vertex_ids = {site_idx: vertex_id for vertex_id, site_idx in enumerate(to_keep)}
+    kept_edges = [
+        (vertex_ids[source], vertex_ids[target])
+        for source, target in edges
+        if source in vertex_ids and target in vertex_ids
+    ]
+    return Graph(
+        n=len(to_keep),
+        edges=kept_edges,
+        directed=True,
+        graph_attrs={"idxs_in_prg": set(to_keep)},
+        vertex_attrs={
+            "POS": [jvcf["Sites"][site_idx]["POS"] for site_idx in to_keep],
+            "populated": [True] * len(to_keep),
+            "nesting_lvl": [nesting_lvls[site_idx] for site_idx in to_keep],
+            # To keep info on absolute site index
+            "idx_in_prg": to_keep,
+        },
+    )
 
 
 diversity_metrics = {
@@ -159,63 +150,6 @@ diversity_metrics = {
     "num_ambig": 0,
 }
 
-
-def heterozygosity(freqs: Dict[str, float]) -> float:
-    """Computes heterozygosity, prob that two randomly sampled individuals differ at a site"""
-
-    diversity = 1.0 if len(freqs) > 0 else 0.0
-    for freq in freqs.values():
-        diversity -= freq * freq
-    if diversity == 0:
-        diversity = 0.001  # To force use of float by cytoscape
-    return diversity
-
-
-def counts_to_freqs(counts_dict) -> Dict:
-    total_counts = sum(counts_dict.values())
-    freqs = {key: count / total_counts for key, count in counts_dict.items()}
-    return freqs
-
-
-def get_site_freqs(site_json, sample_indices: Sample_Indices):
-    """Computes hapg and gt frequencies in a site, and also number of AMBIG sites, for a given set of samples"""
-    gt_counts, hapg_counts = defaultdict(int), defaultdict(int)
-    num_ambigs = 0
-    for idx in sample_indices:
-        gts, hapgs = site_json["GT"][idx], site_json["HAPG"][idx]
-        assert len(gts) == 1  # Assumes haploid for now
-        if "AMBIG" in site_json["FT"][idx]:
-            num_ambigs += 1
-            continue
-        if gts[0] is not None:
-            gt_counts[gts[0]] += 1
-            if len(hapgs) > 0 and hapgs[0] is not None:
-                hapg_counts[hapgs[0]] += 1
-    return (
-        counts_to_freqs(gt_counts),
-        counts_to_freqs(hapg_counts),
-        num_ambigs,
-        sum(gt_counts.values()),
-    )
-
-
-def compute_diversity(site_json, *partitions: List[Optional[Sample_Indices]]) -> Dict:
-    assert len(partitions) == 1
-    result = diversity_metrics.copy()
-    num_samples = len(site_json["GT"])
-    sample_indices = partitions[0]
-    if sample_indices is None:
-        sample_indices = list(range(num_samples))
-
-    gt_freqs, hapg_freqs, num_ambigs, counts = get_site_freqs(site_json, sample_indices)
-    result["gt_heterozygosity"] = heterozygosity(gt_freqs)
-    result["hapg_heterozygosity"] = heterozygosity(hapg_freqs)
-    result["num_ambig"] = num_ambigs
-    result["gt_non_null_counts"] = counts
-
-    return result
-
-
 divergence_metrics = {
     "gtJensen_Shannon": 0,
     "hapgJensen_Shannon": 0,
@@ -227,85 +161,172 @@ divergence_metrics = {
     "p2_hapg_distrib": "",
 }
 
-
-def normalise_distrib(freqs: FreqDict, all_keys: List[str]) -> Distrib:
-    """Converts :param: freqs into a distribution with one entry per entry in :param: all_keys"""
-    result = [0] * len(all_keys)
-    for idx, key in enumerate(all_keys):
-        result[idx] = freqs.get(key, 0)
-    return result
+# Zero-valued metrics are output as this, to force use of float by cytoscape
+MIN_METRIC = 0.001
 
 
-def Kullback_Leibler(d1: Distrib, d2: Distrib) -> float:
-    assert len(d1) == len(d2)
-    result = 0
-    for v1, v2 in zip(d1, d2):
-        if v1 != 0 and v2 != 0:
-            result += v1 * log(v1 / v2, 2)
-    return result
+class PartitionCounts(NamedTuple):
+    """Call counts at each site (graph vertex), for each sample partition"""
 
+    gt_counts: np.ndarray  # partitions x sites x genotypes
+    hapg_counts: np.ndarray  # partitions x sites x haplogroups
+    ambig_counts: np.ndarray  # partitions x sites
 
-def Jensen_Shannon(freqs_1: FreqDict, freqs_2: FreqDict) -> float:
-    all_keys = set(freqs_1.keys()).union(set(freqs_2.keys()))
-    all_keys = sorted(list(all_keys))  # Make sure the gt/hapg are output in order
-    normed_1 = normalise_distrib(freqs_1, all_keys)
-    normed_2 = normalise_distrib(freqs_2, all_keys)
 
-    middle_distrib = [(normed_1[i] + normed_2[i]) / 2 for i in range(len(all_keys))]
-    jensen_shannon = (
-        Kullback_Leibler(normed_1, middle_distrib)
-        + Kullback_Leibler(normed_2, middle_distrib)
-    ) / 2
-    if jensen_shannon == 0:
-        jensen_shannon = 0.001  # Force float for cytoscape
-    return (jensen_shannon, normed_1, normed_2)
+def get_site_calls(site_json):
+    """
+    GT and HAPG calls of all samples in a site, as arrays with -1 for null calls.
+    Calls filtered as AMBIG are set to null, and flagged in the returned AMBIG mask.
+    """
+    num_samples = len(site_json["GT"])
+    gts = np.full(num_samples, -1, dtype=int)
+    hapgs = np.full(num_samples, -1, dtype=int)
+    is_ambig = np.zeros(num_samples, dtype=bool)
+    for idx, (sample_gts, sample_hapgs, ft) in enumerate(
+        zip(site_json["GT"], site_json["HAPG"], site_json["FT"])
+    ):
+        assert len(sample_gts) == 1  # Assumes haploid for now
+        if "AMBIG" in ft:
+            is_ambig[idx] = True
+            continue
+        if sample_gts[0] is not None:
+            gts[idx] = sample_gts[0]
+            if len(sample_hapgs) > 0 and sample_hapgs[0] is not None:
+                hapgs[idx] = sample_hapgs[0]
+    return gts, hapgs, is_ambig
 
 
-def compute_Jensen_Shannon(site_json, *partitions: List[Sample_Indices]) -> Dict:
-    assert len(partitions) == 2
-    result = divergence_metrics.copy()
-    gtfreqs_1, hapgfreqs_1, ambig_counts1, gt_counts1 = get_site_freqs(
-        site_json, partitions[0]
-    )
-    gtfreqs_2, hapgfreqs_2, ambig_counts2, gt_counts2 = get_site_freqs(
-        site_json, partitions[1]
+def stack_counts(counts: List[List[np.ndarray]]) -> np.ndarray:
+    """Pads per-partition, per-site count vectors to a common length"""
+    num_values = max(
+        len(site_counts) for partition in counts for site_counts in partition
     )
+    result = np.zeros((len(counts), len(counts[0]), num_values), dtype=int)
+    for partition_idx, partition in enumerate(counts):
+        for site_idx, site_counts in enumerate(partition):
+            result[partition_idx, site_idx, : len(site_counts)] = site_counts
+    return result
+
 
-    result["gtJensen_Shannon"], _, _ = Jensen_Shannon(gtfreqs_1, gtfreqs_2)
-    (result["hapgJensen_Shannon"], normed_1, normed_2,) = Jensen_Shannon(
-        hapgfreqs_1, hapgfreqs_2
+def get_partition_counts(
+    jvcf, site_indices: List[int], partitions: List[Sample_Indices]
+) -> PartitionCounts:
+    """
+    Counts the GT, HAPG and AMBIG calls of each partition in a single scan of the sites at :param: site_indices
+    """
+    partition_arrays = [np.array(partition, dtype=int) for partition in partitions]
+    gt_counts = [list() for _ in partitions]
+    hapg_counts = [list() for _ in partitions]
+    ambig_counts = np.zeros((len(partitions), len(site_indices)), dtype=int)
+    for col, site_idx in enumerate(site_indices):
+        gts, hapgs, is_ambig = get_site_calls(jvcf["Sites"][site_idx])
+        for partition_idx, sample_indices in enumerate(partition_arrays):
+            partition_gts, partition_hapgs = gts[sample_indices], hapgs[sample_indices]
+            gt_counts[partition_idx].append(
+                np.bincount(partition_gts[partition_gts >= 0], minlength=1)
+            )
+            hapg_counts[partition_idx].append(
+                np.bincount(partition_hapgs[partition_hapgs >= 0], minlength=1)
+            )
+            ambig_counts[partition_idx, col] = is_ambig[sample_indices].sum()
+    return PartitionCounts(
+        stack_counts(gt_counts), stack_counts(hapg_counts), ambig_counts
     )
 
-    result["p1_hapg_distrib"] = str(normed_1)
-    result["p2_hapg_distrib"] = str(normed_2)
 
-    result["p1_gt_non_null_counts"] = gt_counts1
-    result["p2_gt_non_null_counts"] = gt_counts2
+def to_freqs(counts: np.ndarray) -> np.ndarray:
+    totals = counts.sum(axis=-1, keepdims=True)
+    return counts / np.maximum(totals, 1)
 
-    result["p1_ambig_counts"] = ambig_counts1
-    result["p2_ambig_counts"] = ambig_counts2
 
-    return result
+def heterozygosity(counts: np.ndarray) -> np.ndarray:
+    """Prob that two randomly sampled individuals differ at a site, for each site (row) of :param: counts"""
+    diversity = 1.0 - (to_freqs(counts) ** 2).sum(axis=-1)
+    diversity[counts.sum(axis=-1) == 0] = 0.0
+    diversity[diversity == 0] = MIN_METRIC
+    return diversity
 
 
-def annotate_vertices(
-    graph: Graph,
-    jvcf,
-    partitions: List[Sample_Indices],
-    attr_names: List[str],
-    annotation_function,
-):
-    all_sites = jvcf["Sites"]
-    new_attributes = {attr_name: list() for attr_name in attr_names}
-    for idx, site_json in enumerate(all_sites):
-        if idx not in graph["idxs_in_prg"]:
-            continue
-        result = annotation_function(site_json, *partitions)
-        for attr_name, value in result.items():
-            new_attributes[attr_name].append(value)
+def Kullback_Leibler(d1: np.ndarray, d2: np.ndarray) -> np.ndarray:
+    used = (d1 != 0) & (d2 != 0)
+    terms = np.zeros_like(d1)
+    terms[used] = d1[used] * np.log2(d1[used] / d2[used])
+    return terms.sum(axis=-1)
+
+
+def Jensen_Shannon(counts_1: np.ndarray, counts_2: np.ndarray) -> np.ndarray:
+    """Jensen-Shannon divergence between the call distributions at each site (row)"""
+    freqs_1, freqs_2 = to_freqs(counts_1), to_freqs(counts_2)
+    middle_distrib = (freqs_1 + freqs_2) / 2
+    jensen_shannon = (
+        Kullback_Leibler(freqs_1, middle_distrib)
+        + Kullback_Leibler(freqs_2, middle_distrib)
+    ) / 2
+    jensen_shannon[jensen_shannon == 0] = MIN_METRIC
+    return jensen_shannon
+
+
+def serialise_distribs(counts_1: np.ndarray, counts_2: np.ndarray) -> List[str]:
+    """
+    The frequency distribution of :param: counts_1 at each site, over the values called in either set of counts,
+    in increasing order
+    """
+    result = list()
+    for site_counts_1, site_counts_2 in zip(counts_1, counts_2):
+        total = int(site_counts_1.sum())
+        called = np.flatnonzero(site_counts_1 + site_counts_2)
+        distrib = [
+            int(site_counts_1[val]) / total if site_counts_1[val] > 0 else 0
+            for val in called
+        ]
+        result.append(str(distrib))
+    return result
 
-    for attr_name, attr_values in new_attributes.items():
+
+def diversity_attributes(
+    counts: PartitionCounts, partition_idx: int
+) -> Dict[str, List]:
+    gt_counts = counts.gt_counts[partition_idx]
+    hapg_counts = counts.hapg_counts[partition_idx]
+    return {
+        "gt_non_null_counts": gt_counts.sum(axis=-1).tolist(),
+        "gt_heterozygosity": heterozygosity(gt_counts).tolist(),
+        "hapg_heterozygosity": heterozygosity(hapg_counts).tolist(),
+        "num_ambig": counts.ambig_counts[partition_idx].tolist(),
+    }
+
+
+def divergence_attributes(
+    counts: PartitionCounts, partition_idx1: int, partition_idx2: int
+) -> Dict[str, List]:
+    gt_counts1 = counts.gt_counts[partition_idx1]
+    gt_counts2 = counts.gt_counts[partition_idx2]
+    hapg_counts1 = counts.hapg_counts[partition_idx1]
+    hapg_counts2 = counts.hapg_counts[partition_idx2]
+    return {
+        "gtJensen_Shannon": Jensen_Shannon(gt_counts1, gt_counts2).tolist(),
+        "hapgJensen_Shannon": Jensen_Shannon(hapg_counts1, hapg_counts2).tolist(),
+        "p1_gt_non_null_counts": gt_counts1.sum(axis=-1).tolist(),
+        "p2_gt_non_null_counts": gt_counts2.sum(axis=-1).tolist(),
+        "p1_ambig_counts": counts.ambig_counts[partition_idx1].tolist(),
+        "p2_ambig_counts": counts.ambig_counts[partition_idx2].tolist(),
+        "p1_hapg_distrib": serialise_distribs(hapg_counts1, hapg_counts2),
+        "p2_hapg_distrib": serialise_distribs(hapg_counts2, hapg_counts1),
+    }
+
+
+def write_annotated_graph(
+    graph: Graph, attributes: Dict[str, List], output_fname: str
+) -> None:
+    """
+    Writes :param: graph with vertex :param: attributes added.
+    The attributes are removed after writing, so that all partitions share one graph topology.
+    """
+    for attr_name, attr_values in attributes.items():
         graph.vs[attr_name] = attr_values
+    graph.write_gml(output_fname)
+    for attr_name in attributes:
+        del graph.vs[attr_name]
 
 
 @click.command()
@@ -314,7 +335,7 @@ def annotate_vertices(
     "-r",
     help="In the form 'SEG:start-end', as in samtools/bcftools",
     default=None,
-    callback=get_region,
+    callback=click_get_region,
 )
 @click.option(
     "--partition_file",
@@ -339,43 +360,32 @@ def main(
     graph = make_site_graph(jvcf, region)
 
     if partition_file is None:
-        graph_copy = site_graph_copy(graph)
-        annotate_vertices(
-            graph_copy, jvcf, [None], list(diversity_metrics.keys()), compute_diversity
-        )
-        graph_copy.write_gml(f"{output_prefix}_all_samples.gml")
+        partitions = [get_sample_indices(jvcf)]
     else:
         with open(partition_file) as fin:
-            partitions = [line.rstrip().split("\t") for line in fin.readlines()]
-            # Diversity metrics for each partition
-            for idx, partition in enumerate(partitions):
-                graph_copy = site_graph_copy(graph)
-                sample_indices = get_sample_indices(jvcf, partition)
-                annotate_vertices(
-                    graph_copy,
-                    jvcf,
-                    [sample_indices],
-                    list(diversity_metrics.keys()),
-                    compute_diversity,
-                )
-                graph_copy.write_gml(f"{output_prefix}_partition_{idx+1}.gml")
-
-            # Divergence metrics for each pair of partitions
-            for combination in combinations(range(len(partitions)), 2):
-                partition1 = get_sample_indices(jvcf, partitions[combination[0]])
-                partition2 = get_sample_indices(jvcf, partitions[combination[1]])
-
-                graph_copy = site_graph_copy(graph)
-                annotate_vertices(
-                    graph_copy,
-                    jvcf,
-                    [partition1, partition2],
-                    list(divergence_metrics.keys()),
-                    compute_Jensen_Shannon,
-                )
-
-                combin_name = f"partition_{combination[0]+1}_vs_{combination[1]+1}.gml"
-                graph_copy.write_gml(f"{output_prefix}_{combin_name}")
+            partitions = [
+                get_sample_indices(jvcf, line.rstrip().split("\t"))
+                for line in fin.readlines()
+            ]
+    # A single scan of the sites, whatever the number of partitions
+    counts = get_partition_counts(jvcf, graph.vs["idx_in_prg"], partitions)
+
+    if partition_file is None:
+        attributes = diversity_attributes(counts, 0)
+        write_annotated_graph(graph, attributes, f"{output_prefix}_all_samples.gml")
+    else:
+        # Diversity metrics for each partition
+        for idx in range(len(partitions)):
+            attributes = diversity_attributes(counts, idx)
+            write_annotated_graph(
+                graph, attributes, f"{output_prefix}_partition_{idx+1}.gml"
+            )
+
+        # Divergence metrics for each pair of partitions
+        for combination in combinations(range(len(partitions)), 2):
+            attributes = divergence_attributes(counts, *combination)
+            combin_name = f"partition_{combination[0]+1}_vs_{combination[1]+1}.gml"
+            write_annotated_graph(graph, attributes, f"{output_prefix}_{combin_name}")
 
 
 if __name__ == "__main__":
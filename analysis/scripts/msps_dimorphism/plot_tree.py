@@ -6,7 +6,12 @@ from ete3 import Tree, TreeStyle, RectFace, NodeStyle, TreeNode, add_face_to_nod
 import click
 import pandas as pd
 
-from common import get_partition, country_to_colour, cluster_dimorphic_to_colour
+from common import (
+    get_partition,
+    country_to_colour,
+    cluster_dimorphic_to_colour,
+    PARTITION_MODES,
+)
 
 sample_to_country = dict()
 phylo_colouring = dict()
@@ -110,11 +115,19 @@ def get_treestyle():
 
 
 @click.command()
+@click.option(
+    "--partition_mode",
+    help="How to cluster samples: 'auto' switches from exact to scalable clustering for large cohorts",
+    type=click.Choice(PARTITION_MODES),
+    default="auto",
+    show_default=True,
+)
 @click.argument("hapg_matrix_file", type=click.Path(exists=True))
 @click.argument("tree_file", type=click.Path(exists=True))
 @click.argument("sample_metadata_file", type=click.Path(exists=True))
 @click.argument("output_prefix", type=str)
 def main(
+    partition_mode: str,
     hapg_matrix_file: click.Path,
     tree_file: click.Path,
     sample_metadata_file: click.Path,
@@ -124,7 +137,7 @@ def main(
 
     sample_names = t.get_leaf_names()
 
-    groups = get_partition(hapg_matrix_file)
+    groups = get_partition(hapg_matrix_file, mode=partition_mode)
     # Below make sure we have the same set of samples; only works if partition includes all samples
     # assert set(groups[0]).union(set(groups[1])) == set(sample_names)
 
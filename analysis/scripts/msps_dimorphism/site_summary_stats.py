@@ -0,0 +1,184 @@
+"""
+Per-site summary statistics of a combined jVCF, computed in one pass over each site's calls.
+The output table replaces that of count_ambigs.py: its first five columns are the same,
+so analyse_ambigs/make_graphs.sh can consume it.
+"""
+
+from typing import Dict, List
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+import json
+
+import click
+import pandas as pd
+
+from jvcf_processing import (
+    JVCF,
+    Region,
+    click_get_region,
+    is_in_region,
+    site_nesting_depths,
+)
+
+DEFAULT_CHUNK_SIZE = 10000
+# Set in the main process before forking workers, so the sites are not pickled
+JVCF_DATA: JVCF = None
+NESTING_DEPTHS: List[int] = None
+LVL1_SITES = set()
+
+summary_columns = [
+    "site_idx",
+    "alleles",
+    "num_ambigs",
+    "ambig_alleles",
+    "lvl1_site",
+    "SEG",
+    "POS",
+    "nesting_depth",
+    "num_null",
+    "allele_freqs",
+    "hapg_freqs",
+    "gt_heterozygosity",
+    "hapg_heterozygosity",
+]
+
+
+def heterozygosity(counts: Counter) -> float:
+    """Probability that two randomly sampled calls differ, NaN if there are no calls"""
+    total = sum(counts.values())
+    if total == 0:
+        return float("nan")
+    return 1 - sum((count / total) ** 2 for count in counts.values())
+
+
+def serialise_freqs(counts: Counter, num_values: int) -> str:
+    """Frequency of each value in 0..num_values-1, comma-separated"""
+    total = sum(counts.values())
+    if total == 0:
+        return "NA"
+    return ",".join(f"{counts[value] / total:.4g}" for value in range(num_values))
+
+
+def summarise_site(site_idx: int, site_json: Dict) -> Dict:
+    """
+    Ambiguous (AMBIG) calls are counted, but excluded from the allele and haplogroup frequencies,
+    as in the site diversity graphs.
+    """
+    alleles = site_json["ALS"]
+    num_ambigs, num_null = 0, 0
+    ambig_alleles = set()
+    gt_counts, hapg_counts = Counter(), Counter()
+    for gts, hapgs, ft in zip(site_json["GT"], site_json["HAPG"], site_json["FT"]):
+        gt = gts[0]
+        if gt is None:
+            num_null += 1
+        if "AMBIG" in ft:
+            num_ambigs += 1
+            if gt is not None:
+                ambig_alleles.add(alleles[gt])
+            continue
+        if gt is not None:
+            gt_counts[gt] += 1
+            if len(hapgs) > 0 and hapgs[0] is not None:
+                hapg_counts[hapgs[0]] += 1
+    if len(ambig_alleles) == 0:
+        ambig_alleles.add(" ")
+    num_hapgs = max(hapg_counts, default=-1) + 1
+    return {
+        "site_idx": site_idx,
+        "alleles": ",".join(alleles),
+        "num_ambigs": num_ambigs,
+        "ambig_alleles": ",".join(sorted(ambig_alleles)),
+        "lvl1_site": 1 if site_idx in LVL1_SITES else 0,
+        "SEG": site_json["SEG"],
+        "POS": site_json["POS"],
+        "nesting_depth": NESTING_DEPTHS[site_idx],
+        "num_null": num_null,
+        "allele_freqs": serialise_freqs(gt_counts, len(alleles)),
+        "hapg_freqs": serialise_freqs(hapg_counts, num_hapgs),
+        "gt_heterozygosity": heterozygosity(gt_counts),
+        "hapg_heterozygosity": heterozygosity(hapg_counts),
+    }
+
+
+def summarise_sites(site_indices: List[int]) -> List[Dict]:
+    sites = JVCF_DATA["Sites"]
+    return [summarise_site(site_idx, sites[site_idx]) for site_idx in site_indices]
+
+
+def set_jvcf(jvcf: JVCF) -> None:
+    global JVCF_DATA, NESTING_DEPTHS, LVL1_SITES
+    JVCF_DATA = jvcf
+    NESTING_DEPTHS = site_nesting_depths(jvcf)
+    LVL1_SITES = set(jvcf["Lvl1_Sites"])
+
+
+def get_site_summaries(
+    jvcf: JVCF, region: Region, threads: int, chunk_size: int
+) -> pd.DataFrame:
+    set_jvcf(jvcf)
+    site_indices = [
+        idx for idx, site in enumerate(jvcf["Sites"]) if is_in_region(site, region)
+    ]
+    chunks = [
+        site_indices[start : start + chunk_size]
+        for start in range(0, len(site_indices), chunk_size)
+    ]
+    if threads > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(
+            max_workers=threads, mp_context=get_context("fork")
+        ) as executor:
+            summaries = list(executor.map(summarise_sites, chunks))
+    else:
+        summaries = list(map(summarise_sites, chunks))
+    rows = [row for chunk_summaries in summaries for row in chunk_summaries]
+    return pd.DataFrame(rows, columns=summary_columns)
+
+
+@click.command()
+@click.option(
+    "--region",
+    "-r",
+    help="In the form 'SEG:start-end', as in samtools/bcftools",
+    default=None,
+    callback=click_get_region,
+)
+@click.option(
+    "--threads",
+    "-t",
+    help="Number of worker processes, each summarising chunks of consecutive sites",
+    type=int,
+    default=1,
+    show_default=True,
+)
+@click.option(
+    "--chunk_size",
+    help="Number of sites per worker task",
+    type=int,
+    default=DEFAULT_CHUNK_SIZE,
+    show_default=True,
+)
+@click.argument("jvcf_input", type=click.Path(exists=True))
+@click.argument("output_fname", type=str)
+def main(
+    region: Region,
+    threads: int,
+    chunk_size: int,
+    jvcf_input: click.Path,
+    output_fname: str,
+):
+    """Writes a tab-separated table to :param: output_fname, gzipped if it ends in '.gz'"""
+    with open(jvcf_input) as fin:
+        jvcf = json.load(fin)
+    summaries = get_site_summaries(jvcf, region, threads, chunk_size)
+    summaries.to_csv(
+        output_fname, sep="\t", index=False, na_rep="NA", float_format="%.4g"
+    )
+    num_skipped = len(jvcf["Sites"]) - len(summaries)
+    if num_skipped > 0:
+        print(f"Skipped {num_skipped} out of {len(jvcf['Sites'])} sites not in region")
+
+
+if __name__ == "__main__":
+    main()
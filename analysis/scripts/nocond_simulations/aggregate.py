@@ -0,0 +1,241 @@
+"""
+Aggregates the columnar evaluation files written by evaluate.py (one per run) into small
+tables for plotting, reading one file at a time and only the columns needed:
+    - classif_counts.tsv: numbers of TP, FP, TN and FN sites per dataset, condition and site category
+    - precision_recall.tsv: precision and recall per dataset and condition
+    - confidence_boxes.tsv: box plot statistics of the genotype confidence of TP and FP calls,
+      computed from confidences rounded to CONFIDENCE_DIGITS significant digits
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import click
+import numpy as np
+import pandas as pd
+
+from nocond_simulations.evaluate import COLUMNAR_SUFFIXES
+
+CONDITION_KEYS = ["prg", "nesting", "err_rate", "fcov"]
+COUNT_KEYS = CONDITION_KEYS + ["lvl_1", "genotyped_ambiguous", "num_child_sites"]
+CLASSIFS = ["TP", "FP", "TN", "FN"]
+BOX_KEYS = ["nesting", "err_rate", "fcov", "classif"]
+# Subsets of calls whose genotype confidences are plotted, as DataFrame.query expressions
+BOX_SUBSETS = {
+    "all": None,
+    "no_ambiguous": "genotyped_ambiguous == 0",
+    "no_ambiguous_nestedmost": "genotyped_ambiguous == 0 and num_child_sites == 0",
+}
+BOX_METRICS = ["GC", "log_GC", "GCP"]
+# Confidences whose values are counted per file; log_GC is derived from the GC counts
+COUNTED_METRICS = ["GC", "GCP"]
+CONFIDENCE_KEYS = ["subset"] + BOX_KEYS + ["metric", "value"]
+# Significant digits kept when counting confidence values; box statistics are exact at this precision
+CONFIDENCE_DIGITS = 4
+# Number of per-file summaries held before merging them
+MERGE_BATCH_SIZE = 64
+BOX_STATS = ["n", "ymin", "lower", "middle", "upper", "ymax"]
+
+
+def get_eval_files(eval_input: Path) -> List[Path]:
+    """The evaluation files in directory :param: eval_input, or listed in file :param: eval_input"""
+    if eval_input.is_dir():
+        return sorted(
+            fname
+            for fname in eval_input.rglob("*")
+            if fname.suffix in COLUMNAR_SUFFIXES
+        )
+    with eval_input.open() as fin:
+        return [Path(line.strip()) for line in fin if line.strip() != ""]
+
+
+def read_evaluation(fname: Path, columns: List[str]) -> pd.DataFrame:
+    if fname.suffix == ".feather":
+        return pd.read_feather(fname, columns=columns)
+    return pd.read_parquet(fname, columns=columns)
+
+
+def round_significant(values: np.ndarray, digits: int) -> np.ndarray:
+    with np.errstate(divide="ignore", invalid="ignore"):
+        magnitudes = np.floor(np.log10(np.abs(values)))
+    scales = 10.0 ** (digits - 1 - np.where(np.isfinite(magnitudes), magnitudes, 0))
+    return np.round(values * scales) / scales
+
+
+def summarise_file(fname: Path) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Classification counts of the sites of one evaluation file, and how many of its
+    TP and FP calls have each (rounded) genotype confidence, per box plot.
+    Rounding bounds the size of the confidence counts by the number of distinct rounded
+    values rather than the number of calls, so merging them across files uses bounded memory.
+    """
+    sites = read_evaluation(fname, COUNT_KEYS + ["classif", "GC", "GCP"])
+    for column in ["prg", "nesting", "classif"]:
+        sites[column] = sites[column].astype(str)
+    counts = sites.groupby(COUNT_KEYS + ["classif"]).size().unstack("classif")
+    counts = counts.reindex(columns=CLASSIFS, fill_value=0).fillna(0).astype(int)
+
+    calls = sites[sites["classif"].isin(["TP", "FP"])]
+    confidences = list()
+    for subset, query in BOX_SUBSETS.items():
+        subset_calls = calls if query is None else calls.query(query)
+        for metric in COUNTED_METRICS:
+            values = round_significant(
+                subset_calls[metric].to_numpy(), CONFIDENCE_DIGITS
+            )
+            metric_counts = (
+                subset_calls[BOX_KEYS]
+                .assign(value=values)
+                .groupby(BOX_KEYS + ["value"])
+                .size()
+                .rename("count")
+                .reset_index()
+            )
+            confidences.append(metric_counts.assign(subset=subset, metric=metric))
+    return counts, merge_confidences(confidences)
+
+
+def merge_confidences(confidences: List[pd.DataFrame]) -> pd.DataFrame:
+    return (
+        pd.concat(confidences, ignore_index=True)
+        .groupby(CONFIDENCE_KEYS)["count"]
+        .sum()
+        .reset_index()
+    )
+
+
+def get_precision_recall(counts: pd.DataFrame) -> pd.DataFrame:
+    """Same definitions as in the R plotting scripts: TNs count as correct"""
+    totals = counts.groupby(CONDITION_KEYS)[CLASSIFS].sum()
+    num_correct = totals["TP"] + totals["TN"]
+    return pd.DataFrame(
+        {
+            "precision": num_correct / (num_correct + totals["FP"]),
+            "recall": num_correct / (num_correct + totals["FN"]),
+        }
+    ).reset_index()
+
+
+def weighted_quantiles(
+    values: np.ndarray, counts: np.ndarray, quantiles: List[float]
+) -> np.ndarray:
+    """
+    As np.quantile (linear interpolation) on the array with each of the sorted
+    :param: values repeated its number of :param: counts times
+    """
+    cumulative = np.cumsum(counts)
+    positions = np.array(quantiles) * (cumulative[-1] - 1)
+    below = np.floor(positions).astype(np.int64)
+    above = np.minimum(below + 1, cumulative[-1] - 1)
+    below_values = values[np.searchsorted(cumulative, below, side="right")]
+    above_values = values[np.searchsorted(cumulative, above, side="right")]
+    return below_values + (positions - below) * (above_values - below_values)
+
+
+def box_stats(values: np.ndarray, counts: np.ndarray = None) -> Dict:
+    """
+    As ggplot2's stat_boxplot: whiskers extend to the furthest values within 1.5 IQR of the box.
+    :param: counts: how many times each of :param: values occurs, once each if not given
+    """
+    if counts is None:
+        counts = np.ones(len(values), dtype=np.int64)
+    order = np.argsort(values, kind="stable")
+    values, counts = values[order], counts[order]
+    lower, middle, upper = weighted_quantiles(values, counts, [0.25, 0.5, 0.75])
+    iqr = upper - lower
+    in_whiskers = values[(values >= lower - 1.5 * iqr) & (values <= upper + 1.5 * iqr)]
+    return dict(
+        zip(
+            BOX_STATS,
+            [counts.sum(), in_whiskers.min(), lower, middle, upper, in_whiskers.max()],
+        )
+    )
+
+
+def get_confidence_boxes(confidences: pd.DataFrame) -> pd.DataFrame:
+    rows = list()
+    for subset in BOX_SUBSETS:
+        subset_confidences = confidences[confidences["subset"] == subset]
+        for keys, group in subset_confidences.groupby(BOX_KEYS):
+            gc_counts = group[group["metric"] == "GC"]
+            gcp_counts = group[group["metric"] == "GCP"]
+            with np.errstate(divide="ignore"):
+                metric_values = {
+                    "GC": gc_counts["value"].to_numpy(),
+                    "log_GC": np.log(gc_counts["value"].to_numpy()),
+                    "GCP": gcp_counts["value"].to_numpy(),
+                }
+            metric_counts = {
+                "GC": gc_counts["count"].to_numpy(),
+                "log_GC": gc_counts["count"].to_numpy(),
+                "GCP": gcp_counts["count"].to_numpy(),
+            }
+            for metric in BOX_METRICS:
+                values = metric_values[metric]
+                finite = np.isfinite(values)
+                if not finite.any():
+                    continue
+                row = {"subset": subset, **dict(zip(BOX_KEYS, keys)), "metric": metric}
+                counts = metric_counts[metric][finite]
+                rows.append({**row, **box_stats(values[finite], counts)})
+    return pd.DataFrame(rows, columns=["subset"] + BOX_KEYS + ["metric"] + BOX_STATS)
+
+
+def aggregate(
+    eval_files: List[Path], threads: int
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    :returns: the classification counts, and the genotype confidence counts
+    of TP and FP calls (see :func: summarise_file)
+    """
+    all_counts = list()
+    all_confidences = list()
+    with ProcessPoolExecutor(max_workers=threads) as executor:
+        for counts, confidences in executor.map(
+            summarise_file,
+            eval_files,
+            chunksize=max(1, len(eval_files) // (threads * 4)),
+        ):
+            all_counts.append(counts)
+            all_confidences.append(confidences)
+            if len(all_confidences) >= MERGE_BATCH_SIZE:
+                all_confidences = [merge_confidences(all_confidences)]
+    counts = pd.concat(all_counts).groupby(COUNT_KEYS).sum().reset_index()
+    confidences = merge_confidences(all_confidences)
+    return counts, confidences
+
+
+@click.command()
+@click.argument("eval_input", type=click.Path(exists=True))
+@click.argument("output_dir", type=Path)
+@click.option(
+    "--threads",
+    "-t",
+    help="Number of worker processes reading evaluation files",
+    type=int,
+    default=1,
+    show_default=True,
+)
+def main(eval_input, output_dir, threads):
+    """
+    :param: eval_input: a directory of .parquet/.feather files from evaluate.py,
+    or a file of their file names (one per line)
+    """
+    eval_files = get_eval_files(Path(eval_input))
+    if len(eval_files) == 0:
+        print(f"Error: no evaluation files in {eval_input}")
+        exit(1)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    counts, confidences = aggregate(eval_files, threads)
+    counts.to_csv(output_dir / "classif_counts.tsv", sep="\t", index=False)
+    get_precision_recall(counts).to_csv(
+        output_dir / "precision_recall.tsv", sep="\t", index=False
+    )
+    get_confidence_boxes(confidences).to_csv(
+        output_dir / "confidence_boxes.tsv", sep="\t", index=False
+    )
+
+
+if __name__ == "__main__":
+    main()
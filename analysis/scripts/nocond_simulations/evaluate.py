@@ -1,8 +1,15 @@
+"""
+Evaluates the genotyped sites of one simulated path against the truth sites.
+
+Output is a tsv without header, or a typed columnar file if the output path ends in
+'.parquet' or '.feather'. Columnar files from all runs form a dataset partitioned
+by (prg, err_rate, fcov, nesting, simu_path), read by aggregate.py.
+"""
+
 import json
-import sys
-from typing import NamedTuple, Union
+from pathlib import Path
+from typing import Dict, List
 
-import pandas as pd
 import click
 
 from jvcf_processing import (
@@ -12,6 +19,10 @@ from jvcf_processing import (
     evaluate_site,
     num_sites_under,
 )
+from lazy_imports import lazy_import
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
 
 columns = [
     "prg",
@@ -38,6 +49,31 @@ columns = [
     "num_child_sites",
 ]
 result_template = {k: "NA" for k in columns}
+# Types in columnar output. "NA" is missing; alleles stay strings, and the few distinct
+# prg, nesting and classif values are stored as categories.
+column_dtypes = {
+    "prg": "category",
+    "simu_path": "int64",
+    "err_rate": "int64",
+    "fcov": "int64",
+    "nesting": "category",
+    "res_has_call": "bool",
+    "truth_has_call": "bool",
+    "res_is_correct": "bool",
+    "classif": "category",
+    "lvl_1": "int8",
+    "GC": "float64",
+    "GCP": "float64",
+    "edit_dist": "int64",
+    "cov_gt_allele": "Int64",
+    "cov_other_alleles": "int64",
+    "site_num": "int64",
+    "site_pos": "int64",
+    "genotyped_ambiguous": "int8",
+    "truth_ambiguous": "int8",
+    "num_child_sites": "int64",
+}
+COLUMNAR_SUFFIXES = {".parquet", ".feather"}
 
 
 def print_cols(ctx, param, value):
@@ -47,6 +83,64 @@ def print_cols(ctx, param, value):
     ctx.exit()
 
 
+def evaluate_sites(
+    truth_json: Dict, res_json: Dict, prg_name: str, num: int, template: Dict
+) -> List[Dict]:
+    """One result per site of :param: truth_json, with the fields of :param: template"""
+    lvl1_sites = set(res_json["Lvl1_Sites"])
+    # Below sample_id assumes gramtools simulate was called with that --sample_id
+    sample_id = f"{prg_name}{num}"
+    truth_sample_index = find_sample_index(truth_json, sample_id)
+    assert sample_id == res_json["Samples"][0]["Name"]
+
+    results = list()
+    for i in range(len(truth_json["Sites"])):
+        next_result = template.copy()
+
+        called_site_json = res_json["Sites"][i]
+        truth_site_json = truth_json["Sites"][i]
+
+        eval_results = evaluate_site(
+            called_site_json, 0, truth_site_json, truth_sample_index
+        )
+        # Make sure no new keys will be introduced
+        next_result.update(
+            {key: val for key, val in eval_results.items() if key in next_result}
+        )
+
+        next_result["num_child_sites"] = num_sites_under(res_json["Child_Map"], str(i))
+
+        if lvl1_sites == {"all"} or i in lvl1_sites:
+            next_result["lvl_1"] = "1"
+        else:
+            next_result["lvl_1"] = "0"
+
+        next_result["site_num"] = i
+        next_result["site_pos"] = called_site_json["POS"]
+        results.append(next_result)
+    return results
+
+
+def to_typed_df(results: List[Dict]) -> "pd.DataFrame":
+    result = pd.DataFrame(results, columns=columns).replace("NA", np.nan)
+    for column, dtype in column_dtypes.items():
+        if dtype in {"int64", "int8", "float64", "Int64"}:
+            result[column] = pd.to_numeric(result[column])
+        result[column] = result[column].astype(dtype)
+    return result
+
+
+def write_results(results: List[Dict], output_path: Path):
+    if output_path.suffix == ".parquet":
+        to_typed_df(results).to_parquet(output_path, index=False)
+    elif output_path.suffix == ".feather":
+        to_typed_df(results).to_feather(output_path)
+    else:
+        with output_path.open("w") as fout:
+            for result in results:
+                fout.write("\t".join(map(str, result.values())) + "\n")
+
+
 @click.command()
 @click.option(
     "-p",
@@ -65,6 +159,9 @@ def print_cols(ctx, param, value):
 @click.argument("res_json", type=click.Path(exists=True))
 @click.argument("output_path")
 def main(prg_name, num, err_rate, fcov, nesting, truth_json, res_json, output_path):
+    """
+    :output_path: a tsv, or a .parquet/.feather file with typed columns
+    """
     result_template["prg"] = prg_name
     result_template["simu_path"] = str(num)
     result_template["err_rate"] = str(err_rate)
@@ -78,42 +175,10 @@ def main(prg_name, num, err_rate, fcov, nesting, truth_json, res_json, output_pa
     ## Load up result json
     with open(res_json) as fin:
         res_json = json.load(fin)
-        lvl1_sites = set(res_json["Lvl1_Sites"])
 
     ## Evaluate calls
-    fout = open(output_path, "w")
-    # Below sample_id assumes gramtools simulate was called with that --sample_id
-    sample_id = f"{prg_name}{num}"
-    truth_sample_index = find_sample_index(truth_json, sample_id)
-    assert sample_id == res_json["Samples"][0]["Name"]
-
-    for i in range(len(truth_json["Sites"])):
-        next_result = result_template.copy()
-
-        called_site_json = res_json["Sites"][i]
-        truth_site_json = truth_json["Sites"][i]
-
-        eval_results = evaluate_site(
-            called_site_json, 0, truth_site_json, truth_sample_index
-        )
-        # Make sure no new keys will be introduced
-        next_result.update(
-            {key: val for key, val in eval_results.items() if key in next_result}
-        )
-
-        next_result["num_child_sites"] = num_sites_under(res_json["Child_Map"], str(i))
-
-        if lvl1_sites == {"all"} or i in lvl1_sites:
-            next_result["lvl_1"] = "1"
-        else:
-            next_result["lvl_1"] = "0"
-
-        next_result["site_num"] = i
-        next_result["site_pos"] = called_site_json["POS"]
-
-        fout.write("\t".join(map(str, next_result.values())) + "\n")
-
-    fout.close()
+    results = evaluate_sites(truth_json, res_json, prg_name, num, result_template)
+    write_results(results, Path(output_path))
 
 
 if __name__ == "__main__":
@@ -6,218 +6,443 @@ Only analyses:
     - Regions (sample x genes) where gramtools has found a NM that is same or worse than closest in prg, otherwise the 'truth' jvcf is not the best gramtools could do (it is worse than it did)
     - Sites which do not have children, to avoid double-counting them
 """
-from typing import NewType, Optional, Set, Dict, List
+from typing import NewType, NamedTuple, Tuple
 from pathlib import Path
-from dataclasses import dataclass
-from math import isnan
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from tempfile import TemporaryDirectory
 import logging
 
 import click
+import numpy as np
 import pandas as pd
-import seaborn as sns
-import matplotlib.pyplot as plt
 
 classif_fields = set(["TP", "TN", "FP", "FN"])
 Classif = NewType("Classif", str)
 
 
-@dataclass
-class EvaluatedGene:
-    gramtools_NM: float
-    prg_closest_NM: Optional[float] = None
-    delta_prg_closest: Optional[float] = None
-
-    def delta(self) -> Optional[float]:
-        if self.prg_closest_NM is None:
-            raise ValueError(
-                f"prg_closest_NM attribute is None, it was not set during parsing of prg_closest tsv"
-            )
-        if self.delta_prg_closest is None:
-            self.delta_prg_closest = self.gramtools_NM - self.prg_closest_NM
-        return self.delta_prg_closest
-
-    def set_prg_closest(self, value: float) -> None:
-        if self.prg_closest_NM is not None:
-            raise ValueError(
-                f"Cannot set prg_closest_NM: already has value {self.prg_closest_NM}. Duplicate in prg_closest tsv?"
-            )
-        self.prg_closest_NM = value
-
-
-Deltas = Dict[str, EvaluatedGene]
-
-
-def load_gramtools_tsv(gramtools_tsv) -> Deltas:
-    deltas = dict()
-    df = pd.read_table(gramtools_tsv)
-    num_no_NM, num_low_mapq = 0, 0
-    for row in df.itertuples():
-        if not row.condition.startswith("gramtools"):
-            continue
-        if isnan(row.NM):
-            num_no_NM += 1
-            continue
-        if row.MAPQ <= 40:
-            num_low_mapq += 1
-            continue
-        key = f"{row.sample}_{row.gene}"
-        if key in deltas:
-            raise ValueError(f"region {key} found twice in the gramtools tsv")
-        deltas[key] = EvaluatedGene(row.NM)
+REGION_KEYS = ["sample", "gene"]
+EVAL_CHUNK_SIZE = 1000000
+eval_dtypes = {
+    "sample": str,
+    "gene": str,
+    "classif": "category",
+    "GCP": np.float64,
+    "truth_allele": str,
+    "num_child_sites": "Int64",
+    "genotyped_ambiguous": "boolean",
+    "truth_ambiguous": "boolean",
+    "is_nested": "boolean",
+}
+
+
+def load_gramtools_tsv(gramtools_tsv) -> pd.DataFrame:
+    """Regions (sample x gene) with a gramtools NM of MAPQ > 40, indexed by (sample, gene)"""
+    df = pd.read_table(
+        gramtools_tsv,
+        usecols=REGION_KEYS + ["condition", "NM", "MAPQ"],
+        dtype={"sample": str, "gene": str, "condition": str},
+    )
+    df = df[df["condition"].str.startswith("gramtools")]
+    has_NM = df["NM"].notna()
+    high_mapq = ~(df["MAPQ"] <= 40)
+    num_no_NM = int((~has_NM).sum())
+    num_low_mapq = int((has_NM & ~high_mapq).sum())
+    regions = df.loc[has_NM & high_mapq, REGION_KEYS + ["NM"]]
+    duplicated = regions.duplicated(REGION_KEYS)
+    if duplicated.any():
+        sample, gene = regions.loc[duplicated, REGION_KEYS].iloc[0]
+        raise ValueError(f"region {sample}_{gene} found twice in the gramtools tsv")
+    regions = regions.rename(columns={"NM": "gramtools_NM"}).set_index(REGION_KEYS)
     logging.info(
         f"Gramtools genotyping \n Num no NM: {num_no_NM} \n Num MAPQ <= 40: {num_low_mapq}"
-        f"\n Num used regions: {len(deltas)}"
+        f"\n Num used regions: {len(regions)}"
     )
-    return deltas
-
-
-def load_prg_closest_tsv(prg_closest_tsv, deltas: Deltas) -> None:
-    num_no_NM = 0
-    df = pd.read_table(prg_closest_tsv)
-    for row in df.itertuples():
-        if not "mapq_40" in row.condition:
-            continue
-        key = f"{row.sample}_{row.gene}"
-        if isnan(row.NM):
-            num_no_NM += 1
-            if key in deltas:
-                # Gramtools could map it, but no input seq in prg is mappable, so remove region from evaluation
-                deltas.pop(key)
-            continue
-        if key not in deltas:
-            continue
-        deltas[key].set_prg_closest(row.NM)
-    logging.info(f"Prg_closest \n Num no NM: {num_no_NM}")
-
-
-class EvaluatedSite:
-    GCP: float
-    classif: Classif
-    fp_on_null_call: bool = False
-
-    def __init__(self, tsv_line: pd.Series):
-        self.GCP = tsv_line.GCP
-        classif = tsv_line.classif
-        if classif not in classif_fields:
-            raise ValueError(f"{classif} not in {classif_fields}")
-        self.classif = classif
-
-        if classif == "FP" and tsv_line.truth_allele == "":
-            self.fp_on_null_call = True
-
-
-Classifs = List[EvaluatedSite]
-
-
-def load_eval_tsv(eval_tsv, deltas: Deltas) -> Classifs:
-    num_nested, num_nonested = 0, 0
-    classifs = list()
-    df = pd.read_table(eval_tsv)
-    df["truth_allele"] = df["truth_allele"].fillna("")
-    for row in df.itertuples():
-        key = f"{row.sample}_{row.gene}"
-        if key not in deltas:
-            continue
-        if deltas[key].delta() < 0:
-            continue
-        if row.num_child_sites != 0:
-            continue
-        if row.genotyped_ambiguous or row.truth_ambiguous:
-            continue
-        if row.is_nested:
-            num_nested += 1
-        else:
-            num_nonested += 1
-        classifs.append(EvaluatedSite(row))
-    classifs.sort(key=lambda elem: elem.GCP, reverse=True)
-    logging.info(
-        f"Num evaluated sites: {len(classifs)},"
-        f" of which {num_nested} nested and {num_nonested} non-nested sites"
+    return regions
+
+
+def load_prg_closest_tsv(prg_closest_tsv, regions: pd.DataFrame) -> pd.DataFrame:
+    """
+    Adds the prg_closest NM of each region, and its delta to the gramtools NM.
+    Regions that no input seq in prg could map to are removed from evaluation.
+    """
+    df = pd.read_table(
+        prg_closest_tsv,
+        usecols=REGION_KEYS + ["condition", "NM"],
+        dtype={"sample": str, "gene": str, "condition": str},
     )
-    return classifs
-
-
-ClassifCounts = Dict[Classif, int]
-
-
-def get_fpr(counts: ClassifCounts) -> float:
-    TNs = counts["TN"]
-    FPs = counts["FP"]
-    return FPs / (TNs + FPs)
-
-
-def get_precision(counts: ClassifCounts) -> float:
-    TPs = counts["TP"]
-    FPs = counts["FP"]
-    if (TPs + FPs) == 0:
-        return 0
-    return TPs / (TPs + FPs)
-
-
-def get_tpr(counts: ClassifCounts) -> float:
-    TPs = counts["TP"]
-    FNs = counts["FN"]
-    return TPs / (TPs + FNs)
-
-
-def count_classif(sites: Classifs, target_classifs: Set[Classif]) -> int:
-    assert classif_fields.issuperset(target_classifs)
-    result = 0
-    for site in sites:
-        if site.classif in target_classifs:
-            result += 1
+    df = df[df["condition"].str.contains("mapq_40", regex=False)]
+    no_NM = df["NM"].isna()
+    logging.info(f"Prg_closest \n Num no NM: {int(no_NM.sum())}")
+
+    unmappable = pd.MultiIndex.from_frame(df.loc[no_NM, REGION_KEYS])
+    result = regions[~regions.index.isin(unmappable)]
+    closest = df.loc[~no_NM].set_index(REGION_KEYS)["NM"]
+    closest = closest[closest.index.isin(result.index)]
+    if closest.index.has_duplicates:
+        sample, gene = closest.index[closest.index.duplicated()][0]
+        raise ValueError(
+            f"Cannot set prg_closest_NM of region {sample}_{gene}: duplicate in prg_closest tsv?"
+        )
+    result = result.join(closest.rename("prg_closest_NM"))
+    result["delta"] = result["gramtools_NM"] - result["prg_closest_NM"]
     return result
 
 
-def check_no_change(call_rates: Dict) -> bool:
-    same_last_two = lambda list_elem: list_elem[-1] == list_elem[-2]
-    return all(map(same_last_two, call_rates.values()))
+def load_eval_tsv(eval_tsv, regions: pd.DataFrame) -> pd.DataFrame:
+    """
+    Loads the evaluated sites of regions with a non-negative delta, in chunks so that the
+    sites of other regions are never all held in memory.
+    Returns their GCP, classification and whether they are FPs on a null truth call,
+    in decreasing GCP order.
+    """
+    used_regions = regions.index[regions["delta"] >= 0]
+    chunks = list()
+    num_nested = 0
+    reader = pd.read_table(
+        eval_tsv,
+        usecols=list(eval_dtypes),
+        dtype=eval_dtypes,
+        chunksize=EVAL_CHUNK_SIZE,
+    )
+    for chunk in reader:
+        in_regions = pd.MultiIndex.from_frame(chunk[REGION_KEYS]).isin(used_regions)
+        # Missing values count as ambiguous, or as having child sites
+        keep = (
+            in_regions
+            & chunk["num_child_sites"].eq(0).fillna(False).to_numpy()
+            & ~chunk["genotyped_ambiguous"].fillna(True).to_numpy()
+            & ~chunk["truth_ambiguous"].fillna(True).to_numpy()
+        )
+        chunk = chunk[keep]
+        classifs = chunk["classif"].astype(str)
+        unknown = ~classifs.isin(classif_fields)
+        if unknown.any():
+            raise ValueError(f"{classifs[unknown].iloc[0]} not in {classif_fields}")
+        num_nested += int(chunk["is_nested"].fillna(True).sum())
+        null_truth = chunk["truth_allele"].isna() | (chunk["truth_allele"] == "")
+        chunks.append(
+            pd.DataFrame(
+                {
+                    "sample": chunk["sample"],
+                    "gene": chunk["gene"],
+                    "GCP": chunk["GCP"],
+                    "classif": classifs,
+                    "fp_on_null_call": (classifs == "FP") & null_truth,
+                }
+            )
+        )
+    if len(chunks) == 0:
+        raise ValueError(f"No evaluated sites in {eval_tsv}")
+    sites = pd.concat(chunks, ignore_index=True)
+    sites = sites.astype(
+        {
+            "sample": "category",
+            "gene": "category",
+            "classif": pd.CategoricalDtype(sorted(classif_fields)),
+        }
+    )
+    order = np.argsort(-sites["GCP"].to_numpy(), kind="stable")
+    sites = sites.iloc[order].reset_index(drop=True)
+    logging.info(
+        f"Num evaluated sites: {len(sites)},"
+        f" of which {num_nested} nested and {len(sites) - num_nested} non-nested sites"
+    )
+    return sites
+
+
+def trapezoid_auc(tpr: np.ndarray, fpr: np.ndarray) -> float:
+    """Area under the ROC curve (TPR against FPR), by the trapezoidal rule"""
+    return float(np.sum(np.diff(fpr) * (tpr[1:] + tpr[:-1]) / 2))
+
+
+class ROCCurve(NamedTuple):
+    """
+    Call rates when calling the sites with GCP >= each threshold, thresholds in decreasing order.
+    Entry 0 is before any site is called.
+    """
+
+    GCP: np.ndarray
+    num_TP: np.ndarray
+    num_FP: np.ndarray
+    tpr: np.ndarray
+    fpr: np.ndarray
+    precision: np.ndarray
+
+    def auc(self) -> float:
+        return trapezoid_auc(self.tpr, self.fpr)
+
+    def to_df(self) -> pd.DataFrame:
+        return pd.DataFrame(
+            {
+                "GCP": self.GCP,
+                "num_TP": self.num_TP,
+                "num_FP": self.num_FP,
+                "tpr": self.tpr,
+                "fpr": self.fpr,
+                "one_minus_precision": 1 - self.precision,
+            }
+        )
+
+
+def site_arrays(sites: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    """GCPs and classifications of :param: sites, as loaded by `load_eval_tsv`"""
+    return sites["GCP"].to_numpy(), sites["classif"].to_numpy(dtype=object)
+
+
+def cumulative_counts(classifs: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Numbers of TPs and of FPs among the first k sites, for k in 0..len(:param: classifs)"""
+    num_TP = np.concatenate([[0], np.cumsum(classifs == "TP")])
+    num_FP = np.concatenate([[0], np.cumsum(classifs == "FP")])
+    return num_TP, num_FP
+
+
+def get_call_rates(
+    num_TP: np.ndarray, num_FP: np.ndarray, num_true_calls: int, num_no_calls: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    TPR, FPR and precision when the TPs and FPs counted are called, and all other
+    TPs and FPs are filtered out (so become FNs and TNs respectively).
+    Precision is 0 if no TP or FP is called.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        tpr = num_TP / num_true_calls
+        fpr = num_FP / num_no_calls
+        num_calls = num_TP + num_FP
+        precision = np.where(num_calls == 0, 0, num_TP / np.maximum(num_calls, 1))
+    return tpr, fpr, precision
+
+
+def get_roc_curve(GCPs: np.ndarray, classifs: np.ndarray) -> ROCCurve:
+    """
+    Full-resolution curve: one point per distinct GCP threshold.
+    :param: GCPs and :param: classifs must be in decreasing GCP order.
+    """
+    num_TP, num_FP = cumulative_counts(classifs)
+    num_true_calls = int(np.sum((classifs == "TP") | (classifs == "FN")))
+    num_no_calls = int(np.sum((classifs == "TN") | (classifs == "FP")))
+    # Number of sites with GCP >= each distinct GCP
+    threshold_ends = np.flatnonzero(np.append(GCPs[1:] != GCPs[:-1], True)) + 1
+    cuts = np.concatenate([[0], threshold_ends[: len(GCPs)]])
+    tpr, fpr, precision = get_call_rates(
+        num_TP[cuts], num_FP[cuts], num_true_calls, num_no_calls
+    )
+    thresholds = np.concatenate([[np.inf], GCPs[cuts[1:] - 1]])
+    return ROCCurve(thresholds, num_TP[cuts], num_FP[cuts], tpr, fpr, precision)
 
 
-def get_roc_values(sites: Classifs) -> pd.DataFrame:
+def get_roc_values(GCPs: np.ndarray, classifs: np.ndarray) -> pd.DataFrame:
+    """
+    Downsampling of the full curve to NUM_STEPS steps, equally spaced in the distribution of GCP,
+    stopping early once call rates stop changing.
+    :param: GCPs and :param: classifs must be in decreasing GCP order.
+    """
     NUM_STEPS = 30
-    tprs, fprs = list(), list()
-    counts = {elem: 0 for elem in classif_fields}
-    # These two counts will be constant denominators to TPR and FPR respectively
-    num_true_calls = count_classif(sites, {"TP", "FN"})
-    num_no_calls = count_classif(sites, {"TN", "FP"})
-    # First data point: pretend like all sites have been filtered out and called null.
-    counts["FN"] = num_true_calls
-    counts["TN"] = num_no_calls
-    call_rates = {
-        "tpr": [get_tpr(counts)],
-        "fpr": [get_fpr(counts)],
-        "one_minus_precision": [get_precision(counts)],
-    }
-
-    step = 0
-    step_size = (
-        len(sites) // NUM_STEPS
-    )  # steps equally spaced in the distribution of GCP
-    for _ in range(NUM_STEPS):
-        subarray = sites[step : step + step_size]
-        TPs_in_range = count_classif(subarray, {"TP"})
-        counts["TP"] += TPs_in_range
-        counts["FN"] -= TPs_in_range
-
-        FPs_in_range = count_classif(subarray, {"FP"})
-        counts["FP"] += FPs_in_range
-        counts["TN"] -= FPs_in_range
-        call_rates["tpr"].append(get_tpr(counts))
-        call_rates["fpr"].append(get_fpr(counts))
-        call_rates["one_minus_precision"].append(1 - get_precision(counts))
-        step += step_size
-
-        if check_no_change(call_rates):
-            break
-
-    result = pd.DataFrame(call_rates)
-    return result
+    num_TP, num_FP = cumulative_counts(classifs)
+    num_true_calls = int(np.sum((classifs == "TP") | (classifs == "FN")))
+    num_no_calls = int(np.sum((classifs == "TN") | (classifs == "FP")))
+    step_size = len(classifs) // NUM_STEPS
+    cuts = np.arange(NUM_STEPS + 1) * step_size
+    tpr, fpr, precision = get_call_rates(
+        num_TP[cuts], num_FP[cuts], num_true_calls, num_no_calls
+    )
+    # First data point: all sites are filtered out and called null; its precision is reported as is.
+    one_minus_precision = np.concatenate([precision[:1], 1 - precision[1:]])
+    call_rates = np.column_stack([tpr, fpr, one_minus_precision])
+    unchanged = np.flatnonzero((call_rates[1:] == call_rates[:-1]).all(axis=1))
+    num_points = unchanged[0] + 2 if len(unchanged) > 0 else len(cuts)
+    return pd.DataFrame(
+        call_rates[:num_points], columns=["tpr", "fpr", "one_minus_precision"]
+    )
 
 
-def write_stats(classifs: Classifs, ofname: Path):
-    roc_df = get_roc_values(classifs)
+### Bootstrap confidence bands ###
+BAND_PERCENTILES = (2.5, 97.5)
+MAX_BAND_POINTS = 1000
+BOOTSTRAP_BATCH_SIZE = 50
+
+
+class BootstrapData(NamedTuple):
+    """
+    Sites aggregated by GCP threshold bin (index of the site's distinct GCP, in decreasing order)
+    and by region: all that a bootstrap replicate needs.
+    """
+
+    # Rows: bin, region, num TPs, num FPs; one column per (bin, region) with sites
+    cells: np.ndarray
+    # Rows: num true calls (TP or FN), num no calls (TN or FP); one column per region
+    region_totals: np.ndarray
+    num_bins: int
+
+
+def get_bootstrap_data(sites: pd.DataFrame) -> BootstrapData:
+    """:param: sites must be in decreasing GCP order, as loaded by `load_eval_tsv`"""
+    GCPs, classifs = site_arrays(sites)
+    bins = np.concatenate([[0], np.cumsum(GCPs[1:] != GCPs[:-1])]).astype(np.int64)
+    regions = sites.groupby(REGION_KEYS, observed=True, sort=False).ngroup().to_numpy()
+    num_regions = int(regions.max()) + 1 if len(regions) > 0 else 0
+    is_true_call = np.isin(classifs, ["TP", "FN"])
+    is_no_call = np.isin(classifs, ["TN", "FP"])
+    region_totals = np.vstack(
+        [
+            np.bincount(regions, weights=is_true_call, minlength=num_regions),
+            np.bincount(regions, weights=is_no_call, minlength=num_regions),
+        ]
+    ).astype(np.int64)
+    cell_ids, cell_of_site = np.unique(
+        bins * num_regions + regions, return_inverse=True
+    )
+    num_cells = len(cell_ids)
+    cells = np.vstack(
+        [
+            cell_ids // max(num_regions, 1),
+            cell_ids % max(num_regions, 1),
+            np.bincount(cell_of_site, weights=classifs == "TP", minlength=num_cells),
+            np.bincount(cell_of_site, weights=classifs == "FP", minlength=num_cells),
+        ]
+    ).astype(np.int64)
+    num_bins = int(bins[-1]) + 1 if len(bins) > 0 else 0
+    return BootstrapData(cells, region_totals, num_bins)
+
+
+def weighted_call_rates(
+    cells: np.ndarray,
+    region_totals: np.ndarray,
+    num_bins: int,
+    region_weights: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Call rates at each point of the full-resolution curve, with the sites of each region
+    counted :param: region_weights times (its number of draws in a bootstrap replicate).
+    """
+    cell_weights = region_weights[cells[1]]
+    num_TP = np.bincount(cells[0], weights=cell_weights * cells[2], minlength=num_bins)
+    num_FP = np.bincount(cells[0], weights=cell_weights * cells[3], minlength=num_bins)
+    num_true_calls, num_no_calls = region_totals @ region_weights
+    return get_call_rates(
+        np.concatenate([[0], np.cumsum(num_TP)]),
+        np.concatenate([[0], np.cumsum(num_FP)]),
+        num_true_calls,
+        num_no_calls,
+    )
+
+
+def bootstrap_replicates(
+    data_dir: Path,
+    num_bins: int,
+    band_points: np.ndarray,
+    seed: np.random.SeedSequence,
+    num_replicates: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Resamples regions with replacement :param: num_replicates times, and computes the curve
+    of each replicate. The aggregated sites are memory-mapped from :param: data_dir,
+    so are shared by all worker processes.
+    Returns the call rates (replicates x [tpr, fpr, one_minus_precision] x band points)
+    and the AUC of each replicate.
+    """
+    cells = np.load(data_dir / "cells.npy", mmap_mode="r")
+    region_totals = np.load(data_dir / "region_totals.npy", mmap_mode="r")
+    num_regions = region_totals.shape[1]
+    rng = np.random.default_rng(seed)
+    rates = np.empty((num_replicates, 3, len(band_points)))
+    aucs = np.empty(num_replicates)
+    for replicate in range(num_replicates):
+        region_weights = np.bincount(
+            rng.integers(0, num_regions, num_regions), minlength=num_regions
+        )
+        tpr, fpr, precision = weighted_call_rates(
+            cells, region_totals, num_bins, region_weights
+        )
+        rates[replicate] = [
+            tpr[band_points],
+            fpr[band_points],
+            1 - precision[band_points],
+        ]
+        aucs[replicate] = trapezoid_auc(tpr, fpr)
+    return rates, aucs
+
+
+def get_bootstrap_bands(
+    sites: pd.DataFrame,
+    roc_curve: ROCCurve,
+    num_replicates: int,
+    threads: int,
+    seed: int,
+) -> Tuple[pd.DataFrame, np.ndarray]:
+    """
+    Percentile bands of the call rates over bootstrap replicates, at up to MAX_BAND_POINTS
+    thresholds of :param: roc_curve, and the AUC of each replicate.
+    """
+    data = get_bootstrap_data(sites)
+    num_points = len(roc_curve.GCP)
+    band_points = np.linspace(0, num_points - 1, min(num_points, MAX_BAND_POINTS))
+    band_points = np.unique(band_points.round().astype(int))
+    batch_sizes = [
+        min(BOOTSTRAP_BATCH_SIZE, num_replicates - start)
+        for start in range(0, num_replicates, BOOTSTRAP_BATCH_SIZE)
+    ]
+    seeds = np.random.SeedSequence(seed).spawn(len(batch_sizes))
+    with TemporaryDirectory() as data_dir:
+        data_dir = Path(data_dir)
+        np.save(data_dir / "cells.npy", data.cells)
+        np.save(data_dir / "region_totals.npy", data.region_totals)
+        with ProcessPoolExecutor(max_workers=threads) as executor:
+            batches = list(
+                executor.map(
+                    bootstrap_replicates,
+                    repeat(data_dir),
+                    repeat(data.num_bins),
+                    repeat(band_points),
+                    seeds,
+                    batch_sizes,
+                )
+            )
+    rates = np.concatenate([batch_rates for batch_rates, _ in batches])
+    aucs = np.concatenate([batch_aucs for _, batch_aucs in batches])
+
+    bands = {"GCP": roc_curve.GCP[band_points]}
+    estimates = roc_curve.to_df().iloc[band_points]
+    for rate_idx, rate in enumerate(["tpr", "fpr", "one_minus_precision"]):
+        lower, upper = np.nanpercentile(rates[:, rate_idx], BAND_PERCENTILES, axis=0)
+        bands[rate] = estimates[rate].to_numpy()
+        bands[f"{rate}_lower"] = lower
+        bands[f"{rate}_upper"] = upper
+    return pd.DataFrame(bands), aucs
+
+
+def write_stats(
+    sites: pd.DataFrame,
+    ofname: Path,
+    num_replicates: int = 0,
+    threads: int = 1,
+    seed: int = 0,
+):
+    """
+    Writes the downsampled curve to :param: ofname and the full-resolution curve next to it,
+    and logs the area under the curve.
+    With :param: num_replicates > 0, also writes bootstrap percentile bands next to it.
+    """
+    GCPs, site_classifs = site_arrays(sites)
+    roc_df = get_roc_values(GCPs, site_classifs)
     roc_df.to_csv(ofname, sep="\t", index=False)
+    roc_curve = get_roc_curve(GCPs, site_classifs)
+    roc_curve.to_df().to_csv(
+        ofname.with_name(f"{ofname.stem}_full.tsv"), sep="\t", index=False
+    )
+    logging.info(f"ROC AUC for {ofname.name}: {roc_curve.auc():.4f}")
+    if num_replicates > 0:
+        bands, aucs = get_bootstrap_bands(
+            sites, roc_curve, num_replicates, threads, seed
+        )
+        bands.to_csv(
+            ofname.with_name(f"{ofname.stem}_bootstrap.tsv"), sep="\t", index=False
+        )
+        lower, upper = np.nanpercentile(aucs, BAND_PERCENTILES)
+        logging.info(
+            f"ROC AUC {BAND_PERCENTILES} percentiles over {num_replicates} bootstrap replicates: "
+            f"{lower:.4f}, {upper:.4f}"
+        )
 
 
 @click.command()
@@ -225,7 +450,32 @@ def write_stats(classifs: Classifs, ofname: Path):
 @click.argument("closest_tsv", type=click.Path(exists=True))
 @click.argument("evaluation_tsv", type=click.Path(exists=True))
 @click.argument("output_dir", type=Path)
-def main(gramtools_tsv, closest_tsv, evaluation_tsv, output_dir):
+@click.option(
+    "--bootstrap",
+    "num_replicates",
+    help="Number of bootstrap replicates, resampling (sample, gene) regions, for percentile bands of the curves",
+    type=int,
+    default=0,
+    show_default=True,
+)
+@click.option(
+    "--threads",
+    "-t",
+    help="Number of worker processes computing bootstrap replicates",
+    type=int,
+    default=1,
+    show_default=True,
+)
+@click.option("--seed", type=int, default=0, show_default=True)
+def main(
+    gramtools_tsv,
+    closest_tsv,
+    evaluation_tsv,
+    output_dir,
+    num_replicates,
+    threads,
+    seed,
+):
     output_dir.mkdir(exist_ok=True)
     logfile = open(output_dir / "log.txt", "w")
     logging.basicConfig(
@@ -234,27 +484,31 @@ def main(gramtools_tsv, closest_tsv, evaluation_tsv, output_dir):
         handlers=[logging.StreamHandler(logfile)],
     )
 
-    deltas: Dict[str, EvaluatedGene] = load_gramtools_tsv(gramtools_tsv)
-    load_prg_closest_tsv(closest_tsv, deltas)
-    num_nonneg_delta = 0
-    # Compute the deltas and fail early if there is a region with NM in gramtools but not in prg_closest
-    for key, elem in deltas.items():
-        try:
-            delta = elem.delta()
-            if delta >= 0:
-                num_nonneg_delta += 1
-        except ValueError as err:
-            raise err
+    regions = load_gramtools_tsv(gramtools_tsv)
+    regions = load_prg_closest_tsv(closest_tsv, regions)
+    # Fail early if there is a region with NM in gramtools but not in prg_closest
+    missing_closest = regions["prg_closest_NM"].isna()
+    if missing_closest.any():
+        sample, gene = regions.index[missing_closest][0]
+        raise ValueError(
+            f"Region {sample}_{gene} has no prg_closest NM: it was not in the prg_closest tsv"
+        )
+    num_nonneg_delta = int((regions["delta"] >= 0).sum())
     logging.info(
-        f"Total num loaded regions with NM in both gramtools and prg_closest: {len(deltas)}"
+        f"Total num loaded regions with NM in both gramtools and prg_closest: {len(regions)}"
     )
     logging.info(
         f"Total num loaded regions with NM in gramtools >= NM in prg_closest: {num_nonneg_delta}"
     )
-    classifs = load_eval_tsv(evaluation_tsv, deltas)
-    write_stats(classifs, output_dir / "ROC_stats.tsv")
-    classifs_nofpnulls = [elem for elem in classifs if not elem.fp_on_null_call]
-    write_stats(classifs_nofpnulls, output_dir / "ROC_stats_no_fpnull.tsv")
+    sites = load_eval_tsv(evaluation_tsv, regions)
+    write_stats(sites, output_dir / "ROC_stats.tsv", num_replicates, threads, seed)
+    write_stats(
+        sites[~sites["fp_on_null_call"]],
+        output_dir / "ROC_stats_no_fpnull.tsv",
+        num_replicates,
+        threads,
+        seed,
+    )
     logfile.close()
 
 
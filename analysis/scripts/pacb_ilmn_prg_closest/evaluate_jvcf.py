@@ -1,15 +1,28 @@
+"""
+Evaluates the genotyped sites of a sample in a region against the truth sites induced from
+the region's closest sequence in the prg.
+
+Takes a single truth jVCF, or in batch mode a file listing the truth jVCFs of a sample with
+their regions: the sample's genotyped jVCF is then loaded and indexed once for all regions,
+and the results are written to one table with a header.
+"""
+
 import json
 import re
 from pathlib import Path
+from typing import List, Tuple
 
 import click
 
 from jvcf_processing import (
+    JVCF,
     Region,
+    SiteJsons,
+    SitesIndex,
     click_get_region,
     evaluate_site,
     first_idx_in_region,
-    get_n_sites_starting_from_region,
+    get_region,
     is_nested,
     num_sites_under,
 )
@@ -45,49 +58,34 @@ def print_cols(ctx, param, value):
     ctx.exit()
 
 
-@click.command()
-@click.option(
-    "-p",
-    help="print output tsv columns and exit",
-    is_flag=True,
-    callback=print_cols,
-    expose_value=False,
-    is_eager=True,
-)
-@click.argument("genotyped_jvcf", type=click.Path(exists=True))
-@click.argument("truth_jvcf", type=click.Path(exists=True))
-@click.argument("output_file", type=click.Path())
-@click.option(
-    "--region",
-    "-r",
-    help="In the form 'SEG:start-end', as in samtools/bcftools",
-    default=None,
-    callback=click_get_region,
-)
-def main(genotyped_jvcf, truth_jvcf, region: Region, output_file):
+def load_jvcf(jvcf_fname) -> JVCF:
+    with open(jvcf_fname) as fin:
+        return json.load(fin)
+
+
+def get_sample_and_gene(truth_jvcf: Path) -> Tuple[str, str]:
+    fname_matcher = re.match("([^_]+)_([^_]+_[^_]+)_(.*).json", truth_jvcf.name)
+    return fname_matcher.groups()[0], fname_matcher.groups()[1]
+
+
+def evaluate_region(
+    genotyped_sites: SiteJsons, site_num: int, truth: JVCF, sample: str, gene: str
+) -> List[str]:
     """
-    :genotyped_jvcf: A single sample jvcf which either has same sites as :truth_jvcf: or has sites in :region: corresponding to :truth_jvcf:
+    One output line per site of :param: truth, evaluated against the genotyped sites
+    starting at index :param: site_num
     """
-    fout = open(output_file, "w")
-    with open(genotyped_jvcf) as fone, open(truth_jvcf) as ftwo:
-        genotyped = json.load(fone)
-        truth = json.load(ftwo)
-
-    lvl1sites = truth["Lvl1_Sites"]
     truth_sites = truth["Sites"]
-    genotyped_sites = genotyped["Sites"]
-    site_num = first_idx_in_region(genotyped_sites, region)
     genotyped_sites = genotyped_sites[site_num : site_num + len(truth_sites)]
     if len(genotyped_sites) != len(truth_sites):
         raise ValueError(
             f"{len(genotyped_sites)} genotyped sites vs {len(truth_sites)} truth sites, should be same number. Use --region ?"
         )
+    lvl1sites = set(truth["Lvl1_Sites"])
 
     result_template = {k: "NA" for k in result_fields}
-    fname_matcher = re.match("([^_]+)_([^_]+_[^_]+)_(.*).json", Path(truth_jvcf).name)
-    result_template.update(
-        {"sample": fname_matcher.groups()[0], "gene": fname_matcher.groups()[1]}
-    )
+    result_template.update({"sample": sample, "gene": gene})
+    result = list()
     for i in range(len(truth_sites)):
         next_result = result_template.copy()
 
@@ -108,9 +106,86 @@ def main(genotyped_jvcf, truth_jvcf, region: Region, output_file):
         next_result["genotyped_site_num"] = site_num
         next_result["truth_site_num"] = i
         site_num += 1
-        # print("\t".join(map(str, next_result.values())) + "\n")
-        fout.write("\t".join(map(str, next_result.values())) + "\n")
-    fout.close()
+        result.append("\t".join(map(str, next_result.values())))
+    return result
+
+
+def get_truth_regions(truth_list: Path) -> List[Tuple[Path, Region]]:
+    """Reads lines of 'truth_jvcf<tab>region', region as in samtools/bcftools"""
+    result = list()
+    with truth_list.open() as fin:
+        for line in fin:
+            if line.strip() == "":
+                continue
+            truth_jvcf, region_str = line.rstrip("\n").split("\t")
+            result.append((Path(truth_jvcf), get_region(region_str)))
+    return result
+
+
+def evaluate_batch(
+    genotyped_jvcf: Path, truth_regions: List[Tuple[Path, Region]], output_file: Path
+):
+    """
+    Evaluates all :param: truth_regions against a single genotyped jVCF, loaded once and
+    indexed by position. Empty truth jVCFs (no closest sequence found) are skipped.
+    """
+    genotyped_sites = load_jvcf(genotyped_jvcf)["Sites"]
+    sites_index = SitesIndex(genotyped_sites)
+    with output_file.open("w") as fout:
+        fout.write("\t".join(result_fields) + "\n")
+        for truth_jvcf, region in truth_regions:
+            if truth_jvcf.stat().st_size == 0:
+                continue
+            site_num = sites_index.first_idx_in_region(region)
+            sample, gene = get_sample_and_gene(truth_jvcf)
+            lines = evaluate_region(
+                genotyped_sites, site_num, load_jvcf(truth_jvcf), sample, gene
+            )
+            for line in lines:
+                fout.write(line + "\n")
+
+
+@click.command()
+@click.option(
+    "-p",
+    help="print output tsv columns and exit",
+    is_flag=True,
+    callback=print_cols,
+    expose_value=False,
+    is_eager=True,
+)
+@click.argument("genotyped_jvcf", type=click.Path(exists=True))
+@click.argument("truth_input", type=click.Path(exists=True))
+@click.argument("output_file", type=click.Path())
+@click.option(
+    "--region",
+    "-r",
+    help="In the form 'SEG:start-end', as in samtools/bcftools",
+    default=None,
+    callback=click_get_region,
+)
+def main(genotyped_jvcf, truth_input, region: Region, output_file):
+    """
+    :genotyped_jvcf: A single sample jvcf which either has same sites as :truth_input: or has sites in :region: corresponding to :truth_input:
+
+    :truth_input: a truth jvcf, or a file of 'truth_jvcf<tab>region' lines for batch mode, in which case :region: is not used.
+    """
+    truth_input = Path(truth_input)
+    if truth_input.suffix != ".json":
+        evaluate_batch(
+            Path(genotyped_jvcf), get_truth_regions(truth_input), Path(output_file)
+        )
+        return
+
+    genotyped_sites = load_jvcf(genotyped_jvcf)["Sites"]
+    site_num = first_idx_in_region(genotyped_sites, region)
+    sample, gene = get_sample_and_gene(truth_input)
+    lines = evaluate_region(
+        genotyped_sites, site_num, load_jvcf(truth_input), sample, gene
+    )
+    with open(output_file, "w") as fout:
+        for line in lines:
+            fout.write(line + "\n")
 
 
 if __name__ == "__main__":
@@ -1,11 +1,25 @@
+"""
+Finds the closest input sequence to each (sample, gene) assembly portion: the read with the lowest
+NM (edit distance) in the alignment file, at each of several MAPQ thresholds.
+
+Takes a single sam file, or in batch mode a directory of sam files or a file of sam file names (one per line),
+all processed in one invocation and written to one table with a header.
+"""
+
 from pacb_ilmn_validation.process_alignments import load_gene_lengths
 
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from pathlib import Path
-from typing import Tuple
+from typing import Dict, List, Optional, Tuple
 
 from pysam import AlignmentFile, AlignedSegment
 import click
 
+DEFAULT_MIN_MAPQS = [0, 20, 40]
+STATS_HEADER = "gene\tsample\tNM\tcondition\tquery"
+
 
 def get_gene_and_sample_name(sam_fname: Path) -> Tuple[str, str]:
     elements = sam_fname.stem.split("_")
@@ -14,53 +28,98 @@ def get_gene_and_sample_name(sam_fname: Path) -> Tuple[str, str]:
     return gene, sample
 
 
-class BestRead:
-    def __init__(self, min_mapq: int = 0, min_qlen: int = 0):
-        self.min_mapq = min_mapq
-        self.best_read = None
-        self.min_qlen = min_qlen
-
-    def best_NM(self):
-        if self.best_read is None:
-            return "NA"
-        try:
-            return self.best_read.get_tag("NM")
-        except KeyError:
-            return "NA"
-
-    def best_scaled_NM(self, gene_length: int):
-        best_NM = self.best_NM()
-        if best_NM == "NA":
-            return "NA"
-        return best_NM / gene_length
+class BestReads:
+    """
+    Tracks the read with the lowest NM among reads of MAPQ strictly above each of :param: min_mapqs,
+    in one pass over the reads.
+    """
 
-    def best_query(self):
-        if self.best_read is None:
-            return "NA"
-        return self.best_read.qname
+    def __init__(self, min_mapqs: List[int], min_qlen: int = 0):
+        self.min_mapqs = list(min_mapqs)
+        self.min_qlen = min_qlen
+        self.sorted_mapqs = sorted(set(min_mapqs))
+        self.best_NMs: List[Optional[int]] = [None] * len(self.sorted_mapqs)
+        self.best_queries: List[Optional[str]] = [None] * len(self.sorted_mapqs)
 
     def update(self, read: AlignedSegment):
+        if read.qlen < self.min_qlen:
+            return
         try:
-            if read.qlen < self.min_qlen:
-                return
             read_NM = read.get_tag("NM")
-            if read.mapping_quality <= self.min_mapq:
-                return
-            best_NM = self.best_NM()
-            if best_NM == "NA" or read_NM < self.best_NM():
-                self.best_read = read
         except KeyError:
             return
+        # Thresholds below the read's MAPQ are a prefix of the sorted thresholds
+        num_passed = bisect_left(self.sorted_mapqs, read.mapping_quality)
+        for idx in range(num_passed):
+            if self.best_NMs[idx] is None or read_NM < self.best_NMs[idx]:
+                self.best_NMs[idx] = read_NM
+                self.best_queries[idx] = read.qname
+
+    def output_lines(self, gene_length: int) -> List[str]:
+        result = list()
+        for min_mapq in self.min_mapqs:
+            idx = self.sorted_mapqs.index(min_mapq)
+            best_NM = self.best_NMs[idx]
+            best_scaled_NM = "NA" if best_NM is None else best_NM / gene_length
+            best_query = "NA" if best_NM is None else self.best_queries[idx]
+            condition = f"closest_in_prg_mapq_{min_mapq}"
+            result.append(f"{best_scaled_NM}\t{condition}\t{best_query}")
+        return result
+
+
+def get_stats_lines(
+    sam_fname: Path, gene_lengths: Dict[str, int], min_mapqs: List[int], min_qlen: int
+) -> List[str]:
+    """One line per MAPQ threshold, prefixed by the gene and sample of :param: sam_fname"""
+    best_reads = BestReads(min_mapqs, min_qlen)
+    samfile = AlignmentFile(str(sam_fname), "r")
+    for read in samfile.fetch(until_eof=True):
+        best_reads.update(read)
+    samfile.close()
+
+    gene, sample = get_gene_and_sample_name(sam_fname)
+    gene_length = gene_lengths[gene]
+    return [
+        f"{gene}\t{sample}\t{output_line}"
+        for output_line in best_reads.output_lines(gene_length)
+    ]
 
-    def output_line(self, gene_length: int):
-        condition = f"closest_in_prg_mapq_{self.min_mapq}"
-        best_scaled_NM = self.best_scaled_NM(gene_length)
-        return f"{best_scaled_NM}\t{condition}\t{self.best_query()}"
+
+def get_sam_files(sam_input: Path) -> List[Path]:
+    """The sam files in directory :param: sam_input, or listed in file :param: sam_input"""
+    if sam_input.is_dir():
+        return sorted(sam_input.glob("*.sam"))
+    with sam_input.open() as fin:
+        return [Path(line.strip()) for line in fin if line.strip() != ""]
+
+
+def write_batch_stats(
+    sam_files: List[Path],
+    gene_lengths: Dict[str, int],
+    min_mapqs: List[int],
+    min_qlen: int,
+    output_file: Path,
+    threads: int,
+):
+    with ProcessPoolExecutor(max_workers=threads) as executor:
+        all_lines = executor.map(
+            get_stats_lines,
+            sam_files,
+            repeat(gene_lengths),
+            repeat(min_mapqs),
+            repeat(min_qlen),
+            chunksize=max(1, len(sam_files) // (threads * 4)),
+        )
+        with output_file.open("w") as fout:
+            fout.write(STATS_HEADER + "\n")
+            for lines in all_lines:
+                for line in lines:
+                    fout.write(line + "\n")
 
 
 @click.command()
 @click.argument(
-    "sam_fname",
+    "sam_input",
     type=click.Path(exists=True),
 )
 @click.argument("input_bed", type=click.Path(exists=True))
@@ -71,25 +130,44 @@ class BestRead:
     help="minimum length of mapped query to be considered",
     default=0,
 )
-def main(sam_fname, input_bed, output_file, min_qlen):
-    best_reads = [
-        BestRead(min_mapq=0, min_qlen=min_qlen),
-        BestRead(min_mapq=20, min_qlen=min_qlen),
-        BestRead(min_mapq=40, min_qlen=min_qlen),
-    ]
-    samfile = AlignmentFile(sam_fname, "r")
-    for read in samfile.fetch(until_eof=True):
-        for best_read in best_reads:
-            best_read.update(read)
-
-    gene, sample = get_gene_and_sample_name(Path(sam_fname))
-    gene_length = load_gene_lengths(Path(input_bed))[gene]
-
-    with open(output_file, "w") as fout:
-        for best_read in best_reads:
-            output_line = best_read.output_line(gene_length)
-            output_line = f"{gene}\t{sample}\t{output_line}\n"
-            fout.write(output_line)
+@click.option(
+    "--min_mapq",
+    "min_mapqs",
+    type=int,
+    multiple=True,
+    help="MAPQ threshold: reads must have MAPQ above it to be considered. Can be repeated.",
+    default=DEFAULT_MIN_MAPQS,
+    show_default=True,
+)
+@click.option(
+    "--threads",
+    "-t",
+    help="Number of worker processes in batch mode",
+    type=int,
+    default=1,
+    show_default=True,
+)
+def main(sam_input, input_bed, output_file, min_qlen, min_mapqs, threads):
+    """
+    :param: sam_input: a sam file, a directory of sam files or a file of sam file names.
+    In the latter two cases, writes a single table with a header for all files.
+    """
+    sam_input = Path(sam_input)
+    gene_lengths = load_gene_lengths(Path(input_bed))
+    if sam_input.suffix == ".sam" and sam_input.is_file():
+        lines = get_stats_lines(sam_input, gene_lengths, min_mapqs, min_qlen)
+        with open(output_file, "w") as fout:
+            for line in lines:
+                fout.write(line + "\n")
+        return
+
+    sam_files = get_sam_files(sam_input)
+    if len(sam_files) == 0:
+        print(f"Error: no .sam files in {sam_input}")
+        exit(1)
+    write_batch_stats(
+        sam_files, gene_lengths, min_mapqs, min_qlen, Path(output_file), threads
+    )
 
 
 if __name__ == "__main__":
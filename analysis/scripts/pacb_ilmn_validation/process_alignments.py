@@ -8,9 +8,12 @@ And writes the stats to a tsv file.
 from collections import namedtuple
 from typing import Dict, Tuple, List
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 
 from pysam import AlignmentFile
 import click
+import pandas as pd
 
 
 class MultipleAlignmentsError(Exception):
@@ -19,7 +22,19 @@ class MultipleAlignmentsError(Exception):
 
 Scores = namedtuple("Scores", ["NM", "AS", "MAPQ"])
 GeneScores = Dict[str, Scores]
-BaselineScores: Dict[str, GeneScores] = dict()
+BASELINE_CONDITION = "baseline_ref"
+STATS_FIELDNAMES = [
+    "sample",
+    "gene",
+    "condition",
+    "NM",
+    "AS",
+    "MAPQ",
+    "delta_NM",
+    "delta_AS",
+    "delta_MAPQ",
+    "mask_overlap",
+]
 
 MaskDict = Dict[str, float]
 
@@ -79,78 +94,90 @@ def get_scores(sam_fname: Path, gene_lengths: Dict[str, int]) -> GeneScores:
     return result
 
 
-def compute_delta(scores_1: Scores, scores_2: Scores) -> Scores:
-    newattrs = dict()
-    for attr in Scores._fields:
-        score_1 = getattr(scores_1, attr)
-        score_2 = getattr(scores_2, attr)
-        if score_1 == "NA" or score_2 == "NA":
-            newattrs[attr] = "NA"
-        else:
-            newattrs[attr] = getattr(scores_2, attr) - getattr(scores_1, attr)
-    return Scores(**newattrs)
-
-
-def get_delta_scores(baseline_genes: GeneScores, query_genes: GeneScores) -> GeneScores:
-    """Computes the scores of genes in `query_genes` minus the scores of genes in `baseline_genes`"""
-    if baseline_genes.keys() != query_genes.keys():
-        raise ValueError(
-            f"Cannot get score deltas for dicts without same keys: {baseline_genes} vs {query_genes}"
-        )
-    result: GeneScores = dict()
-    for gene_name, scores_1 in baseline_genes.items():
-        scores_2 = query_genes[gene_name]
-        result[gene_name] = compute_delta(scores_1, scores_2)
-    return result
+def get_score_table(
+    sam_file_list: List[Path], gene_lengths: Dict[str, int], threads: int
+) -> pd.DataFrame:
+    """
+    Scores of all genes in all files, one row per (sample, condition, gene), in file and then alignment order.
+    Each file is parsed once, by a pool of :param: threads worker processes.
+    """
+    if threads > 1:
+        with ProcessPoolExecutor(max_workers=threads) as executor:
+            all_scores = list(
+                executor.map(get_scores, sam_file_list, repeat(gene_lengths))
+            )
+    else:
+        all_scores = [
+            get_scores(sam_fname, gene_lengths) for sam_fname in sam_file_list
+        ]
+    records = list()
+    for file_idx, (sam_fname, scores) in enumerate(zip(sam_file_list, all_scores)):
+        sample, condition = get_sample_and_condition_name(sam_fname)
+        for gene, gene_scores in scores.items():
+            values = [None if score == "NA" else score for score in gene_scores]
+            records.append((file_idx, sample, condition, gene, *values))
+    table = pd.DataFrame.from_records(
+        records, columns=["file_idx", "sample", "condition", "gene", *Scores._fields]
+    )
+    return table.astype({"NM": "float64", "AS": "Int64", "MAPQ": "Int64"})
+
+
+def check_same_genes(table: pd.DataFrame, baseline: pd.DataFrame) -> None:
+    baseline_genes = {
+        sample: set(genes) for sample, genes in baseline.groupby("sample")["gene"]
+    }
+    for (_, sample, condition), genes in table.groupby(
+        ["file_idx", "sample", "condition"]
+    )["gene"]:
+        if sample not in baseline_genes:
+            raise ValueError(f"No {BASELINE_CONDITION} alignments for sample {sample}")
+        if set(genes) != baseline_genes[sample]:
+            raise ValueError(
+                f"Cannot get score deltas for {condition} of sample {sample}: "
+                f"genes differ from those of {BASELINE_CONDITION}"
+            )
 
 
-def write_stats(
-    sam_file_list: List[Path], output_stats: Path, gene_lengths, mask_overlaps: MaskDict
-):
+def add_delta_scores(table: pd.DataFrame) -> pd.DataFrame:
+    """
+    Adds the scores of each gene minus its scores in the baseline condition of the same sample.
+    Rows of each file are ordered as the genes of the baseline file.
+    """
+    baseline = table[table["condition"] == BASELINE_CONDITION]
+    check_same_genes(table, baseline)
+    baseline = baseline.set_index(["sample", "gene"])
+    baseline["gene_rank"] = baseline.groupby(level="sample").cumcount()
+    aligned = baseline.reindex(
+        pd.MultiIndex.from_frame(table[["sample", "gene"]])
+    ).set_axis(table.index)
+    result = table.copy()
+    for field in Scores._fields:
+        result[f"delta_{field}"] = table[field] - aligned[field]
+    result["gene_rank"] = aligned["gene_rank"]
+    return result.sort_values(["file_idx", "gene_rank"], kind="stable")
 
-    # First pass: get baseline scores
-    baseline_scores: BaselineScores = dict()
-    for sam_fname in sam_file_list:
-        sample, condition = get_sample_and_condition_name(sam_fname)
-        if condition == "baseline_ref":
-            baseline_scores[sample] = get_scores(sam_fname, gene_lengths)
 
-    # Second pass: get scores and deltas relative to baseline
+def to_strings(column: pd.Series) -> List[str]:
+    """Formats values as str() does for the underlying Python values, with 'NA' for missing values"""
+    return ["NA" if pd.isna(value) else str(value) for value in column.astype(object)]
+
+
+def write_stats(
+    sam_file_list: List[Path],
+    output_stats: Path,
+    gene_lengths,
+    mask_overlaps: MaskDict,
+    threads: int = 1,
+):
+    table = add_delta_scores(get_score_table(sam_file_list, gene_lengths, threads))
+    mask_keys = table["gene"] + "_" + table["sample"] + "_" + table["condition"]
+    columns = [to_strings(table[fieldname]) for fieldname in STATS_FIELDNAMES[:-1]]
+    # Not a table column: pandas would cast the default overlap of 0 to float
+    columns.append([str(mask_overlaps.get(key, 0)) for key in mask_keys])
     with output_stats.open("w") as stats_file:
-        fieldnames = [
-            "sample",
-            "gene",
-            "condition",
-            "NM",
-            "AS",
-            "MAPQ",
-            "delta_NM",
-            "delta_AS",
-            "delta_MAPQ",
-            "mask_overlap",
-        ]
-        stats_file.write("\t".join(fieldnames) + "\n")
-
-        for sam_fname in sam_file_list:
-            sample, condition = get_sample_and_condition_name(sam_fname)
-            scores = get_scores(sam_fname, gene_lengths)
-            delta_scores = get_delta_scores(baseline_scores[sample], scores)
-            for gene in delta_scores:
-                mask_key = f"{gene}_{sample}_{condition}"
-                mask_overlap = mask_overlaps.get(mask_key, 0)
-                row = [
-                    sample,
-                    gene,
-                    condition,
-                    scores[gene].NM,
-                    scores[gene].AS,
-                    scores[gene].MAPQ,
-                    delta_scores[gene].NM,
-                    delta_scores[gene].AS,
-                    delta_scores[gene].MAPQ,
-                    mask_overlap,
-                ]
-                stats_file.write("\t".join(map(str, row)) + "\n")
+        stats_file.write("\t".join(STATS_FIELDNAMES) + "\n")
+        for row in zip(*columns):
+            stats_file.write("\t".join(row) + "\n")
 
 
 @click.command()
@@ -161,7 +188,15 @@ def write_stats(
 @click.argument("input_bed", type=click.Path(exists=True))
 @click.argument("output_file", type=str)
 @click.option("--mask_bed", type=click.Path(exists=True), default=None)
-def main(input_dir, input_bed, output_file, mask_bed):
+@click.option(
+    "--threads",
+    "-t",
+    help="Number of worker processes parsing the sam files",
+    type=int,
+    default=1,
+    show_default=True,
+)
+def main(input_dir, input_bed, output_file, mask_bed, threads):
     output_file = Path(output_file).resolve()
     output_file.parent.mkdir(exist_ok=True)
 
@@ -174,7 +209,7 @@ def main(input_dir, input_bed, output_file, mask_bed):
         gene_lengths = load_gene_lengths(Path(input_bed))
         mask_overlaps = load_mask_bed(mask_bed)
 
-        write_stats(sam_file_list, output_file, gene_lengths, mask_overlaps)
+        write_stats(sam_file_list, output_file, gene_lengths, mask_overlaps, threads)
     else:
         print(f"Found existing {output_file}, nothing to do. Delete it to regenerate")
 
@@ -1,59 +1,162 @@
 """
-Converts a Bed file expressed in terms of a base reference into 
+Converts a Bed file expressed in terms of a base reference into
 a Bed expressed in terms of a personalised reference.
+
+Several (input.bed, rebasing_map.json, output.bed) triples can be given in one invocation:
+each rebasing map is loaded once, and cached in binary form next to its json file
+so that later translations do not re-parse the json.
 """
+
 import sys
 from csv import reader as csv_reader
 from pathlib import Path
+from typing import Dict, List, NamedTuple
+
+import numpy as np
+
+from lazy_imports import lazy_import
+
+# Only needed to parse rebasing maps: translations from cached region starts run without gramtools
+seq_region_map = lazy_import("gramtools.commands.genotype.seq_region_map")
+
+Chrom = str
+
 
-from gramtools.commands.genotype.seq_region_map import (
-    SearchableSeqRegionsMap,
-    BisectTarget,
-    Chrom,
-)
+class RegionStarts(NamedTuple):
+    """Start coordinates of the regions of a chromosome in a rebasing map, sorted by base_ref_start"""
 
+    base_ref: np.ndarray
+    pers_ref: np.ndarray
 
-def translate_pos(chrom: Chrom, pos: int, searcher: SearchableSeqRegionsMap) -> int:
-    region_idx = searcher.bisect(chrom, pos, BisectTarget.BASE_REF)
+
+RebasingStarts = Dict[Chrom, RegionStarts]
+
+
+def translate_pos(
+    chrom: Chrom, pos: int, searcher: "seq_region_map.SearchableSeqRegionsMap"
+) -> int:
+    region_idx = searcher.bisect(chrom, pos, seq_region_map.BisectTarget.BASE_REF)
     region = searcher.get_region(chrom, region_idx)
     base_ref_offset = pos - region.base_ref_start
     translation = region.pers_ref_start + base_ref_offset
     return translation
 
 
+def translate_positions(positions: np.ndarray, starts: RegionStarts) -> np.ndarray:
+    """
+    Vectorised `translate_pos` for all :param: positions of a chromosome, in any order:
+    the region of each position is found by binary search in the sorted region starts.
+    Positions before the first region are not an error: they are offset from the start of
+    the first region, as if it extended leftwards. Rebasing maps start at position 1,
+    so these are positions below 1, e.g. from bed intervals starting at 0.
+    """
+    region_indices = np.searchsorted(starts.base_ref, positions, side="right") - 1
+    region_indices = np.maximum(region_indices, 0)
+    return starts.pers_ref[region_indices] + positions - starts.base_ref[region_indices]
+
+
+def cache_path(rebasing_map: Path) -> Path:
+    return rebasing_map.with_suffix(".starts.npz")
+
+
+def save_rebasing_starts(fname: Path, rebasing_starts: RebasingStarts) -> None:
+    chroms = list(rebasing_starts)
+    with fname.open("wb") as fout:
+        np.savez(
+            fout,
+            chroms=np.array(chroms, dtype=str),
+            sizes=np.array([len(rebasing_starts[chrom].base_ref) for chrom in chroms]),
+            base_ref=np.concatenate(
+                [rebasing_starts[chrom].base_ref for chrom in chroms] + [[]]
+            ).astype(np.int64),
+            pers_ref=np.concatenate(
+                [rebasing_starts[chrom].pers_ref for chrom in chroms] + [[]]
+            ).astype(np.int64),
+        )
+
+
+def load_cached_rebasing_starts(fname: Path) -> RebasingStarts:
+    with np.load(fname) as saved:
+        offsets = np.concatenate([[0], np.cumsum(saved["sizes"])])
+        return {
+            chrom: RegionStarts(
+                saved["base_ref"][start:end], saved["pers_ref"][start:end]
+            )
+            for chrom, start, end in zip(
+                saved["chroms"].tolist(), offsets[:-1], offsets[1:]
+            )
+        }
+
+
+def load_rebasing_starts(rebasing_map: Path) -> RebasingStarts:
+    """
+    Loads the region starts of :param: rebasing_map, from its binary cache if that is
+    more recent than the json file. The cache is (re)written otherwise.
+    """
+    cache_fname = cache_path(rebasing_map)
+    if (
+        cache_fname.exists()
+        and cache_fname.stat().st_mtime >= rebasing_map.stat().st_mtime
+    ):
+        return load_cached_rebasing_starts(cache_fname)
+    searcher = seq_region_map.SearchableSeqRegionsMap.load_from(rebasing_map)
+    result = dict()
+    for chrom, regions in searcher.value.items():
+        result[chrom] = RegionStarts(
+            np.array([region.base_ref_start for region in regions], dtype=np.int64),
+            np.array([region.pers_ref_start for region in regions], dtype=np.int64),
+        )
+    save_rebasing_starts(cache_fname, result)
+    return result
+
+
+def translate_bed(input_bed: Path, rebasing_starts: RebasingStarts, output_bed: Path):
+    with input_bed.open("r") as bed_in:
+        lines = list(csv_reader(bed_in, delimiter="\t"))
+
+    line_indices: Dict[Chrom, List[int]] = dict()
+    for line_idx, line in enumerate(lines):
+        line_indices.setdefault(line[0], list()).append(line_idx)
+    translated_starts = np.empty(len(lines), dtype=np.int64)
+    translated_ends = np.empty(len(lines), dtype=np.int64)
+    for chrom, indices in line_indices.items():
+        if chrom not in rebasing_starts:
+            raise KeyError(f"Chromosome {chrom} of {input_bed} not in rebasing map")
+        # Bed start is 0-based, SeqRegion coords are 1-based
+        starts = np.array([int(lines[idx][1]) - 1 for idx in indices], dtype=np.int64)
+        ends = np.array([int(lines[idx][2]) for idx in indices], dtype=np.int64)
+        translated_starts[indices] = (
+            translate_positions(starts, rebasing_starts[chrom]) - 1
+        )
+        translated_ends[indices] = translate_positions(ends, rebasing_starts[chrom])
+
+    with output_bed.open("w") as bed_out:
+        for line, start, end in zip(lines, translated_starts, translated_ends):
+            bed_out.write("\t".join([line[0], str(start), str(end)] + line[3:]) + "\n")
+
+
 def usage():
-    print(f"{sys.argv[0]} input.bed rebasing_map.json output.bed")
+    print(
+        f"{sys.argv[0]} input.bed rebasing_map.json output.bed "
+        "[input.bed rebasing_map.json output.bed ...]"
+    )
     exit(1)
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 4:
+    if len(sys.argv) < 4 or (len(sys.argv) - 1) % 3 != 0:
         usage()
 
-    input_bed: Path = Path(sys.argv[1]).resolve()
-    rebasing_map: Path = Path(sys.argv[2]).resolve()
-    output_bed: Path = Path(sys.argv[3]).resolve()
-
-    for fname in (input_bed, rebasing_map, output_bed.parent):
-        if not fname.exists():
-            print(f"Error: {fname} required but not found")
-            usage()
-
-    searcher = SearchableSeqRegionsMap.load_from(rebasing_map)
-    with input_bed.open("r") as bed_in, output_bed.open("w") as bed_out:
-        reader = csv_reader(bed_in, delimiter="\t")
-        for line in reader:
-            chrom = line[0]
-            start_pos = (
-                int(line[1]) - 1
-            )  # Bed start is 0-based, SeqRegion coords are 1-based
-            end_pos = int(line[2])
-
-            translated_start_pos = translate_pos(chrom, start_pos, searcher)
-            translated_start_pos = str(translated_start_pos - 1)
-            translated_end_pos = translate_pos(chrom, end_pos, searcher).__str__()
-
-            bed_out.write(
-                "\t".join([chrom, translated_start_pos, translated_end_pos] + line[3:])
-                + "\n"
-            )
+    fnames = [Path(arg).resolve() for arg in sys.argv[1:]]
+    triples = [fnames[i : i + 3] for i in range(0, len(fnames), 3)]
+    for input_bed, rebasing_map, output_bed in triples:
+        for fname in (input_bed, rebasing_map, output_bed.parent):
+            if not fname.exists():
+                print(f"Error: {fname} required but not found")
+                usage()
+
+    loaded_starts: Dict[Path, RebasingStarts] = dict()
+    for input_bed, rebasing_map, output_bed in triples:
+        if rebasing_map not in loaded_starts:
+            loaded_starts[rebasing_map] = load_rebasing_starts(rebasing_map)
+        translate_bed(input_bed, loaded_starts[rebasing_map], output_bed)
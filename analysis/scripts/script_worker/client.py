@@ -0,0 +1,138 @@
+"""
+Thin client of the script worker (see server.py): runs a script as `python3 script.py args`
+would, but in a warm interpreter forked by the worker listening on a Unix socket.
+
+The client's stdin, stdout and stderr are passed to the worker, so shell redirections
+work as usual, and the script's exit code is returned.
+SIGTERM, SIGINT and SIGHUP received by the client are forwarded to the script, and
+the client then exits as the script does; if the client is killed outright, the worker
+kills the script.
+If no worker is listening on the socket (e.g. in a cluster job on another node),
+the script is run in a fresh interpreter instead.
+
+Usage: client.py SOCKET SCRIPT [ARGS...]
+       client.py SOCKET --ping
+       client.py SOCKET --stop
+"""
+
+import json
+import os
+import signal
+import socket
+import sys
+from array import array
+from pathlib import Path
+from typing import Dict, List
+
+# Standard file descriptors passed to the worker: stdin, stdout, stderr
+PASSED_FDS = [0, 1, 2]
+MAX_RESPONSE_SIZE = 4096
+FORWARDED_SIGNALS = [signal.SIGTERM, signal.SIGINT, signal.SIGHUP]
+
+
+class WorkerUnavailable(Exception):
+    pass
+
+
+def send_request(socket_path: str, request: Dict, forward_signals=False) -> Dict:
+    """
+    Sends :param: request, with the standard file descriptors, and waits for the response.
+    Raises WorkerUnavailable if no worker listens on :param: socket_path.
+    :param: forward_signals: whether to forward FORWARDED_SIGNALS to the worker while waiting
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+        except (FileNotFoundError, ConnectionRefusedError) as err:
+            raise WorkerUnavailable(str(err)) from None
+        message = json.dumps(request).encode() + b"\n"
+        fds = array("i", PASSED_FDS)
+        sock.sendmsg([message], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, fds)])
+        previous_handlers = dict()
+        if forward_signals:
+            for signum in FORWARDED_SIGNALS:
+                previous_handlers[signum] = signal.signal(
+                    signum, lambda signum, frame: forward_signal(sock, signum)
+                )
+        try:
+            response = b""
+            while not response.endswith(b"\n"):
+                chunk = sock.recv(MAX_RESPONSE_SIZE)
+                if chunk == b"":
+                    raise RuntimeError(
+                        f"Script worker at {socket_path} closed the connection without a response"
+                    )
+                response += chunk
+        finally:
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+    return json.loads(response)
+
+
+def forward_signal(sock: socket.socket, signum: int):
+    try:
+        sock.sendall(json.dumps({"signal": signum}).encode() + b"\n")
+    except OSError:  # The worker went away: the response will say what happened
+        pass
+
+
+def run_script(socket_path: str, script: str, args: List[str]) -> int:
+    """The exit code of the script, negative if it was killed by a signal"""
+    request = {
+        "script": str(Path(script).resolve()),
+        "args": args,
+        "cwd": os.getcwd(),
+        "env": dict(os.environ),
+    }
+    return send_request(socket_path, request, forward_signals=True)["returncode"]
+
+
+def exit_as_script(returncode: int):
+    """Exits with the script's exit code, or dies from the signal that killed it"""
+    sys.stdout.flush()
+    if returncode < 0:
+        signal.signal(-returncode, signal.SIG_DFL)
+        os.kill(os.getpid(), -returncode)
+    exit(returncode if returncode >= 0 else 128 - returncode)
+
+
+def ping_worker(socket_path: str) -> Dict:
+    """The worker's response to a ping, including the identity it was started with"""
+    return send_request(socket_path, {"ping": True})
+
+
+def stop_worker(socket_path: str) -> bool:
+    """Returns whether a worker was listening, and so was stopped"""
+    try:
+        send_request(socket_path, {"stop": True})
+    except WorkerUnavailable:
+        return False
+    return True
+
+
+def usage():
+    print(
+        f"Usage: {sys.argv[0]} socket script [args...] | socket --ping | socket --stop"
+    )
+    exit(1)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        usage()
+    socket_path, script, args = sys.argv[1], sys.argv[2], sys.argv[3:]
+    if script == "--stop":
+        stop_worker(socket_path)
+        exit(0)
+    if script == "--ping":
+        try:
+            print(json.dumps(ping_worker(socket_path)))
+        except WorkerUnavailable:
+            exit(1)
+        exit(0)
+
+    try:
+        returncode = run_script(socket_path, script, args)
+    except WorkerUnavailable:
+        os.execv(sys.executable, [sys.executable, script] + args)
+    exit_as_script(returncode)
@@ -0,0 +1,274 @@
+"""
+Script worker: a local service that keeps a Python interpreter warm, with heavy modules
+already imported, and runs scripts of analysis/scripts on request from client.py.
+
+Each request runs in a process forked from the worker, so it starts with the preloaded
+modules in memory, and scripts cannot affect each other or the worker. The script is run
+as `python3 script.py args` would: as __main__, with the client's arguments, working
+directory, environment and standard file descriptors.
+
+The script runs in its own process group, which is sent the signals the client forwards,
+and killed if the client goes away: a killed job must not leave its script writing outputs.
+The worker exits when the process owning it (the Snakemake run) no longer exists.
+"""
+
+import importlib
+import json
+import os
+import runpy
+import select
+import signal
+import socket
+import socketserver
+import sys
+import traceback
+from array import array
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import click
+
+from script_worker.client import (
+    MAX_RESPONSE_SIZE,
+    PASSED_FDS,
+    WorkerUnavailable,
+    ping_worker,
+)
+
+DEFAULT_PRELOADS = ["numpy", "pandas", "pysam", "edlib", "jvcf_processing"]
+MAX_REQUEST_CHUNK = 65536
+
+
+class ScriptWorker(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+    identity: Dict = dict()
+    owner_pid: Optional[int] = None
+
+    def service_actions(self):
+        super().service_actions()
+        if self.owner_pid is not None and not process_exists(self.owner_pid):
+            print(f"Owner process {self.owner_pid} exited, stopping", flush=True)
+            sys.exit(0)
+
+
+def process_exists(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def receive_request(sock: socket.socket) -> Tuple[Dict, List[int], bytes]:
+    """
+    The json request of a client, the file descriptors sent with it,
+    and any data the client sent after the request (forwarded signals)
+    """
+    fds = array("i")
+    message, ancdata, _, _ = sock.recvmsg(
+        MAX_REQUEST_CHUNK, socket.CMSG_LEN(len(PASSED_FDS) * fds.itemsize)
+    )
+    for level, msg_type, data in ancdata:
+        if level == socket.SOL_SOCKET and msg_type == socket.SCM_RIGHTS:
+            fds.frombytes(data[: len(data) - (len(data) % fds.itemsize)])
+    while b"\n" not in message:
+        chunk = sock.recv(MAX_REQUEST_CHUNK)
+        if chunk == b"":
+            raise ConnectionError("Client closed the connection mid-request")
+        message += chunk
+    request, pending = message.split(b"\n", 1)
+    return json.loads(request), list(fds), pending
+
+
+def exit_status_code(status: int) -> int:
+    """Exit code of a process from its os.waitpid status, negative if killed by a signal"""
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def exit_code(code) -> int:
+    """Exit code of an interpreter exiting with sys.exit(:param: code)"""
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    print(code, file=sys.stderr)
+    return 1
+
+
+def run_script(request: Dict) -> int:
+    try:
+        os.chdir(request["cwd"])
+        os.environ.clear()
+        os.environ.update(request["env"])
+        script = request["script"]
+        sys.argv = [script] + request["args"]
+        sys.path.insert(0, str(Path(script).parent))
+        runpy.run_path(script, run_name="__main__")
+    except SystemExit as exit_request:
+        return exit_code(exit_request.code)
+    except BaseException:
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+class ScriptRequestHandler(socketserver.BaseRequestHandler):
+    """Runs in the process forked for the request"""
+
+    def handle(self):
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        request, fds, pending = receive_request(self.request)
+        if "script" not in request:
+            for fd in fds:
+                os.close(fd)
+            if request.get("stop", False):
+                os.kill(os.getppid(), signal.SIGTERM)
+            self.respond({"running": True, "identity": self.server.identity})
+            return
+
+        # Set before forking, so that the script exiting is never missed
+        wakeup_read, wakeup_write = os.pipe()
+        os.set_blocking(wakeup_write, False)
+        signal.set_wakeup_fd(wakeup_write)
+        signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+        script_pid = os.fork()
+        if script_pid == 0:
+            signal.set_wakeup_fd(-1)
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            for fd in [wakeup_read, wakeup_write]:
+                os.close(fd)
+            self.request.close()
+            self.server.socket.close()
+            os.setpgid(0, 0)
+            for fd, std_fd in zip(fds, PASSED_FDS):
+                os.dup2(fd, std_fd)
+                os.close(fd)
+            returncode = run_script(request)
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(returncode)
+
+        # Only the script writes to the client's file descriptors
+        for fd in fds:
+            os.close(fd)
+        returncode = self.wait_for_script(script_pid, wakeup_read, pending)
+        if returncode is not None:
+            self.respond({"returncode": returncode})
+
+    def wait_for_script(
+        self, script_pid: int, wakeup_fd: int, pending: bytes
+    ) -> Optional[int]:
+        """
+        The script's exit code, after forwarding it the signals the client sends.
+        If the client goes away, kills the script's process group and returns None.
+        """
+        messages = pending
+        while True:
+            while b"\n" in messages:
+                message, messages = messages.split(b"\n", 1)
+                signum = json.loads(message)["signal"]
+                kill_process_group(script_pid, signum)
+            finished_pid, status = os.waitpid(script_pid, os.WNOHANG)
+            if finished_pid == script_pid:
+                return exit_status_code(status)
+
+            readable, _, _ = select.select([self.request, wakeup_fd], [], [])
+            if wakeup_fd in readable:
+                os.read(wakeup_fd, MAX_REQUEST_CHUNK)
+            if self.request in readable:
+                try:
+                    chunk = self.request.recv(MAX_REQUEST_CHUNK)
+                except ConnectionError:
+                    chunk = b""
+                if chunk == b"":
+                    kill_process_group(script_pid, signal.SIGKILL)
+                    os.waitpid(script_pid, 0)
+                    return None
+                messages += chunk
+
+    def respond(self, response: Dict):
+        message = json.dumps(response).encode() + b"\n"
+        assert len(message) <= MAX_RESPONSE_SIZE
+        try:
+            self.request.sendall(message)
+        except ConnectionError:  # The client was killed after the script finished
+            pass
+
+
+def kill_process_group(pgid: int, signum: int):
+    try:
+        os.killpg(pgid, signum)
+    except ProcessLookupError:  # Already exited
+        pass
+
+
+def preload_modules(modules: List[str]):
+    for module in modules:
+        try:
+            importlib.import_module(module)
+        except ImportError as err:
+            print(f"Warning: could not preload {module}: {err}", file=sys.stderr)
+
+
+def serve(
+    socket_path: Path,
+    preloads: List[str],
+    identity: Dict,
+    owner_pid: Optional[int] = None,
+):
+    try:
+        ping_worker(str(socket_path))
+        print(f"Error: a script worker already listens on {socket_path}")
+        exit(1)
+    except WorkerUnavailable:
+        pass
+    except (ConnectionError, ValueError):  # Not a script worker
+        pass
+    preload_modules(preloads)
+    socket_path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    if socket_path.exists():  # Left by a worker that did not stop cleanly
+        socket_path.unlink()
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    server = ScriptWorker(str(socket_path), ScriptRequestHandler)
+    server.identity = identity
+    server.owner_pid = owner_pid
+    try:
+        print(f"Script worker listening on {socket_path}", flush=True)
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if socket_path.exists():
+            socket_path.unlink()
+
+
+@click.command()
+@click.argument("socket_path", type=Path)
+@click.option(
+    "--preload",
+    "preloads",
+    multiple=True,
+    default=DEFAULT_PRELOADS,
+    show_default=True,
+    help="Module to import before serving requests. Can be repeated.",
+)
+@click.option(
+    "--identity",
+    default="{}",
+    help="json object describing the environment the worker serves, returned to pings",
+)
+@click.option(
+    "--owner_pid",
+    type=int,
+    default=None,
+    help="Stop serving once the process with this pid no longer exists",
+)
+def main(socket_path, preloads, identity, owner_pid):
+    serve(socket_path, list(preloads), json.loads(identity), owner_pid)
+
+
+if __name__ == "__main__":
+    main()
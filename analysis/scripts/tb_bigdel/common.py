@@ -1,5 +1,7 @@
 from pathlib import Path
-from typing import List
+from typing import List, Iterator, Iterable, Tuple
+from array import array
+from bisect import bisect_left, bisect_right
 
 
 class Interval:
@@ -46,6 +48,78 @@ class Interval:
 Intervals = List[Interval]
 
 
+class IntervalIndex:
+    """
+    Containment queries over a fixed set of Intervals, in logarithmic time.
+
+    Intervals are sorted by start, with starts and stops held in parallel arrays.
+    An interval spanning a query must start no further left than the longest indexed
+    interval allows, which bounds the bisected search window.
+    """
+
+    def __init__(self, intervals: Intervals):
+        self._intervals: Intervals = sorted(intervals)
+        self._starts = array("q", (interval.start for interval in self._intervals))
+        self._stops = array("q", (interval.stop for interval in self._intervals))
+        self._max_len = max(
+            (stop - start + 1 for start, stop in zip(self._starts, self._stops)),
+            default=0,
+        )
+
+    def __len__(self) -> int:
+        return len(self._intervals)
+
+    def __iter__(self) -> Iterator[Interval]:
+        return iter(self._intervals)
+
+    def spanning(self, interval: Interval) -> Intervals:
+        """Indexed intervals that span :param: interval"""
+        lo = bisect_left(self._starts, interval.stop - self._max_len + 1)
+        hi = bisect_right(self._starts, interval.start)
+        return [
+            self._intervals[i] for i in range(lo, hi) if self._stops[i] >= interval.stop
+        ]
+
+    def spanned_by(self, interval: Interval) -> Intervals:
+        """Indexed intervals that :param: interval spans"""
+        lo = bisect_left(self._starts, interval.start)
+        hi = bisect_right(self._starts, interval.stop)
+        return [
+            self._intervals[i] for i in range(lo, hi) if self._stops[i] <= interval.stop
+        ]
+
+
+def sweep_overlaps(
+    queries: Intervals, targets: Iterable[Interval]
+) -> Iterator[Tuple[Interval, Intervals]]:
+    """
+    Overlap join between two sets of Intervals, in one pass over both sorted by start.
+
+    Yields each query with the targets that overlap it (as per `target.overlaps(query)`),
+    in order of query start. Targets are only held while they can still overlap a query,
+    so they can be streamed; they must come sorted by start.
+    """
+    targets = iter(targets)
+    next_target = next(targets, None)
+    active: Intervals = list()
+    for query in sorted(queries):
+        while next_target is not None and next_target.start <= query.stop:
+            active.append(next_target)
+            prev_start, next_target = next_target.start, next(targets, None)
+            if next_target is not None and next_target.start < prev_start:
+                raise ValueError(
+                    f"Targets not sorted by start: {next_target} after {prev_start}"
+                )
+        # Queries come by increasing start, so targets ending before this one can be dropped
+        active = [target for target in active if target.stop >= query.start]
+        found = [
+            target
+            for target in active
+            if target.start <= query.stop and target.overlaps(query)
+        ]
+        yield query, found
+
+
 def load_input_dels(input_dels_bed) -> Intervals:
     """
     Loads deletions as Intervals from a bed file
@@ -8,7 +8,7 @@ import json
 import click
 from pysam import VariantFile, VariantRecord
 
-from tb_bigdel.common import Interval, Intervals, load_input_dels
+from tb_bigdel.common import Interval, Intervals, IntervalIndex, load_input_dels
 
 
 class VarContainer(Interval):
@@ -33,11 +33,11 @@ class VarContainer(Interval):
 VarContainers = List[VarContainer]
 
 
-def add_if_spanned(interval: Interval, containers: VarContainers) -> None:
+def add_if_spanned(interval: Interval, containers: IntervalIndex) -> None:
     """
     Record `interval` as spanned by a container
     """
-    spanners = [cand for cand in containers if cand.spans(interval)]
+    spanners = containers.spanning(interval)
     if len(spanners) > 1:
         raise ValueError(f"Found >1 variant spanning interval {interval}: {spanners}")
     elif len(spanners) == 1:
@@ -48,7 +48,7 @@ def add_if_spanned(interval: Interval, containers: VarContainers) -> None:
         spanners[0].num_ref_bases += len(interval)
 
 
-def find_nested_ref_sites(json_prg, regions: VarContainers):
+def find_nested_ref_sites(json_prg, regions: IntervalIndex):
     """
     Because jvcf encodes nesting, need to only find sites in it
     that are nested within the ref section of each region in `regions`.
@@ -67,12 +67,12 @@ def find_nested_ref_sites(json_prg, regions: VarContainers):
         site_interval = Interval(
             site["POS"] - TOLERANCE, site["POS"] + len(ref_allele) - 1
         )
-        spanned = [reg for reg in regions if site_interval.spans(reg)]
+        spanned = regions.spanned_by(site_interval)
         if len(spanned) == 0:
             continue
         elif len(spanned) > 1:
             raise ValueError(
-                f"In jvcf, found interval {interval} spanning multiple input deletions"
+                f"In jvcf, found interval {site_interval} spanning multiple input deletions"
             )
 
         # Remove any previously found interval that spans this found interval: this interval replaces it.
@@ -94,9 +94,10 @@ def find_nested_ref_sites(json_prg, regions: VarContainers):
         )
         result += added_sites
     # Check for bijection between input regions and their representation in jvcf, warn if not
+    found_index = IntervalIndex(all_found)
     missing_regions = []
     for reg in regions:
-        if not any(map(lambda interval: interval.spans(reg), all_found)):
+        if len(found_index.spanning(reg)) == 0:
             missing_regions.append(reg)
     if len(missing_regions) > 0:
         print(f"Warning: could not find: {missing_regions} in jvcf")
@@ -117,7 +118,7 @@ def record_pair_yielder(vcf_file) -> Tuple[VariantRecord, VariantRecord]:
         cur_record = next_record
 
 
-def add_vcf_metrics(vcf_file, input_dels: VarContainers) -> None:
+def add_vcf_metrics(vcf_file, input_dels: IntervalIndex) -> None:
     for cur_rec, next_rec in record_pair_yielder(vcf_file):
         cur_rec_stop = cur_rec.pos + len(cur_rec.ref) - 1
         # Ignore a record if it overlaps with next one
@@ -128,7 +129,7 @@ def add_vcf_metrics(vcf_file, input_dels: VarContainers) -> None:
         add_if_spanned(interval, input_dels)
 
 
-def add_jvcf_metrics(jvcf_file, input_dels: VarContainers) -> None:
+def add_jvcf_metrics(jvcf_file, input_dels: IntervalIndex) -> None:
     with open(jvcf_file) as fin:
         json_prg = json.load(fin)
     sites_to_consider = find_nested_ref_sites(json_prg, input_dels)
@@ -155,12 +156,13 @@ def main(variant_file: click.Path, input_dels_bed: click.Path, output_file: str)
     """
     input_dels: Intervals = load_input_dels(input_dels_bed)
     input_dels = [VarContainer.make_from(reg) for reg in input_dels]
+    input_dels_index = IntervalIndex(input_dels)
 
     suffixes = set(Path(variant_file).suffixes)
     if ".json" in suffixes:
-        add_jvcf_metrics(variant_file, input_dels)
+        add_jvcf_metrics(variant_file, input_dels_index)
     elif len({".vcf", ".gz"} & suffixes) > 0:
-        add_vcf_metrics(variant_file, input_dels)
+        add_vcf_metrics(variant_file, input_dels_index)
     else:
         raise ValueError(f"{variant_file} has neither vcf nor jvcf file suffixes")
     with Path(output_file).open("w") as fout:
@@ -5,15 +5,19 @@ look for those deletions in those samples in a multi-sample vcf.
 Output: a tsv describing the deletions and if they are found in each sample.
 """
 from pathlib import Path
+from typing import Iterator
 
 import click
 from pysam import VariantFile
 
-from tb_bigdel.common import Interval, Intervals, load_input_dels
+from tb_bigdel.common import Interval, Intervals, load_input_dels, sweep_overlaps
 
 
-def load_gtyped_dels(called_vcf) -> Intervals:
-    gtyped_dels: Intervals = list()
+def load_gtyped_dels(called_vcf) -> Iterator[Interval]:
+    """
+    Streams the large deletions genotyped in any sample of :param: called_vcf,
+    in vcf record order.
+    """
     vcf_recs = VariantFile(called_vcf)
     for rec in vcf_recs.fetch():
         samples = set()
@@ -48,8 +52,7 @@ def load_gtyped_dels(called_vcf) -> Intervals:
             print("symbolic", rec.pos, del_len)
         else:
             stop = rec.pos + len(rec.ref) - 1
-        gtyped_dels.append(Interval(rec.pos, stop, samples, del_len))
-    return gtyped_dels
+        yield Interval(rec.pos, stop, samples, del_len)
 
 
 @click.command()
@@ -59,7 +62,7 @@ def load_gtyped_dels(called_vcf) -> Intervals:
 def main(called_vcf: click.Path, input_dels_bed: click.Path, output_file: str):
 
     input_dels: Intervals = load_input_dels(input_dels_bed)
-    gtyped_dels: Intervals = load_gtyped_dels(called_vcf)
+    gtyped_dels = load_gtyped_dels(called_vcf)
 
     fout = open(output_file, "w")
     header = [
@@ -71,11 +74,7 @@ def main(called_vcf: click.Path, input_dels_bed: click.Path, output_file: str):
     ]
     fout.write("\t".join(header) + "\n")
 
-    for input_del in input_dels:
-        found_dels = []
-        for gtyped_del in gtyped_dels:
-            if gtyped_del.overlaps(input_del):
-                found_dels.append(gtyped_del)
+    for input_del, found_dels in sweep_overlaps(input_dels, gtyped_dels):
         if len(found_dels) > 1:
             print(
                 f"WARNING: input del {input_del} found in >1 separate records: {found_dels}"
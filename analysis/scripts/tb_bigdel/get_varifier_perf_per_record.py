@@ -1,96 +1,136 @@
 import click
 from pathlib import Path
-from operator import itemgetter
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator
 
-import edlib
-
-from varifier.vcf_stats import format_dict_to_edit_dist_scores, _frs_from_vcf_record
-from cluster_vcf_records import vcf_file_read
-
-
-## Below function copied from varifier codebase
-def per_record_stats_from_vcf_file(infile):
-    """Gathers stats for each record in a VCF file.
-    Returns a list of dictionaries of stats. One dict per VCF line.
-    List is sorted by ref seq name (CHROM), then position (POS)"""
-    stats = []
-    wanted_keys = [
-        "DP",
-        "DPF",
-        "FRS",
-        "GT_CONF",
-        "GT_CONF_PERCENTILE",
-        "VFR_IN_MASK",
-        "VFR_ED_RA",
-        "VFR_ED_TR",
-        "VFR_ED_TA",
-        "VFR_ALLELE_LEN",
-        "VFR_ALLELE_MATCH_COUNT",
-        "VFR_ALLELE_MATCH_FRAC",
-        "VFR_RESULT",
-    ]
-    key_types = {
-        "DP": int,
-        "DPF": float,
-        "GT_CONF": float,
-        "GT_CONF_PERCENTILE": float,
-        "FRS": float,
-        "VFR_IN_MASK": int,
-        "VFR_ED_RA": int,
-        "VFR_ED_TR": int,
-        "VFR_ED_TA": int,
-        "VFR_ALLELE_MATCH_FRAC": float,
-        "VFR_ALLELE_LEN": int,
-        "VFR_ALLELE_MATCH_COUNT": int,
+from lazy_imports import lazy_import
+from tb_bigdel.common import Interval, IntervalIndex
+
+edlib = lazy_import("edlib")
+pysam = lazy_import("pysam")
+vcf_stats = lazy_import("varifier.vcf_stats")
+
+RegionIndex = Dict[str, IntervalIndex]
+
+wanted_keys = [
+    "DP",
+    "DPF",
+    "FRS",
+    "GT_CONF",
+    "GT_CONF_PERCENTILE",
+    "VFR_IN_MASK",
+    "VFR_ED_RA",
+    "VFR_ED_TR",
+    "VFR_ED_TA",
+    "VFR_ALLELE_LEN",
+    "VFR_ALLELE_MATCH_COUNT",
+    "VFR_ALLELE_MATCH_FRAC",
+    "VFR_RESULT",
+]
+key_types = {
+    "DP": int,
+    "DPF": float,
+    "GT_CONF": float,
+    "GT_CONF_PERCENTILE": float,
+    "FRS": float,
+    "VFR_IN_MASK": int,
+    "VFR_ED_RA": int,
+    "VFR_ED_TR": int,
+    "VFR_ED_TA": int,
+    "VFR_ALLELE_MATCH_FRAC": float,
+    "VFR_ALLELE_LEN": int,
+    "VFR_ALLELE_MATCH_COUNT": int,
+}
+
+
+def get_format_value(sample, key: str):
+    """Value of FORMAT :param: key in a pysam sample, as varifier would see it in vcf text"""
+    if key not in sample:
+        return "NA"
+    value = sample[key]
+    if value is None:
+        return "."
+    if type(value) is tuple:
+        return ",".join("." if val is None else str(val) for val in value)
+    return value
+
+
+def frs_from_sample(sample, cov_key="COV"):
+    """
+    pysam port of varifier's `_frs_from_vcf_record`: the FRS tag if present,
+    else the fraction of coverage on the called allele.
+    """
+    if "FRS" in sample:
+        frs = get_format_value(sample, "FRS")
+        return "NA" if frs == "." else float(frs)
+
+    if cov_key not in sample:
+        return "NA"
+
+    genotypes = set(sample["GT"])
+    if None in genotypes or len(genotypes) != 1:
+        return "NA"
+
+    allele_index = genotypes.pop()
+    coverages = [int(cov) for cov in sample[cov_key]]
+    total_cov = sum(coverages)
+    if total_cov == 0:
+        return 0
+    else:
+        return coverages[allele_index] / total_cov
+
+
+## Below function adapted from varifier codebase
+def per_record_stats_from_vcf_file(infile) -> Iterator[Dict]:
+    """Streams stats for each record in a VCF file, one dict per VCF line,
+    in file order."""
+    with pysam.VariantFile(infile) as vcf_in:
+        for record in vcf_in:
+            sample = record.samples[0]
+            record_stats = {x: get_format_value(sample, x) for x in wanted_keys}
+            record_stats["FRS"] = frs_from_sample(sample)
+            record_stats["CHROM"] = record.chrom
+            record_stats["POS"] = record.pos
+            record_stats["ALS"] = list(record.alleles)
+            record_stats["GT"] = sample["GT"] if "GT" in sample else (None,)
+            for key, key_type in key_types.items():
+                try:
+                    record_stats[key] = key_type(record_stats[key])
+                except:
+                    pass
+
+            yield record_stats
+
+
+def load_regions(bed_fname) -> RegionIndex:
+    intervals = defaultdict(list)
+    if bed_fname is not None:
+        with open(bed_fname) as fin:
+            for line in fin:
+                entries = line.split("\t")
+                intervals[entries[0]].append(
+                    Interval(int(entries[1]) + 1, int(entries[2]))
+                )
+    return {
+        chrom: IntervalIndex(chrom_regions)
+        for chrom, chrom_regions in intervals.items()
     }
-    header_lines, vcf_records = vcf_file_read.vcf_file_to_list(infile)
-    for record in vcf_records:
-        record_stats = {x: record.FORMAT.get(x, "NA") for x in wanted_keys}
-        record_stats["FRS"] = _frs_from_vcf_record(record)
-        record_stats["CHROM"] = record.CHROM
-        record_stats["POS"] = record.POS + 1
-        record_stats["ALS"] = [record.REF] + record.ALT
-        record_stats["GT"] = record.FORMAT.get("GT", [None])
-        for key, key_type in key_types.items():
-            try:
-                record_stats[key] = key_type(record_stats[key])
-            except:
-                pass
-
-        stats.append(record_stats)
-
-    stats.sort(key=itemgetter("CHROM", "POS"))
-    return stats
-
-
-def load_regions(bed_fname):
-    result = defaultdict(list)
-    if bed_fname is None:
-        return result
-    with open(bed_fname) as fin:
-        for line in fin:
-            entries = line.split("\t")
-            result[entries[0]].append([int(entries[1]) + 1, int(entries[2])])
-    return result
-
-
-def is_in_regions(record_stats, regions):
+
+
+def is_in_regions(record_stats, regions: RegionIndex):
     if len(regions) == 0:  # No filtering by regions
         return True
     chrom_regions = regions.get(record_stats["CHROM"])
     if chrom_regions is None:
         return False
     pos = int(record_stats["POS"])
-    for region in chrom_regions:
-        if region[0] <= pos <= region[1]:
-            return True
-    return False
+    return len(chrom_regions.spanning(Interval(pos, pos))) > 0
 
 
 def get_variant_type_and_size(record_stats):
     ref_allele = record_stats["ALS"][0]
-    gtype_call = int(record_stats["GT"].split("/")[0])  # Assumes haploid
+    gtype_call = record_stats["GT"][0]  # Assumes haploid
     called_allele = record_stats["ALS"][gtype_call]
 
     variant_size = edlib.align(ref_allele, called_allele, task="distance")[
@@ -128,6 +168,38 @@ def print_headers(ctx, param, value):
     ctx.exit()
 
 
+def write_record_stats(
+    vcf_fname: Path,
+    metric: str,
+    regions: RegionIndex,
+    sample_name: str,
+    tool_name: str,
+    output_fname: Path,
+) -> int:
+    """
+    Writes the per-record stats of one varifier output vcf,
+    returning the number of records skipped for not being in :param: regions
+    """
+    num_not_in_region = 0
+    with output_fname.open("w") as fout:
+        for record_stats in per_record_stats_from_vcf_file(str(vcf_fname)):
+            if not is_in_regions(record_stats, regions):
+                num_not_in_region += 1
+                continue
+            var_type, event_size = get_variant_type_and_size(record_stats)
+            if event_size == 0:  # Can occur, eg AMBIG call
+                continue
+            ed_num, ed_denum = vcf_stats.format_dict_to_edit_dist_scores(record_stats)
+            if ed_num is not None:
+                fout.write(
+                    f'{record_stats["POS"]}\t{record_stats["CHROM"]}\t'
+                    f"{var_type}\t{event_size}\t{sample_name}\t{tool_name}\t"
+                    f'{metric}\t{record_stats["VFR_RESULT"]}\t'
+                    f"{ed_num}\t{ed_denum}\n"
+                )
+    return num_not_in_region
+
+
 @click.command()
 @click.argument(
     "input_dir",
@@ -157,27 +229,36 @@ def main(input_dir, output_tsv, sample_name, tool_name, region_file):
 
     regions = load_regions(region_file)
 
+    # precision and recall vcfs are processed concurrently, each to its own part file
+    metrics = ["precision", "recall"]
+    part_paths = [
+        fout_path.with_name(f"{fout_path.name}.{metric}") for metric in metrics
+    ]
+    with ProcessPoolExecutor(max_workers=len(metrics)) as executor:
+        futures = [
+            executor.submit(
+                write_record_stats,
+                vcf_fname,
+                metric,
+                regions,
+                sample_name,
+                tool_name,
+                part_path,
+            )
+            for vcf_fname, metric, part_path in zip(
+                [precision_vcf, recall_vcf], metrics, part_paths
+            )
+        ]
+        skipped_counts = [future.result() for future in futures]
+
     with fout_path.open("w") as fout:
-        for vcf_fname, metric in zip(
-            [precision_vcf, recall_vcf], ["precision", "recall"]
+        for metric, part_path, num_not_in_region in zip(
+            metrics, part_paths, skipped_counts
         ):
-            all_stats = per_record_stats_from_vcf_file(str(vcf_fname))
-            num_not_in_region = 0
-            for record_stats in all_stats:
-                if not is_in_regions(record_stats, regions):
-                    num_not_in_region += 1
-                    continue
-                var_type, event_size = get_variant_type_and_size(record_stats)
-                if event_size == 0:  # Can occur, eg AMBIG call
-                    continue
-                ed_num, ed_denum = format_dict_to_edit_dist_scores(record_stats)
-                if ed_num is not None:
-                    fout.write(
-                        f'{record_stats["POS"]}\t{record_stats["CHROM"]}\t'
-                        f"{var_type}\t{event_size}\t{sample_name}\t{tool_name}\t"
-                        f'{metric}\t{record_stats["VFR_RESULT"]}\t'
-                        f"{ed_num}\t{ed_denum}\n"
-                    )
+            with part_path.open() as fin:
+                for line in fin:
+                    fout.write(line)
+            part_path.unlink()
             print(f"{metric}:Skipped {num_not_in_region} variants not in {region_file}")
 
 
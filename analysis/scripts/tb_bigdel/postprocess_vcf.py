@@ -4,13 +4,17 @@ VCF postprocessing:
   output VCFs and cannot be analysed by varifier (nor by bcftools consensus for <INS>)
 * Optionally remove REF and null calls: if left in these can cause varifier to unnecessarily 
   ignore some overlapping variant records
+* Optionally rename the sample and drop INFO fields (eg those preventing vcf merging)
+
+Reference sequence is fetched from an indexed fasta only where symbolic alleles need it.
+Output is bgzipped and indexed (.csi).
 """
 import sys
 from pathlib import Path
+from typing import Optional, Tuple
 
 import click
-import pyfastaq
-from pysam import VariantFile
+from pysam import VariantFile, VariantHeader, FastaFile, tabix_index
 
 
 def is_symbolic(allele: str) -> bool:
@@ -22,7 +26,7 @@ def symbolic_del_to_sequence(vcf_record, ref_sequences):
     pos = vcf_record.pos - 1
     event_size = vcf_record.info["SVLEN"]
     # Extracts the first base before the deletion + the deleted sequence
-    ref_seq = ref_sequences[vcf_record.chrom][pos - 1 : pos + event_size]
+    ref_seq = ref_sequences.fetch(vcf_record.chrom, pos - 1, pos + event_size)
     alt_seq = ref_seq[0]
     vcf_record.alleles = [ref_seq, alt_seq]
     vcf_record.pos = pos
@@ -34,7 +38,7 @@ def symbolic_ins_to_sequence(vcf_record, ref_sequences):
     pos = vcf_record.pos - 1
     event_size = vcf_record.info["SVLEN"]
     inserted_seq = vcf_record.info["SEQ"]
-    ref_seq = ref_sequences[vcf_record.chrom][pos]
+    ref_seq = ref_sequences.fetch(vcf_record.chrom, pos, pos + 1)
     alt_seq = ref_seq + inserted_seq
     vcf_record.alleles = [ref_seq, alt_seq]
     return vcf_record
@@ -49,6 +53,23 @@ def process_symbolic(record, ref_sequences):
         return symbolic_ins_to_sequence(record, ref_sequences)
 
 
+def make_output_header(
+    input_header: VariantHeader, sample_name: Optional[str], drop_info: Tuple[str]
+) -> VariantHeader:
+    result = VariantHeader()
+    for header_record in input_header.records:
+        if header_record.type == "INFO" and header_record.get("ID") in drop_info:
+            continue
+        result.add_record(header_record)
+    samples = list(input_header.samples)
+    if sample_name is not None:
+        assert len(samples) == 1
+        samples = [sample_name]
+    for sample in samples:
+        result.add_sample(sample)
+    return result
+
+
 @click.command()
 @click.argument(
     "fasta_ref",
@@ -60,18 +81,21 @@ def process_symbolic(record, ref_sequences):
 )
 @click.argument("output_vcf")
 @click.option("--remove_ref_and_null", is_flag=True)
-def main(fasta_ref, vcf_file, output_vcf, remove_ref_and_null):
+@click.option("--sample_name", type=str, default=None, help="Rename the vcf's sample")
+@click.option(
+    "--drop_info", type=str, multiple=True, help="INFO field to remove; repeatable"
+)
+def main(fasta_ref, vcf_file, output_vcf, remove_ref_and_null, sample_name, drop_info):
     output_fname = Path(output_vcf)
     output_fname.parent.mkdir(exist_ok=True, parents=True)
+    if output_fname.suffix != ".gz":
+        raise ValueError(f"{output_vcf} should end in .gz: output is bgzipped")
 
-    ref_seqs = {}
-    for seq in pyfastaq.sequences.file_reader(fasta_ref):
-        seq_id = seq.id.split()[0]
-        ref_seqs[seq_id] = seq.seq
+    ref_seqs = FastaFile(fasta_ref)  # Builds the .fai if absent
 
-    with open(vcf_file) as fin, open(output_vcf, "w") as fout:
-        varfile = VariantFile(fin)
-        fout.write(str(varfile.header))
+    varfile = VariantFile(vcf_file)
+    output_header = make_output_header(varfile.header, sample_name, drop_info)
+    with VariantFile(str(output_fname), "wz", header=output_header) as fout:
         found_symbolics = set()
         for record in varfile:
             if remove_ref_and_null:
@@ -88,10 +112,16 @@ def main(fasta_ref, vcf_file, output_vcf, remove_ref_and_null):
                 else:
                     assert record.id.rsplit(".", maxsplit=1)[0] in found_symbolics
                     continue
-            fout.write(str(record))
+            for info_field in drop_info:
+                record.info.pop(info_field, None)
+            record.translate(output_header)
+            fout.write(record)
         print(
             f"Processed {len(found_symbolics)} symbolically encoded structural variants"
         )
+    varfile.close()
+    ref_seqs.close()
+    tabix_index(str(output_fname), preset="vcf", csi=True, force=True)
 
 
 if __name__ == "__main__":
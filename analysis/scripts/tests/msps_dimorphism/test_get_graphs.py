@@ -1,12 +1,17 @@
 from unittest.mock import MagicMock
 
+import numpy as np
+
 import pytest
-from igraph import Graph
 
-from msps_dimorphism.get_site_diversity_graphs import (
+from msps_dimorphism.old.get_site_diversity_graphs import (
     get_sample_indices,
     wire,
     make_site_graph,
+    get_partition_counts,
+    diversity_attributes,
+    divergence_attributes,
+    MIN_METRIC,
 )
 from jvcf_processing import Region
 
@@ -30,29 +35,27 @@ def test_wire_data(request):
         "Sites": MagicMock(),
     }
 
-    graph = Graph(directed=True)
-    num_sites = 6
-    graph.add_vertices(num_sites)
-    graph.vs["POS"] = [0] * num_sites
-    graph.vs["populated"] = [False] * num_sites
-    graph.vs["nesting_lvl"] = [1] * num_sites
-
     request.cls.jvcf = jvcf
-    request.cls.graph = graph
+    request.cls.nesting_lvls = dict()
 
 
 class TestWire:
     def test_wire_no_nesting(self, test_wire_data):
-        wire(2, 5, 1, self.jvcf, self.graph)
-        assert sum(self.graph.vs["populated"]) == 1
-        assert len(self.graph.es) == 1
+        edges = wire(2, 5, 1, self.jvcf, self.nesting_lvls)
+        assert self.nesting_lvls == {2: 1}
+        assert edges == [(2, 5)]
 
     def test_wire_with_nesting(self, test_wire_data):
-        wire(0, 5, 1, self.jvcf, self.graph)
-        assert sum(self.graph.vs["populated"]) == 5
-        assert self.graph.vs["nesting_lvl"] == [1, 2, 2, 2, 3, 1]
-        assert self.graph.degree(mode="in") == [0, 1, 1, 1, 1, 2]
-        assert self.graph.degree(mode="out") == [2, 1, 1, 1, 1, 0]
+        edges = wire(0, 5, 1, self.jvcf, self.nesting_lvls)
+        assert self.nesting_lvls == {0: 1, 1: 2, 2: 2, 3: 2, 4: 3}
+        assert edges == [(0, 1), (1, 4), (4, 2), (2, 5), (0, 3), (3, 5)]
+
+    def test_deep_nesting_does_not_recurse(self, test_wire_data):
+        depth = 5000
+        self.jvcf["Child_Map"] = {str(i): {"0": [i + 1]} for i in range(depth)}
+        edges = wire(0, depth + 1, 1, self.jvcf, self.nesting_lvls)
+        assert len(edges) == depth + 1
+        assert self.nesting_lvls[depth] == depth + 1
 
 
 @pytest.fixture(scope="function")
@@ -66,14 +69,7 @@ def site_graph_data(request):
     for i in range(num_sites):
         jvcf["Sites"].append({"SEG": "seg1", "POS": i + 1})
 
-    graph = Graph(directed=True)
-    graph.add_vertices(num_sites)
-    graph.vs["POS"] = [0] * num_sites
-    graph.vs["populated"] = [False] * num_sites
-    graph.vs["nesting_lvl"] = [1] * num_sites
-
     request.cls.jvcf = jvcf
-    request.cls.graph = graph
 
 
 class TestMakeSiteGraph:
@@ -102,17 +98,65 @@ class TestMakeSiteGraph:
         # which has nested sites below it; these get processed too.
         region = Region("seg1", 4, 5)
         result = make_site_graph(self.jvcf, region)
-        print(result.vs["nesting_lvl"])
         assert len(result.vs) == 5
         assert sum(result.vs["populated"]) == 5
         assert result.vs["nesting_lvl"] == [1, 1, 2, 3, 1]
         assert result.degree(mode="in") == [0, 1, 1, 1, 1]
         assert result.degree(mode="out") == [1, 1, 1, 1, 0]
         # site indices of kept nodes
-        assert result.vs["name"] == [3, 4, 5, 6, 7]
+        assert result.vs["idx_in_prg"] == [3, 4, 5, 6, 7]
+        assert result.vs["POS"] == [4, 5, 6, 7, 8]
 
     def test_make_whole_graph(self, site_graph_data):
         result = make_site_graph(self.jvcf, Region())
         assert result.vs["nesting_lvl"] == [1, 2, 2, 1, 1, 2, 3, 1]
         assert result.degree(mode="in") == [0, 1, 1, 2, 1, 1, 1, 1]
         assert result.degree(mode="out") == [2, 1, 1, 1, 1, 1, 1, 0]
+
+
+@pytest.fixture(scope="class")
+def partition_counts_data(request):
+    request.cls.jvcf = {
+        "Sites": [
+            {
+                "GT": [[0], [1], [1], [None], [0]],
+                "HAPG": [[0], [1], [1], [None], [0]],
+                "FT": [[], [], ["AMBIG"], [], []],
+            },
+            {
+                "GT": [[2], [2], [2], [2], [2]],
+                "HAPG": [[1], [1], [1], [1], [1]],
+                "FT": [[], [], [], [], []],
+            },
+        ]
+    }
+    request.cls.partitions = [[0, 1, 2], [3, 4], [0, 4]]
+    request.cls.counts = get_partition_counts(
+        request.cls.jvcf, [0, 1], request.cls.partitions
+    )
+
+
+@pytest.mark.usefixtures("partition_counts_data")
+class TestPartitionCounts:
+    def test_counts_exclude_null_and_ambiguous_calls(self):
+        assert self.counts.gt_counts.shape == (3, 2, 3)
+        assert self.counts.gt_counts[0].tolist() == [[1, 1, 0], [0, 0, 3]]
+        assert self.counts.gt_counts[1].tolist() == [[1, 0, 0], [0, 0, 2]]
+        assert self.counts.hapg_counts[2].tolist() == [[2, 0], [0, 2]]
+        assert self.counts.ambig_counts.tolist() == [[1, 0], [0, 0], [0, 0]]
+
+    def test_diversity(self):
+        result = diversity_attributes(self.counts, 0)
+        assert result["gt_non_null_counts"] == [2, 3]
+        assert result["gt_heterozygosity"] == pytest.approx([0.5, MIN_METRIC])
+        assert result["num_ambig"] == [1, 0]
+
+    def test_divergence(self):
+        result = divergence_attributes(self.counts, 0, 1)
+        # KL divergences of [0.5, 0.5] and [1, 0] from [0.75, 0.25], in bits
+        expected = (0.5 * np.log2(0.5 / 0.75) + 0.5 * np.log2(0.5 / 0.25)) / 2 + (
+            np.log2(1 / 0.75)
+        ) / 2
+        assert result["gtJensen_Shannon"] == pytest.approx([expected, MIN_METRIC])
+        assert result["p1_hapg_distrib"] == ["[0.5, 0.5]", "[1.0]"]
+        assert result["p2_hapg_distrib"] == ["[1.0, 0]", "[1.0]"]
@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+from scipy import sparse
+from scipy.cluster.hierarchy import linkage, cophenet, is_valid_linkage
+from scipy.spatial.distance import cdist
+
+from msps_dimorphism.linkage import (
+    dedup_rows,
+    chunked_distances,
+    scalable_linkage,
+    partition_from_linkage,
+)
+
+
+@pytest.fixture
+def duplicated_rows():
+    rng = np.random.default_rng(42)
+    distinct_rows = rng.integers(0, 1000, size=(15, 30))
+    return distinct_rows[rng.integers(0, 15, size=200)]
+
+
+class TestScalableLinkage:
+    @pytest.mark.parametrize("metric", ["hamming", "euclidean"])
+    def test_chunked_distances(self, metric):
+        rng = np.random.default_rng(0)
+        rows = rng.integers(-1, 4, size=(50, 20))
+        result = chunked_distances(rows, rows[:7], metric, chunk_size=8)
+        assert np.allclose(result, cdist(rows, rows[:7], metric=metric), atol=1e-5)
+
+    @pytest.mark.parametrize("metric", ["hamming", "euclidean"])
+    def test_sparse_chunked_distances(self, metric):
+        rng = np.random.default_rng(0)
+        rows = rng.choice([-1, 0, 0, 0, 1, 2], size=(50, 20))
+        result = chunked_distances(
+            sparse.csr_matrix(rows), sparse.csr_matrix(rows[:7]), metric, chunk_size=8
+        )
+        assert np.allclose(result, cdist(rows, rows[:7], metric=metric), atol=1e-5)
+
+    def test_sparse_dedup_rows(self, duplicated_rows):
+        unique_rows, members, counts = dedup_rows(duplicated_rows)
+        sparse_unique, sparse_members, sparse_counts = dedup_rows(
+            sparse.csr_matrix(duplicated_rows)
+        )
+        assert sorted(map(list, sparse_members)) == sorted(map(list, members))
+        assert sorted(sparse_counts) == sorted(counts)
+        for row_members, row in zip(sparse_members, sparse_unique.toarray()):
+            assert (duplicated_rows[row_members] == row).all()
+
+    def test_unsupported_metric_fails(self):
+        with pytest.raises(ValueError):
+            chunked_distances(np.zeros((2, 2)), np.zeros((2, 2)), "cosine")
+
+    def test_same_clustering_as_scipy(self, duplicated_rows):
+        result = scalable_linkage(duplicated_rows, "euclidean")
+        expected = linkage(duplicated_rows, method="average", metric="euclidean")
+        assert is_valid_linkage(result)
+        assert np.allclose(cophenet(result), cophenet(expected), rtol=1e-4)
+
+    def test_same_partition_as_scipy(self):
+        rng = np.random.default_rng(0)
+        distinct_rows = rng.integers(-1, 4, size=(12, 30))
+        rows = distinct_rows[rng.integers(0, 12, size=300)]
+        names = [f"s{i}" for i in range(len(rows))]
+        result = partition_from_linkage(scalable_linkage(rows, "hamming"), names)
+        expected = partition_from_linkage(
+            linkage(rows, method="average", metric="hamming"), names
+        )
+        assert sorted(map(sorted, result)) == sorted(map(sorted, expected))
+
+    def test_max_points_bounds_clustered_rows(self, duplicated_rows):
+        bounded = scalable_linkage(duplicated_rows, "euclidean", max_points=5)
+        approximate = scalable_linkage(
+            duplicated_rows, "euclidean", approximate=True, num_representatives=5
+        )
+        assert np.array_equal(bounded, approximate)
+        # 15 distinct rows: within bounds, so clustered exactly
+        unbounded = scalable_linkage(duplicated_rows, "euclidean", max_points=15)
+        assert np.array_equal(unbounded, scalable_linkage(duplicated_rows, "euclidean"))
+
+    def test_approximate_partition_finds_forms(self):
+        rng = np.random.default_rng(1)
+        rows = rng.integers(0, 3, size=(600, 20))
+        rows[:250, :10] = 5
+        result = scalable_linkage(
+            rows, "hamming", approximate=True, num_representatives=50
+        )
+        assert is_valid_linkage(result)
+        groups = partition_from_linkage(result, list(range(len(rows))))
+        assert sorted(map(sorted, groups)) == [
+            list(range(250)),
+            list(range(250, 600)),
+        ]
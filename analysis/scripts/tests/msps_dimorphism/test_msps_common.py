@@ -0,0 +1,368 @@
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import sparse
+from scipy.cluster.hierarchy import cophenet
+from scipy.spatial.distance import jensenshannon
+from scipy.stats import entropy
+
+from msps_dimorphism.common import (
+    get_region_calls,
+    get_sparse_region_calls,
+    save_sparse_calls,
+    load_sparse_calls,
+    sparse_group_gt_counts,
+    to_gt_list,
+    get_clustering,
+    clustering_cache_path,
+    num_matrix_samples,
+    matrix_sample_names,
+    allelic_distinguishability,
+    allelic_specificity,
+    get_complete_counts,
+    group_index_vector,
+    group_gt_counts,
+    get_dimorphism_metrics,
+    get_country_form_counts,
+    load_sequences,
+    seq_hash_pair,
+    get_edit_distances,
+    SparseCalls,
+)
+from msps_dimorphism.linkage import scalable_linkage
+from jvcf_processing import Region
+
+
+@pytest.fixture(scope="function")
+def region_jvcf(request):
+    request.cls.jvcf = {
+        "Samples": [{"Name": "s1"}, {"Name": "s2"}, {"Name": "s3"}],
+        "Lvl1_Sites": [0, 1, 3],
+        "Sites": [
+            {
+                "SEG": "seg1",
+                "POS": 1,
+                "GT": [[0], [1], [None]],
+                "HAPG": [[0], [1], [0]],
+            },
+            {
+                "SEG": "seg1",
+                "POS": 5,
+                "GT": [[1], [None], [2]],
+                "HAPG": [[0], [0], [1]],
+            },
+            {
+                "SEG": "seg1",
+                "POS": 6,
+                "GT": [[0], [0], [1]],
+                "HAPG": [[2], [2], [3]],
+            },
+            {
+                "SEG": "seg2",
+                "POS": 1,
+                "GT": [[0], [0], [0]],
+                "HAPG": [[0], [0], [0]],
+            },
+        ],
+    }
+
+
+@pytest.mark.usefixtures("region_jvcf")
+class TestGetRegionCalls:
+    def test_whole_region(self):
+        result = get_region_calls(self.jvcf, Region())
+        assert result.hapgs.shape == (3, 4)
+        assert result.hapgs.dtype == np.int16
+        assert result.site_indices.tolist() == [0, 1, 2, 3]
+
+    def test_null_calls_are_minus_one(self):
+        result = get_region_calls(self.jvcf, Region("seg1", 1, 10))
+        assert result.gts.tolist() == [[0, 1, 0], [1, -1, 0], [-1, 2, 1]]
+        assert result.hapgs.tolist() == [[0, 0, 2], [1, -1, 2], [-1, 1, 3]]
+
+    def test_nested_site_mask(self):
+        result = get_region_calls(self.jvcf, Region("seg1", 1, 10))
+        assert result.nested.tolist() == [False, False, True]
+
+    def test_region_starts_at_non_nested_site(self):
+        result = get_region_calls(self.jvcf, Region("seg1", 5, 10))
+        assert result.site_indices.tolist() == [1, 2]
+
+
+@pytest.mark.usefixtures("region_jvcf")
+class TestSparseCalls:
+    def test_same_calls_as_dense(self):
+        for region in [Region(), Region("seg1", 5, 10)]:
+            dense = get_region_calls(self.jvcf, region)
+            result = get_sparse_region_calls(self.jvcf, region)
+            assert np.array_equal(result.hapgs.to_dense(), dense.hapgs)
+            assert np.array_equal(result.gts.to_dense(), dense.gts)
+            assert np.array_equal(result.nested, dense.nested)
+            assert np.array_equal(result.site_indices, dense.site_indices)
+
+    def test_zero_calls_not_stored(self):
+        result = get_sparse_region_calls(self.jvcf, Region())
+        assert result.gts.values.nnz == 4
+        assert result.gts.null.nnz == 2
+
+    def test_save_and_load(self, tmp_path):
+        calls = get_sparse_region_calls(self.jvcf, Region()).hapgs
+        fname = tmp_path / "gene_hapgs.npz"
+        save_sparse_calls(fname, calls, ["s1", "s2", "s3"])
+        loaded, sample_names = load_sparse_calls(fname)
+        assert sample_names == ["s1", "s2", "s3"]
+        assert np.array_equal(loaded.to_dense(), calls.to_dense())
+
+
+def test_to_gt_list_nulls_become_None():
+    assert to_gt_list(np.array([1, -1, 0], dtype=np.int16)) == [1, None, 0]
+
+
+@pytest.fixture
+def hapg_matrix(tmp_path):
+    rows = [[0, 0, 1, 0]] * 6 + [[1, 2, 0, 2]] * 4 + [[1, 2, 0, 1]] * 3
+    df = pd.DataFrame(rows, index=[f"s{i}" for i in range(len(rows))])
+    fname = tmp_path / "gene_hapgs.tsv"
+    df.to_csv(fname, sep="\t")
+    return fname
+
+
+class TestClusteringCache:
+    def test_partition_of_two_forms(self, hapg_matrix):
+        result = get_clustering(hapg_matrix)
+        partition = sorted(map(sorted, result.groups), key=len)
+        assert partition[0] == [f"s{i}" for i in range(6)]
+        assert partition[1] == sorted(f"s{i}" for i in range(6, 13))
+        assert sorted(result.leaves.tolist()) == list(range(13))
+
+    def test_second_call_reuses_cache(self, hapg_matrix):
+        first = get_clustering(hapg_matrix)
+        assert clustering_cache_path(hapg_matrix).exists()
+        with patch("msps_dimorphism.linkage.linkage") as mocked_linkage:
+            second = get_clustering(hapg_matrix)
+            mocked_linkage.assert_not_called()
+        assert np.array_equal(first.linkage, second.linkage)
+        assert first.groups == second.groups
+
+    def test_changed_parameters_or_content_recompute(self, hapg_matrix):
+        get_clustering(hapg_matrix)
+        with patch(
+            "msps_dimorphism.linkage.linkage", side_effect=ValueError
+        ) as mocked_linkage:
+            with pytest.raises(ValueError):
+                get_clustering(hapg_matrix, metric="cityblock")
+            hapg_matrix.write_text(hapg_matrix.read_text().replace("s0", "s00"))
+            with pytest.raises(ValueError):
+                get_clustering(hapg_matrix)
+            assert mocked_linkage.call_count == 2
+
+    def test_auto_mode_cache_hit_does_not_load_matrix(self, hapg_matrix):
+        first = get_clustering(hapg_matrix)
+        with patch("msps_dimorphism.common.load_hapg_matrix") as mocked_load:
+            second = get_clustering(hapg_matrix)
+            mocked_load.assert_not_called()
+        assert first.groups == second.groups
+
+    def test_auto_mode_bounds_distinct_rows(self, hapg_matrix):
+        with patch("msps_dimorphism.common.MAX_EXACT_SAMPLES", 5), patch(
+            "msps_dimorphism.common.MAX_SCALABLE_POINTS", 2
+        ), patch(
+            "msps_dimorphism.common.scalable_linkage", wraps=scalable_linkage
+        ) as mocked_linkage:
+            result = get_clustering(hapg_matrix)
+        assert mocked_linkage.call_args.kwargs["max_points"] == 2
+        assert sorted(result.leaves.tolist()) == list(range(13))
+        assert str(np.load(clustering_cache_path(hapg_matrix))["key"]).split(":")[
+            3:5
+        ] == [
+            "scalable",
+            "max_points=2",
+        ]
+
+    def test_cache_written_without_temporary_files(self, hapg_matrix):
+        get_clustering(hapg_matrix)
+        get_clustering(hapg_matrix, metric="cityblock")
+        cache_files = sorted(path.name for path in hapg_matrix.parent.iterdir())
+        assert cache_files == ["gene_hapgs.linkage.npz", "gene_hapgs.tsv"]
+
+
+def test_clustering_of_sparse_matrix_file(hapg_matrix):
+    df = pd.read_csv(hapg_matrix, sep="\t", index_col=0)
+    values = df.to_numpy()
+    calls = SparseCalls(
+        sparse.csr_matrix(np.where(values > 0, values, 0)),
+        sparse.csr_matrix(values < 0),
+    )
+    fname = hapg_matrix.with_suffix(".npz")
+    save_sparse_calls(fname, calls, list(df.index))
+    assert num_matrix_samples(fname) == num_matrix_samples(hapg_matrix) == 13
+    assert (
+        matrix_sample_names(fname) == matrix_sample_names(hapg_matrix) == list(df.index)
+    )
+    for mode in ["exact", "scalable"]:
+        result = get_clustering(fname, mode=mode)
+        expected = get_clustering(hapg_matrix, mode=mode)
+        assert sorted(map(sorted, result.groups)) == sorted(
+            map(sorted, expected.groups)
+        )
+        assert np.allclose(cophenet(result.linkage), cophenet(expected.linkage))
+
+
+@pytest.fixture(scope="class")
+def grouped_gts(request):
+    rng = np.random.default_rng(1)
+    gts = rng.integers(-1, 4, size=(60, 25))
+    gts[:, 0] = -1  # No calls at all
+    gts[:30, 1] = -1  # No calls in the first group
+    gts[:, 2] = 2  # Monomorphic
+    request.cls.gts = gts
+    request.cls.sample_names = [f"s{i}" for i in range(60)]
+    request.cls.groups = [
+        request.cls.sample_names[:30],
+        request.cls.sample_names[30:55],
+    ]
+    request.cls.group_indices = group_index_vector(
+        request.cls.sample_names, request.cls.groups
+    )
+
+
+@pytest.mark.usefixtures("grouped_gts")
+class TestDimorphismMetrics:
+    def site_gts(self, site_idx):
+        form1 = to_gt_list(self.gts[:30, site_idx])
+        form2 = to_gt_list(self.gts[30:55, site_idx])
+        return form1, form2
+
+    def test_group_index_vector(self):
+        assert list(self.group_indices[[0, 29, 30, 54, 55]]) == [0, 0, 1, 1, -1]
+
+    def test_group_gt_counts(self):
+        counts = group_gt_counts(self.gts, self.group_indices)
+        assert counts.shape == (2, 25, 4)
+        for site_idx in range(25):
+            expected = np.bincount(
+                self.gts[30:55, site_idx][self.gts[30:55, site_idx] >= 0],
+                minlength=4,
+            )
+            assert list(counts[1, site_idx]) == list(expected)
+
+    def test_matches_per_site_functions(self):
+        metrics = get_dimorphism_metrics(self.gts, self.group_indices)
+        for site_idx in range(3, 25):
+            form1, form2 = self.site_gts(site_idx)
+            distrib1, distrib2 = get_complete_counts(form1, form2)
+            assert metrics.distinguishability[site_idx] == pytest.approx(
+                allelic_distinguishability(form1, form2)
+            )
+            assert metrics.specificity[site_idx] == pytest.approx(
+                allelic_specificity(form1, form2)
+            )
+            assert metrics.kl_divergence[site_idx] == pytest.approx(
+                entropy(distrib1, distrib2)
+            )
+            assert metrics.js_divergence[site_idx] == pytest.approx(
+                jensenshannon(distrib1, distrib2, base=2) ** 2
+            )
+
+    def test_heterozygosity(self):
+        metrics = get_dimorphism_metrics(self.gts, self.group_indices)
+        assert metrics.heterozygosity.shape == (2, 25)
+        assert np.isnan(metrics.heterozygosity[:, 0]).all()
+        assert list(metrics.heterozygosity[:, 2]) == [0, 0]
+        form1, _ = self.site_gts(5)
+        freqs = np.bincount([gt for gt in form1 if gt is not None]) / len(
+            [gt for gt in form1 if gt is not None]
+        )
+        assert metrics.heterozygosity[0, 5] == pytest.approx(1 - (freqs**2).sum())
+
+    def test_sparse_calls(self):
+        calls = SparseCalls(
+            sparse.csr_matrix(np.where(self.gts > 0, self.gts, 0)),
+            sparse.csr_matrix(self.gts < 0),
+        )
+        assert np.array_equal(
+            sparse_group_gt_counts(calls, self.group_indices),
+            group_gt_counts(self.gts, self.group_indices),
+        )
+        result = get_dimorphism_metrics(calls, self.group_indices)
+        expected = get_dimorphism_metrics(self.gts, self.group_indices)
+        for result_metric, expected_metric in zip(result, expected):
+            assert np.allclose(result_metric, expected_metric, equal_nan=True)
+
+    def test_country_form_counts(self):
+        countries = ["Ghana", "Laos", "Cambodia"]
+        sample_to_country = {
+            name: countries[idx % 3] for idx, name in enumerate(self.sample_names)
+        }
+        result = get_country_form_counts(
+            self.gts, self.sample_names, sample_to_country, self.groups
+        )
+        assert result.countries == countries
+        assert list(result.form_sizes) == [30, 25]
+        assert np.array_equal(
+            result.form_counts, group_gt_counts(self.gts, self.group_indices)
+        )
+        for site_idx in range(25):
+            for country_idx, country in enumerate(countries):
+                rows = np.arange(country_idx, 60, 3)
+                site_gts = self.gts[rows, site_idx]
+                expected = np.bincount(site_gts[site_gts >= 0], minlength=4)
+                assert list(result.country_counts[country_idx, site_idx]) == list(
+                    expected
+                )
+                for form_idx in range(2):
+                    in_form = rows[self.group_indices[rows] == form_idx]
+                    num_calls = (self.gts[in_form, site_idx] >= 0).sum()
+                    form_calls = result.country_form_calls[country_idx, form_idx]
+                    assert form_calls[site_idx] == num_calls
+
+        calls = SparseCalls(
+            sparse.csr_matrix(np.where(self.gts > 0, self.gts, 0)),
+            sparse.csr_matrix(self.gts < 0),
+        )
+        sparse_result = get_country_form_counts(
+            calls, self.sample_names, sample_to_country, self.groups
+        )
+        for result_counts, expected_counts in zip(sparse_result, result):
+            assert np.array_equal(result_counts, expected_counts)
+
+    def test_sites_without_calls(self):
+        metrics = get_dimorphism_metrics(self.gts, self.group_indices)
+        assert metrics.distinguishability[0] == 0
+        assert metrics.distinguishability[1] == 0
+        assert np.isinf(metrics.kl_divergence[1])
+        assert metrics.js_divergence[2] == 0
+
+
+class TestEditDistances:
+    seq_pairs = [("ACGT", "ACGA"), ("ACGA", "ACGT"), ("AAAA", "ACGT"), ("ACGT", "ACGT")]
+
+    def test_distinct_pairs_computed_once(self):
+        with patch(
+            "msps_dimorphism.common.edit_distance", side_effect=lambda seqs: 7
+        ) as mocked:
+            result = get_edit_distances(self.seq_pairs)
+        assert mocked.call_count == 3
+        assert result[seq_hash_pair("ACGA", "ACGT")] == 7
+
+    def test_distances(self):
+        result = get_edit_distances(self.seq_pairs, threads=2)
+        assert result[seq_hash_pair("ACGT", "ACGA")] == 1
+        assert result[seq_hash_pair("AAAA", "ACGT")] == 3
+        assert result[seq_hash_pair("ACGT", "ACGT")] == 0
+
+    def test_rerun_uses_cache(self, tmp_path):
+        cache_path = tmp_path / "distances.sqlite"
+        expected = get_edit_distances(self.seq_pairs, cache_path=cache_path)
+        with patch("msps_dimorphism.common.edit_distance") as mocked:
+            result = get_edit_distances(self.seq_pairs[:3], cache_path=cache_path)
+        mocked.assert_not_called()
+        assert len(result) == 2
+        assert all(result[key] == expected[key] for key in result)
+
+    def test_load_sequences(self, tmp_path):
+        fasta = tmp_path / "seqs.fa"
+        fasta.write_text(">s1\nACGT\nAC\n>s2\nTTTT\n")
+        assert load_sequences(fasta) == {"s1": "ACGTAC", "s2": "TTTT"}
@@ -0,0 +1,87 @@
+import pandas as pd
+import pytest
+
+from msps_dimorphism.site_summary_stats import get_site_summaries
+from jvcf_processing import Region
+
+
+@pytest.fixture(scope="class")
+def summary_jvcf(request):
+    request.cls.jvcf = {
+        "Samples": [{"Name": f"s{i}"} for i in range(4)],
+        "Lvl1_Sites": [0, 3],
+        "Child_Map": {"0": {"1": [1, 2]}},
+        "Sites": [
+            {
+                "SEG": "seg1",
+                "POS": 1,
+                "ALS": ["A", "C"],
+                "GT": [[0], [1], [1], [None]],
+                "HAPG": [[0], [1], [1], [None]],
+                "FT": [[], [], ["AMBIG"], []],
+            },
+            {
+                "SEG": "seg1",
+                "POS": 2,
+                "ALS": ["G", "T", "TT"],
+                "GT": [[2], [2], [None], [2]],
+                "HAPG": [[1], [1], [None], [1]],
+                "FT": [[], ["AMBIG"], ["AMBIG"], []],
+            },
+            {
+                "SEG": "seg1",
+                "POS": 3,
+                "ALS": ["C", "G"],
+                "GT": [[None], [None], [None], [None]],
+                "HAPG": [[], [], [], []],
+                "FT": [[], [], [], []],
+            },
+            {
+                "SEG": "seg2",
+                "POS": 10,
+                "ALS": ["A", "T"],
+                "GT": [[0], [1], [0], [1]],
+                "HAPG": [[0], [1], [0], [1]],
+                "FT": [[], [], [], []],
+            },
+        ],
+    }
+
+
+@pytest.mark.usefixtures("summary_jvcf")
+class TestSiteSummaries:
+    def test_counts(self):
+        summaries = get_site_summaries(self.jvcf, Region(), threads=1, chunk_size=10)
+        assert list(summaries["num_ambigs"]) == [1, 2, 0, 0]
+        assert list(summaries["num_null"]) == [1, 1, 4, 0]
+        assert list(summaries["ambig_alleles"]) == ["C", "TT", " ", " "]
+
+    def test_nesting(self):
+        summaries = get_site_summaries(self.jvcf, Region(), threads=1, chunk_size=10)
+        assert list(summaries["lvl1_site"]) == [1, 0, 0, 1]
+        assert list(summaries["nesting_depth"]) == [0, 1, 1, 0]
+
+    def test_freqs_exclude_ambiguous_calls(self):
+        summaries = get_site_summaries(self.jvcf, Region(), threads=1, chunk_size=10)
+        first = summaries.iloc[0]
+        assert first["allele_freqs"] == "0.5,0.5"
+        assert first["hapg_freqs"] == "0.5,0.5"
+        assert first["gt_heterozygosity"] == pytest.approx(0.5)
+        assert summaries.iloc[1]["allele_freqs"] == "0,0,1"
+        assert summaries.iloc[1]["gt_heterozygosity"] == 0
+
+    def test_site_without_calls(self):
+        summaries = get_site_summaries(self.jvcf, Region(), threads=1, chunk_size=10)
+        assert summaries.iloc[2]["allele_freqs"] == "NA"
+        assert pd.isna(summaries.iloc[2]["gt_heterozygosity"])
+
+    def test_region_filter(self):
+        summaries = get_site_summaries(
+            self.jvcf, Region("seg1", 2, 5), threads=1, chunk_size=10
+        )
+        assert list(summaries["site_idx"]) == [1, 2]
+
+    def test_chunked_workers_give_same_table(self):
+        single = get_site_summaries(self.jvcf, Region(), threads=1, chunk_size=10)
+        chunked = get_site_summaries(self.jvcf, Region(), threads=2, chunk_size=1)
+        assert chunked.equals(single)
@@ -0,0 +1,156 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from nocond_simulations.evaluate import columns, evaluate_sites, write_results
+from nocond_simulations.aggregate import (
+    aggregate,
+    box_stats,
+    get_confidence_boxes,
+    get_eval_files,
+    get_precision_recall,
+    round_significant,
+)
+
+
+def make_site(gt, truth_gt=None, gc=10.0, ambiguous=False):
+    return {
+        "POS": 1,
+        "ALS": ["A", "C"],
+        "GT": [[gt]] if truth_gt is None else [[truth_gt], [gt]],
+        "GT_CONF": [gc],
+        "GT_CONF_PERCENTILE": [gc / 10],
+        "DP": [20],
+        "COV": [[12, 8]],
+        "FT": [["AMBIG"] if ambiguous else []] * (1 if truth_gt is None else 2),
+    }
+
+
+def make_run(prg, num, err_rate, truth_gts, res_gts):
+    """A truth jVCF (two samples, the simulated one second) and a genotyped jVCF"""
+    truth = {
+        "Samples": [{"Name": "other"}, {"Name": f"{prg}{num}"}],
+        "Sites": [make_site(gt, truth_gt=0) for gt in truth_gts],
+    }
+    res = {
+        "Samples": [{"Name": f"{prg}{num}"}],
+        "Sites": [
+            make_site(gt, gc=float(i + 1), ambiguous=i == 0)
+            for i, gt in enumerate(res_gts)
+        ],
+        "Lvl1_Sites": [0],
+        "Child_Map": {"0": {"1": list(range(1, len(res_gts)))}},
+    }
+    template = {k: "NA" for k in columns}
+    template.update(
+        prg=prg, simu_path=str(num), err_rate=str(err_rate), fcov="40", nesting="nested"
+    )
+    return evaluate_sites(truth, res, prg, num, template)
+
+
+@pytest.fixture
+def runs():
+    return [
+        make_run("prgA", 1, 0, [0, 1, None, 1], [0, 0, 1, None]),
+        make_run("prgA", 2, 0, [0, 0, None], [0, 1, None]),
+        make_run("prgB", 1, -20, [1, 1], [1, None]),
+    ]
+
+
+def test_evaluate_sites(runs):
+    assert [result["classif"] for result in runs[0]] == ["TP", "FP", "FP", "FN"]
+    assert [result["lvl_1"] for result in runs[0]] == ["1", "0", "0", "0"]
+    assert runs[0][0]["num_child_sites"] == 3
+    assert runs[0][0]["genotyped_ambiguous"] == 1
+
+
+def test_tsv_output_unchanged(runs, tmp_path):
+    output_path = tmp_path / "1_eval.tsv"
+    write_results(runs[0], output_path)
+    lines = output_path.read_text().splitlines()
+    assert lines[0].split("\t")[:9] == [
+        "prgA",
+        "1",
+        "0",
+        "40",
+        "nested",
+        "True",
+        "True",
+        "True",
+        "TP",
+    ]
+    assert lines[3].split("\t")[columns.index("cov_gt_allele")] == "NA"
+
+
+class TestColumnar:
+    @pytest.fixture
+    def eval_files(self, runs, tmp_path):
+        pytest.importorskip("pyarrow")
+        result = list()
+        for idx, run in enumerate(runs):
+            suffix = ".feather" if idx == 2 else ".parquet"
+            result.append(tmp_path / f"run{idx}_eval{suffix}")
+            write_results(run, result[-1])
+        return result
+
+    def test_typed_columns(self, eval_files):
+        sites = pd.read_parquet(eval_files[0])
+        assert list(sites.columns) == columns
+        assert sites["GC"].dtype == np.float64
+        assert sites["lvl_1"].tolist() == [1, 0, 0, 0]
+        assert sites["cov_gt_allele"].isna().tolist() == [False, False, False, True]
+
+    def test_eval_files_from_directory(self, eval_files, tmp_path):
+        assert get_eval_files(tmp_path) == sorted(eval_files)
+
+    def test_aggregates_match_site_level_data(self, runs, eval_files):
+        counts, confidences = aggregate(eval_files, threads=2)
+        sites = pd.DataFrame([result for run in runs for result in run])
+        assert counts[["TP", "FP", "TN", "FN"]].sum().tolist() == [
+            sum(sites["classif"] == classif) for classif in ["TP", "FP", "TN", "FN"]
+        ]
+        num_calls = sum(sites["classif"].isin(["TP", "FP"]))
+        all_gc = confidences[
+            (confidences["subset"] == "all") & (confidences["metric"] == "GC")
+        ]
+        assert all_gc["count"].sum() == num_calls
+
+        precision_recall = get_precision_recall(counts).set_index("prg")
+        # prgA: 2 TP, 3 FP, 1 TN, 1 FN
+        assert precision_recall.loc["prgA", "precision"] == pytest.approx(3 / 6)
+        assert precision_recall.loc["prgA", "recall"] == pytest.approx(3 / 4)
+
+        boxes = get_confidence_boxes(confidences)
+        assert set(boxes["subset"]) == {
+            "all",
+            "no_ambiguous",
+            "no_ambiguous_nestedmost",
+        }
+        # The first site of each run is ambiguous
+        no_ambiguous = boxes[
+            (boxes["subset"] == "no_ambiguous") & (boxes["metric"] == "GC")
+        ]
+        assert no_ambiguous["n"].sum() == num_calls - 3
+
+
+def test_box_stats_whiskers():
+    values = np.array([1.0, 2.0, 3.0, 4.0, 100.0])
+    result = box_stats(values)
+    assert (result["lower"], result["middle"], result["upper"]) == (2.0, 3.0, 4.0)
+    # 100 is an outlier: beyond 1.5 IQR of the box
+    assert (result["ymin"], result["ymax"]) == (1.0, 4.0)
+
+
+def test_box_stats_from_value_counts():
+    values = np.array([5.0, 1.0, 2.0, 100.0, 3.0])
+    counts = np.array([1, 3, 2, 1, 4])
+    expected = box_stats(np.repeat(values, counts))
+    assert box_stats(values, counts) == pytest.approx(expected)
+    assert expected["n"] == 11
+
+
+def test_confidences_rounded_to_significant_digits():
+    values = np.array([0.0, 1.23456, 123456.7, -0.00123456, np.nan])
+    rounded = round_significant(values, 3)
+    assert rounded[:4].tolist() == pytest.approx([0.0, 1.23, 123000.0, -0.00123])
+    assert np.isnan(rounded[4])
@@ -0,0 +1,238 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pacb_ilmn_prg_closest.GCP_roc_curve import (
+    get_bootstrap_bands,
+    get_bootstrap_data,
+    weighted_call_rates,
+    get_roc_curve,
+    get_roc_values,
+    site_arrays,
+    load_gramtools_tsv,
+    load_prg_closest_tsv,
+    load_eval_tsv,
+)
+
+
+@pytest.fixture
+def sorted_sites():
+    GCPs = np.array([0.9, 0.9, 0.8, 0.5, 0.5, 0.5, 0.1])
+    classifs = np.array(["TP", "FP", "TP", "TP", "TN", "FP", "FN"], dtype=object)
+    return GCPs, classifs
+
+
+class TestROCCurve:
+    def test_one_point_per_distinct_GCP(self, sorted_sites):
+        curve = get_roc_curve(*sorted_sites)
+        assert list(curve.GCP) == [np.inf, 0.9, 0.8, 0.5, 0.1]
+        assert list(curve.num_TP) == [0, 1, 2, 3, 3]
+        assert list(curve.num_FP) == [0, 1, 1, 2, 2]
+
+    def test_call_rates(self, sorted_sites):
+        curve = get_roc_curve(*sorted_sites)
+        # 4 true calls (TP or FN), 3 no calls (TN or FP)
+        assert curve.tpr == pytest.approx([0, 1 / 4, 2 / 4, 3 / 4, 3 / 4])
+        assert curve.fpr == pytest.approx([0, 1 / 3, 1 / 3, 2 / 3, 2 / 3])
+        assert curve.precision == pytest.approx([0, 1 / 2, 2 / 3, 3 / 5, 3 / 5])
+
+    def test_auc(self, sorted_sites):
+        curve = get_roc_curve(*sorted_sites)
+        expected = (1 / 3) * (1 / 8) + (1 / 3) * (5 / 8)
+        assert curve.auc() == pytest.approx(expected)
+
+    def test_no_sites(self):
+        curve = get_roc_curve(np.array([]), np.array([], dtype=object))
+        assert list(curve.num_TP) == [0]
+        assert curve.auc() == 0
+
+
+class TestDownsampledROC:
+    def test_steps_are_points_of_full_curve(self):
+        rng = np.random.default_rng(0)
+        GCPs = np.sort(rng.random(3000))[::-1]
+        classifs = rng.choice(["TP", "FP", "TN", "FN"], size=3000).astype(object)
+        result = get_roc_values(GCPs, classifs)
+        assert len(result) == 31
+        num_TP = np.cumsum(classifs == "TP")
+        num_true_calls = np.sum(np.isin(classifs, ["TP", "FN"]))
+        assert result["tpr"].iloc[1] == pytest.approx(num_TP[99] / num_true_calls)
+        assert result["one_minus_precision"].iloc[0] == 0
+
+    def test_stops_once_rates_are_constant(self):
+        GCPs = np.linspace(1, 0, 60)
+        classifs = np.array(["TP"] * 4 + ["TN"] * 56, dtype=object)
+        result = get_roc_values(GCPs, classifs)
+        # The second step calls the last two TPs, the third changes nothing
+        assert list(result["tpr"]) == [0, 0.5, 1, 1]
+
+
+def write_tsv(fname, header, rows):
+    lines = ["\t".join(header)] + ["\t".join(map(str, row)) for row in rows]
+    fname.write_text("\n".join(lines) + "\n")
+    return fname
+
+
+@pytest.fixture
+def gramtools_tsv(tmp_path):
+    rows = [
+        ("s1", "gene1", "gramtools_genotype", 0.02, 42),
+        ("s1", "gene1", "baseline_ref", 0.0, 42),
+        ("s1", "gene2", "gramtools_genotype", "NA", 42),
+        ("s2", "gene1", "gramtools_genotype", 0.01, 40),
+        ("s2", "gene2", "gramtools_genotype", 0.0, 41),
+        ("s3", "gene1", "gramtools_genotype", 0.03, 60),
+    ]
+    return write_tsv(
+        tmp_path / "gramtools.tsv", ["sample", "gene", "condition", "NM", "MAPQ"], rows
+    )
+
+
+@pytest.fixture
+def closest_tsv(tmp_path):
+    rows = [
+        ("gene1", "s1", 0.01, "closest_in_prg_mapq_40"),
+        ("gene1", "s1", 0.0, "closest_in_prg_mapq_20"),
+        ("gene2", "s2", 0.01, "closest_in_prg_mapq_40"),
+        ("gene1", "s3", "NA", "closest_in_prg_mapq_40"),
+    ]
+    return write_tsv(
+        tmp_path / "closest.tsv", ["gene", "sample", "NM", "condition"], rows
+    )
+
+
+class TestLoaders:
+    def test_gramtools_regions(self, gramtools_tsv):
+        regions = load_gramtools_tsv(gramtools_tsv)
+        assert list(regions.index) == [
+            ("s1", "gene1"),
+            ("s2", "gene2"),
+            ("s3", "gene1"),
+        ]
+        assert list(regions["gramtools_NM"]) == [0.02, 0.0, 0.03]
+
+    def test_duplicate_gramtools_region_fails(self, gramtools_tsv):
+        with gramtools_tsv.open("a") as fout:
+            fout.write("s1\tgene1\tgramtools_other\t0.01\t50\n")
+        with pytest.raises(ValueError):
+            load_gramtools_tsv(gramtools_tsv)
+
+    def test_prg_closest_deltas(self, gramtools_tsv, closest_tsv):
+        regions = load_prg_closest_tsv(closest_tsv, load_gramtools_tsv(gramtools_tsv))
+        # s3 has no prg_closest NM, so is removed
+        assert list(regions.index) == [("s1", "gene1"), ("s2", "gene2")]
+        assert regions["delta"].tolist() == pytest.approx([0.01, -0.01])
+
+    def test_duplicate_prg_closest_region_fails(self, gramtools_tsv, closest_tsv):
+        with closest_tsv.open("a") as fout:
+            fout.write("gene1\ts1\t0.02\tclosest_in_prg_mapq_40\n")
+        with pytest.raises(ValueError):
+            load_prg_closest_tsv(closest_tsv, load_gramtools_tsv(gramtools_tsv))
+
+    def test_eval_sites(self, gramtools_tsv, closest_tsv, tmp_path):
+        header = [
+            "gene",
+            "sample",
+            "classif",
+            "GCP",
+            "truth_allele",
+            "genotyped_ambiguous",
+            "truth_ambiguous",
+            "num_child_sites",
+            "is_nested",
+        ]
+        rows = [
+            ("gene1", "s1", "TP", 0.5, "A", False, False, 0, False),
+            ("gene1", "s1", "FP", 0.9, "NA", False, False, 0, True),
+            ("gene1", "s1", "FP", 0.7, "C", False, False, 0, False),
+            ("gene1", "s1", "TN", 0.9, "C", False, True, 0, False),
+            ("gene1", "s1", "TN", 0.9, "C", "NA", False, 0, False),
+            ("gene1", "s1", "TN", 0.9, "C", False, False, 2, False),
+            ("gene2", "s2", "TP", 0.9, "A", False, False, 0, False),
+        ]
+        eval_tsv = write_tsv(tmp_path / "eval.tsv", header, rows)
+        regions = load_prg_closest_tsv(closest_tsv, load_gramtools_tsv(gramtools_tsv))
+        sites = load_eval_tsv(eval_tsv, regions)
+        assert list(sites["GCP"]) == [0.9, 0.7, 0.5]
+        assert list(sites["classif"]) == ["FP", "FP", "TP"]
+        assert list(sites["fp_on_null_call"]) == [True, False, False]
+
+    def test_unknown_classif_fails(self, gramtools_tsv, closest_tsv, tmp_path):
+        header = ["gene", "sample", "classif", "GCP", "truth_allele"]
+        header += ["genotyped_ambiguous", "truth_ambiguous", "num_child_sites"]
+        header += ["is_nested"]
+        rows = [("gene1", "s1", "NA", 0.5, "A", False, False, 0, False)]
+        eval_tsv = write_tsv(tmp_path / "eval.tsv", header, rows)
+        regions = load_prg_closest_tsv(closest_tsv, load_gramtools_tsv(gramtools_tsv))
+        with pytest.raises(ValueError):
+            load_eval_tsv(eval_tsv, regions)
+
+
+@pytest.fixture
+def region_sites():
+    rng = np.random.default_rng(1)
+    num_sites = 400
+    return pd.DataFrame(
+        {
+            "sample": pd.Categorical(rng.choice(["s1", "s2", "s3"], num_sites)),
+            "gene": pd.Categorical(rng.choice(["gene1", "gene2"], num_sites)),
+            "GCP": np.sort(rng.integers(0, 50, num_sites) / 50)[::-1],
+            "classif": rng.choice(["TP", "FP", "TN", "FN"], num_sites),
+            "fp_on_null_call": False,
+        }
+    )
+
+
+class TestBootstrap:
+    def test_unit_weights_give_full_curve(self, region_sites):
+        data = get_bootstrap_data(region_sites)
+        curve = get_roc_curve(
+            region_sites["GCP"].to_numpy(),
+            region_sites["classif"].to_numpy(dtype=object),
+        )
+        num_regions = data.region_totals.shape[1]
+        assert num_regions == 6
+        tpr, fpr, precision = weighted_call_rates(
+            data.cells, data.region_totals, data.num_bins, np.ones(num_regions)
+        )
+        assert tpr == pytest.approx(curve.tpr)
+        assert fpr == pytest.approx(curve.fpr)
+        assert precision == pytest.approx(curve.precision)
+
+    def test_weights_count_regions_repeatedly(self, region_sites):
+        data = get_bootstrap_data(region_sites)
+        regions = region_sites.groupby(["sample", "gene"], observed=True, sort=False)
+        region_ids = regions.ngroup()
+        weights = np.array([2, 0, 1, 0, 3, 0])
+        resampled = region_sites.loc[
+            region_sites.index.repeat(weights[region_ids.to_numpy()])
+        ]
+        expected = get_roc_curve(
+            resampled["GCP"].to_numpy(), resampled["classif"].to_numpy(dtype=object)
+        )
+        tpr, fpr, precision = weighted_call_rates(
+            data.cells, data.region_totals, data.num_bins, weights
+        )
+        # The weighted curve has a point for each GCP of all sites, a superset of the resampled GCPs
+        all_GCPs = get_roc_curve(*site_arrays(region_sites)).GCP
+        points = np.searchsorted(-all_GCPs, -expected.GCP)
+        assert tpr[points] == pytest.approx(expected.tpr)
+        assert fpr[points] == pytest.approx(expected.fpr)
+        assert precision[points] == pytest.approx(expected.precision)
+
+    def test_bands_are_reproducible_and_contain_estimates(self, region_sites):
+        curve = get_roc_curve(
+            region_sites["GCP"].to_numpy(),
+            region_sites["classif"].to_numpy(dtype=object),
+        )
+        bands, aucs = get_bootstrap_bands(region_sites, curve, 60, threads=2, seed=3)
+        assert len(aucs) == 60
+        assert list(bands["GCP"]) == list(curve.GCP)
+        for rate in ["tpr", "fpr"]:
+            assert (bands[f"{rate}_lower"] <= bands[rate] + 1e-9).all()
+            assert (bands[rate] <= bands[f"{rate}_upper"] + 1e-9).all()
+        same_bands, same_aucs = get_bootstrap_bands(
+            region_sites, curve, 60, threads=1, seed=3
+        )
+        pd.testing.assert_frame_equal(bands, same_bands)
+        assert np.array_equal(aucs, same_aucs)
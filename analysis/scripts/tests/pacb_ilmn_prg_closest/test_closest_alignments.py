@@ -0,0 +1,79 @@
+from pathlib import Path
+
+import pytest
+
+from pacb_ilmn_prg_closest.process_alignments import (
+    get_stats_lines,
+    get_sam_files,
+    write_batch_stats,
+    STATS_HEADER,
+)
+
+GENE_LENGTHS = {"AMA1": 100, "EBA_175": 200}
+SAM_HEADER = "@HD\tVN:1.6\n@SQ\tSN:chr1\tLN:10000\n"
+
+
+def write_sam(fname: Path, records):
+    lines = [SAM_HEADER]
+    for query, NM, MAPQ, qlen in records:
+        tag = "" if NM is None else f"\tNM:i:{NM}"
+        lines.append(
+            f"{query}\t0\tchr1\t100\t{MAPQ}\t{qlen}M\t*\t0\t0\t{'A' * qlen}\t*{tag}\n"
+        )
+    fname.write_text("".join(lines))
+    return fname
+
+
+@pytest.fixture
+def sam_files(tmp_path):
+    return [
+        write_sam(
+            tmp_path / "PfA_EBA_175.sam",
+            [
+                ("r1", 4, 60, 10),
+                ("r2", 2, 20, 10),
+                ("r3", 1, 5, 10),
+                ("r4", 0, 60, 2),
+                ("r5", None, 60, 10),
+            ],
+        ),
+        write_sam(tmp_path / "PfB_AMA1.sam", []),
+    ]
+
+
+class TestStatsLines:
+    def test_best_read_per_mapq_threshold(self, sam_files):
+        result = get_stats_lines(sam_files[0], GENE_LENGTHS, [0, 20, 40], 5)
+        assert result == [
+            "EBA_175\tPfA\t0.005\tclosest_in_prg_mapq_0\tr3",
+            "EBA_175\tPfA\t0.02\tclosest_in_prg_mapq_20\tr1",
+            "EBA_175\tPfA\t0.02\tclosest_in_prg_mapq_40\tr1",
+        ]
+
+    def test_thresholds_in_given_order(self, sam_files):
+        result = get_stats_lines(sam_files[0], GENE_LENGTHS, [60, 10], 0)
+        assert result == [
+            "EBA_175\tPfA\tNA\tclosest_in_prg_mapq_60\tNA",
+            "EBA_175\tPfA\t0.0\tclosest_in_prg_mapq_10\tr4",
+        ]
+
+    def test_no_reads(self, sam_files):
+        result = get_stats_lines(sam_files[1], GENE_LENGTHS, [0], 0)
+        assert result == ["AMA1\tPfB\tNA\tclosest_in_prg_mapq_0\tNA"]
+
+
+def test_sam_files_from_directory_or_list(sam_files, tmp_path):
+    assert get_sam_files(tmp_path) == sorted(sam_files)
+    fofn = tmp_path / "sam_files.txt"
+    fofn.write_text("\n".join(map(str, sam_files)) + "\n")
+    assert get_sam_files(fofn) == sam_files
+
+
+def test_batch_stats(sam_files, tmp_path):
+    output_file = tmp_path / "stats.tsv"
+    write_batch_stats(sam_files, GENE_LENGTHS, [0, 20], 5, output_file, threads=2)
+    lines = output_file.read_text().splitlines()
+    assert lines[0] == STATS_HEADER
+    assert lines[1:] == get_stats_lines(
+        sam_files[0], GENE_LENGTHS, [0, 20], 5
+    ) + get_stats_lines(sam_files[1], GENE_LENGTHS, [0, 20], 5)
@@ -0,0 +1,90 @@
+import json
+
+import pytest
+
+from jvcf_processing import Region
+from pacb_ilmn_prg_closest.evaluate_jvcf import (
+    evaluate_batch,
+    evaluate_region,
+    get_truth_regions,
+    result_fields,
+)
+
+
+def make_site(pos, gt, seg="chr1", gcp=0.5):
+    return {
+        "SEG": seg,
+        "POS": pos,
+        "ALS": ["A", "C"],
+        "GT": [[gt]],
+        "GT_CONF": [10.0],
+        "GT_CONF_PERCENTILE": [gcp],
+        "DP": [20],
+        "COV": [[12, 8]],
+        "FT": [[]],
+    }
+
+
+def make_jvcf(sites, lvl1_sites=None, child_map=None):
+    return {
+        "Sites": sites,
+        "Lvl1_Sites": list(range(len(sites))) if lvl1_sites is None else lvl1_sites,
+        "Child_Map": dict() if child_map is None else child_map,
+    }
+
+
+@pytest.fixture
+def genotyped():
+    sites = [make_site(10, 0), make_site(20, 1), make_site(30, 0)]
+    sites += [make_site(5, 1, seg="chr2"), make_site(8, None, seg="chr2")]
+    return make_jvcf(sites)
+
+
+class TestEvaluateRegion:
+    def test_classifs_and_site_numbers(self, genotyped):
+        truth = make_jvcf([make_site(1, 1), make_site(3, 0)])
+        lines = evaluate_region(genotyped["Sites"], 1, truth, "s1", "gene_1")
+        rows = [dict(zip(result_fields, line.split("\t"))) for line in lines]
+        assert [row["classif"] for row in rows] == ["TP", "TP"]
+        assert [row["genotyped_site_num"] for row in rows] == ["1", "2"]
+        assert [row["truth_site_num"] for row in rows] == ["0", "1"]
+        assert [row["POS"] for row in rows] == ["20", "30"]
+        assert rows[0]["gene"] == "gene_1"
+
+    def test_too_few_genotyped_sites_fails(self, genotyped):
+        truth = make_jvcf([make_site(1, 1), make_site(3, 0)])
+        with pytest.raises(ValueError):
+            evaluate_region(genotyped["Sites"], 4, truth, "s1", "gene_1")
+
+
+def test_batch_matches_single_region_evaluations(genotyped, tmp_path):
+    genotyped_jvcf = tmp_path / "genotyped.json"
+    genotyped_jvcf.write_text(json.dumps(genotyped))
+    truths = {
+        "s1_gene_1": (make_jvcf([make_site(1, 0), make_site(2, 1)]), "chr1:15-40"),
+        "s1_gene_2": (make_jvcf([make_site(1, 0)]), "chr2:1-10"),
+    }
+    truth_list = tmp_path / "truth_regions.tsv"
+    with truth_list.open("w") as fout:
+        for name, (truth, region) in truths.items():
+            truth_jvcf = tmp_path / f"{name}_closest_in_prg_mapq_40.json"
+            truth_jvcf.write_text(json.dumps(truth))
+            fout.write(f"{truth_jvcf}\t{region}\n")
+        # No closest sequence found for this region
+        empty_jvcf = tmp_path / "s1_gene_3_closest_in_prg_mapq_40.json"
+        empty_jvcf.touch()
+        fout.write(f"{empty_jvcf}\tchr1:1-5\n")
+
+    truth_regions = get_truth_regions(truth_list)
+    assert truth_regions[0][1] == Region("chr1", 15, 40)
+    output_file = tmp_path / "evals.tsv"
+    evaluate_batch(genotyped_jvcf, truth_regions, output_file)
+    lines = output_file.read_text().splitlines()
+    assert lines[0] == "\t".join(result_fields)
+    expected = evaluate_region(
+        genotyped["Sites"], 1, truths["s1_gene_1"][0], "s1", "gene_1"
+    )
+    expected += evaluate_region(
+        genotyped["Sites"], 3, truths["s1_gene_2"][0], "s1", "gene_2"
+    )
+    assert lines[1:] == expected
@@ -0,0 +1,80 @@
+from pathlib import Path
+
+import pytest
+
+from pacb_ilmn_validation.process_alignments import (
+    get_score_table,
+    add_delta_scores,
+    write_stats,
+)
+
+GENE_LENGTHS = {"gene1": 100, "gene2": 50}
+SAM_HEADER = "@HD\tVN:1.6\n@SQ\tSN:chr1\tLN:10000\n"
+
+
+def write_sam(fname: Path, records):
+    lines = [SAM_HEADER]
+    for gene, NM, AS, MAPQ in records:
+        if NM is None:
+            lines.append(f"{gene}\t4\t*\t0\t0\t*\t*\t0\t0\tACGT\t*\n")
+        else:
+            lines.append(
+                f"{gene}\t0\tchr1\t100\t{MAPQ}\t4M\t*\t0\t0\tACGT\t*\tNM:i:{NM}\tAS:i:{AS}\n"
+            )
+    fname.write_text("".join(lines))
+    return fname
+
+
+@pytest.fixture
+def sam_files(tmp_path):
+    return [
+        write_sam(
+            tmp_path / "pers_ref_s1.sam",
+            [("gene2", 5, -10, 40), ("gene1", None, None, None)],
+        ),
+        write_sam(
+            tmp_path / "baseline_ref_s1.sam",
+            [("gene1", 10, -20, 42), ("gene2", 0, 0, 30)],
+        ),
+    ]
+
+
+class TestScoreTable:
+    @pytest.mark.parametrize("threads", [1, 2])
+    def test_one_row_per_gene_and_file(self, sam_files, threads):
+        table = get_score_table(sam_files, GENE_LENGTHS, threads)
+        assert list(table["condition"]) == ["pers_ref"] * 2 + ["baseline_ref"] * 2
+        assert list(table["gene"]) == ["gene2", "gene1", "gene1", "gene2"]
+        assert list(table["NM"])[0] == 0.1
+        assert table["AS"].isna().sum() == 1
+
+    def test_deltas_in_baseline_gene_order(self, sam_files):
+        table = add_delta_scores(get_score_table(sam_files, GENE_LENGTHS, 1))
+        pers_ref = table[table["condition"] == "pers_ref"]
+        assert list(pers_ref["gene"]) == ["gene1", "gene2"]
+        assert pers_ref["delta_AS"].isna().tolist() == [True, False]
+        assert list(pers_ref["delta_AS"])[1] == 10
+        assert list(pers_ref["delta_MAPQ"])[1] == 10
+        assert (table[table["condition"] == "baseline_ref"]["delta_NM"] == 0).all()
+
+    def test_different_genes_fail(self, sam_files, tmp_path):
+        sam_files.append(
+            write_sam(tmp_path / "cortex_vcf_s1.sam", [("gene1", 1, -2, 3)])
+        )
+        with pytest.raises(ValueError):
+            add_delta_scores(get_score_table(sam_files, GENE_LENGTHS, 1))
+
+    def test_missing_baseline_fails(self, sam_files):
+        with pytest.raises(ValueError):
+            add_delta_scores(get_score_table(sam_files[:1], GENE_LENGTHS, 1))
+
+
+def test_write_stats(sam_files, tmp_path):
+    output_stats = tmp_path / "stats.tsv"
+    write_stats(sam_files, output_stats, GENE_LENGTHS, {"gene2_s1_pers_ref": 12.5})
+    lines = output_stats.read_text().splitlines()
+    assert lines[1:3] == [
+        "s1\tgene1\tpers_ref\tNA\tNA\tNA\tNA\tNA\tNA\t0",
+        "s1\tgene2\tpers_ref\t0.1\t10\t40\t0.1\t10\t10\t12.5",
+    ]
+    assert lines[3] == "s1\tgene1\tbaseline_ref\t0.1\t20\t42\t0.0\t0\t0\t0"
@@ -0,0 +1,110 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+from pacb_ilmn_validation.shift_to_pers_ref_coords import (
+    RegionStarts,
+    translate_positions,
+    translate_bed,
+    cache_path,
+    save_rebasing_starts,
+    load_cached_rebasing_starts,
+    load_rebasing_starts,
+)
+
+
+@pytest.fixture
+def region_starts():
+    return RegionStarts(np.array([1, 10, 12, 30]), np.array([1, 10, 15, 31]))
+
+
+class TestTranslatePositions:
+    def test_unsorted_positions(self, region_starts):
+        positions = np.array([31, 1, 11, 12, 5, 29])
+        result = translate_positions(positions, region_starts)
+        assert result.tolist() == [32, 1, 11, 15, 5, 32]
+
+    def test_positions_before_first_region(self, region_starts):
+        assert translate_positions(np.array([0]), region_starts).tolist() == [0]
+        # Offset from the first region's start, as if it extended leftwards
+        shifted_starts = RegionStarts(np.array([1, 10]), np.array([5, 14]))
+        result = translate_positions(np.array([0, -1, 2]), shifted_starts)
+        assert result.tolist() == [4, 3, 6]
+
+
+def test_cache_round_trip(region_starts, tmp_path):
+    starts = {"chr1": region_starts, "chr2": RegionStarts(np.array([1]), np.array([5]))}
+    fname = tmp_path / "rebasing_map.starts.npz"
+    save_rebasing_starts(fname, starts)
+    loaded = load_cached_rebasing_starts(fname)
+    assert list(loaded) == ["chr1", "chr2"]
+    for chrom in starts:
+        assert np.array_equal(loaded[chrom].base_ref, starts[chrom].base_ref)
+        assert np.array_equal(loaded[chrom].pers_ref, starts[chrom].pers_ref)
+
+
+def test_up_to_date_cache_is_loaded_without_gramtools(region_starts, tmp_path):
+    rebasing_map = tmp_path / "rebasing_map.json"
+    rebasing_map.write_text("{}")
+    save_rebasing_starts(cache_path(rebasing_map), {"chr1": region_starts})
+    map_time = cache_path(rebasing_map).stat().st_mtime - 10
+    os.utime(rebasing_map, (map_time, map_time))
+    loaded = load_rebasing_starts(rebasing_map)
+    assert np.array_equal(loaded["chr1"].pers_ref, region_starts.pers_ref)
+    assert not any(module.startswith("gramtools") for module in sys.modules)
+
+
+@pytest.fixture
+def consistent_starts():
+    """
+    chr1: 19 invariant bases, a variant region growing from 5 to 8 bases, then invariant bases.
+    chr2: a 4-base insertion before position 1.
+    """
+    return {
+        "chr1": RegionStarts(np.array([1, 20, 25, 60]), np.array([1, 20, 28, 63])),
+        "chr2": RegionStarts(np.array([1]), np.array([5])),
+    }
+
+
+class TestTranslateBed:
+    bed_lines = [
+        ["chr1", "30", "50", "gene1", "."],
+        ["chr2", "2", "10", "gene2"],
+        ["chr1", "3", "15", "gene3"],
+    ]
+
+    def write_bed(self, fname):
+        fname.write_text("".join("\t".join(line) + "\n" for line in self.bed_lines))
+
+    def test_round_trip_matches_line_by_line_translation(
+        self, consistent_starts, tmp_path
+    ):
+        """
+        Lines come back in input order with their extra columns, and each interval
+        is translated as the original one-line-at-a-time script did
+        """
+        input_bed = tmp_path / "input.bed"
+        self.write_bed(input_bed)
+        translate_bed(input_bed, consistent_starts, tmp_path / "output.bed")
+
+        expected = list()
+        for chrom, start, end, *rest in self.bed_lines:
+            starts = consistent_starts[chrom]
+            new_start = translate_positions(np.array([int(start) - 1]), starts)[0] - 1
+            new_end = translate_positions(np.array([int(end)]), starts)[0]
+            expected.append("\t".join([chrom, str(new_start), str(new_end)] + rest))
+        result = (tmp_path / "output.bed").read_text().splitlines()
+        assert result == expected
+        assert result == [
+            "chr1\t31\t53\tgene1\t.",
+            "chr2\t4\t14\tgene2",
+            "chr1\t1\t15\tgene3",
+        ]
+
+    def test_unknown_chromosome_fails(self, consistent_starts, tmp_path):
+        input_bed = tmp_path / "input.bed"
+        input_bed.write_text("chr3\t0\t10\n")
+        with pytest.raises(KeyError):
+            translate_bed(input_bed, consistent_starts, tmp_path / "output.bed")
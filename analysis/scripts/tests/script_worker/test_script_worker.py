@@ -0,0 +1,171 @@
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+from script_worker.client import WorkerUnavailable, ping_worker, stop_worker
+
+SCRIPTS_DIR = Path(__file__).resolve().parents[2]
+CLIENT = SCRIPTS_DIR / "script_worker" / "client.py"
+SERVER = SCRIPTS_DIR / "script_worker" / "server.py"
+
+PROBE_SCRIPT = """
+import os
+import sys
+from probe_helper import GREETING
+
+print(GREETING, sys.argv[1:], os.getcwd(), os.environ.get("PROBE_VAR"))
+print("probe stderr", file=sys.stderr)
+exit(int(sys.argv[1]))
+"""
+
+SLOW_SCRIPT = """
+import sys
+import time
+from pathlib import Path
+
+Path(sys.argv[1]).write_text("started")
+time.sleep(1)
+Path(sys.argv[2]).write_text("done")
+"""
+IDENTITY = {"container": None, "scripts_mtime": 1}
+
+
+@pytest.fixture
+def probe(tmp_path):
+    script_dir = tmp_path / "scripts"
+    script_dir.mkdir()
+    (script_dir / "probe_helper.py").write_text('GREETING = "hello"\n')
+    script = script_dir / "probe.py"
+    script.write_text(PROBE_SCRIPT)
+    return script
+
+
+def wait_for(condition, timeout=20):
+    start = time.time()
+    while not condition():
+        if time.time() - start > timeout:
+            raise TimeoutError
+        time.sleep(0.05)
+
+
+def is_listening(socket_path) -> bool:
+    try:
+        ping_worker(str(socket_path))
+    except WorkerUnavailable:
+        return False
+    return True
+
+
+def start_worker(socket_path, *options) -> subprocess.Popen:
+    env = dict(os.environ, PYTHONPATH=str(SCRIPTS_DIR))
+    server = subprocess.Popen(
+        [sys.executable, str(SERVER), str(socket_path), "--preload", "json"]
+        + list(options),
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+    wait_for(lambda: is_listening(socket_path))
+    return server
+
+
+@pytest.fixture
+def worker(tmp_path):
+    socket_path = tmp_path / "worker" / "worker.sock"
+    server = start_worker(socket_path, "--identity", json.dumps(IDENTITY))
+    yield socket_path
+    stop_worker(str(socket_path))
+    server.wait(timeout=20)
+
+
+def start_slow_client(socket_path, tmp_path):
+    """A client running a script that only writes its output after a second"""
+    script = tmp_path / "slow.py"
+    script.write_text(SLOW_SCRIPT)
+    started, output = tmp_path / "started", tmp_path / "output"
+    client = subprocess.Popen(
+        [sys.executable, str(CLIENT), str(socket_path), str(script)]
+        + [str(started), str(output)],
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    wait_for(started.exists)
+    return client, output
+
+
+def run_client(socket_path, script, args, cwd, probe_var="worker"):
+    env = dict(os.environ, PROBE_VAR=probe_var)
+    return subprocess.run(
+        [sys.executable, str(CLIENT), str(socket_path), str(script)] + args,
+        cwd=cwd,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+
+
+class TestScriptWorker:
+    def test_runs_script_as_interpreter_would(self, worker, probe, tmp_path):
+        completed = run_client(worker, probe, ["3", "x"], cwd=tmp_path)
+        assert completed.returncode == 3
+        expected = f"hello ['3', 'x'] {tmp_path} worker\n"
+        assert completed.stdout == expected
+        assert completed.stderr == "probe stderr\n"
+
+    def test_requests_do_not_share_state(self, worker, probe, tmp_path):
+        first = run_client(worker, probe, ["0"], cwd=tmp_path, probe_var="first")
+        second = run_client(worker, probe, ["0"], cwd=probe.parent, probe_var="second")
+        assert first.stdout.split()[-2:] == [str(tmp_path), "first"]
+        assert second.stdout.split()[-2:] == [str(probe.parent), "second"]
+
+    def test_uncaught_exception_fails(self, worker, tmp_path):
+        script = tmp_path / "failing.py"
+        script.write_text("raise ValueError('bad input')\n")
+        completed = run_client(worker, script, [], cwd=tmp_path)
+        assert completed.returncode == 1
+        assert "ValueError: bad input" in completed.stderr
+
+    def test_killed_client_kills_script(self, worker, tmp_path):
+        client, output = start_slow_client(worker, tmp_path)
+        client.kill()
+        client.wait(timeout=20)
+        time.sleep(1.5)
+        assert not output.exists()
+        assert is_listening(worker)
+
+    def test_signals_forwarded_to_script(self, worker, tmp_path):
+        client, output = start_slow_client(worker, tmp_path)
+        client.send_signal(signal.SIGTERM)
+        assert client.wait(timeout=20) == -signal.SIGTERM
+        assert client.stderr.read() == ""
+        time.sleep(1.5)
+        assert not output.exists()
+
+    def test_ping_reports_identity(self, worker):
+        assert ping_worker(str(worker)) == {"running": True, "identity": IDENTITY}
+
+    def test_stop_removes_socket(self, worker):
+        assert stop_worker(str(worker))
+        wait_for(lambda: not worker.exists())
+        assert not stop_worker(str(worker))
+
+
+def test_no_worker_runs_fresh_interpreter(probe, tmp_path):
+    completed = run_client(tmp_path / "absent.sock", probe, ["2"], cwd=tmp_path)
+    assert completed.returncode == 2
+    assert completed.stdout == f"hello ['2'] {tmp_path} worker\n"
+
+
+def test_worker_stops_with_owner(tmp_path):
+    owner = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])
+    socket_path = tmp_path / "worker.sock"
+    server = start_worker(socket_path, "--owner_pid", str(owner.pid))
+    owner.kill()
+    owner.wait(timeout=20)
+    assert server.wait(timeout=20) == 0
+    assert not socket_path.exists()
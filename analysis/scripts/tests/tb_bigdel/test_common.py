@@ -0,0 +1,93 @@
+import pytest
+
+from tb_bigdel.common import Interval, IntervalIndex, sweep_overlaps
+
+
+@pytest.fixture(scope="class")
+def index_data(request):
+    request.cls.intervals = [
+        Interval(50, 60),
+        Interval(1, 10),
+        Interval(20, 45),
+        Interval(100, 200),
+    ]
+    request.cls.index = IntervalIndex(request.cls.intervals)
+
+
+@pytest.mark.usefixtures("index_data")
+class TestIntervalIndex:
+    def test_iterates_sorted_by_start(self):
+        assert [interval.start for interval in self.index] == [1, 20, 50, 100]
+
+    def test_empty_index_finds_nothing(self):
+        empty = IntervalIndex([])
+        assert empty.spanning(Interval(1, 10)) == []
+        assert empty.spanned_by(Interval(1, 10)) == []
+
+    def test_spanning_inner_interval(self):
+        assert self.index.spanning(Interval(120, 130)) == [Interval(100, 200)]
+
+    def test_spanning_same_interval(self):
+        assert self.index.spanning(Interval(20, 45)) == [Interval(20, 45)]
+
+    def test_overlapping_interval_is_not_spanned(self):
+        assert self.index.spanning(Interval(40, 55)) == []
+        assert self.index.spanning(Interval(190, 210)) == []
+
+    def test_spanned_by_large_interval(self):
+        result = self.index.spanned_by(Interval(15, 70))
+        assert result == [Interval(20, 45), Interval(50, 60)]
+
+    def test_spanned_by_partial_overlaps_excluded(self):
+        assert self.index.spanned_by(Interval(5, 55)) == [Interval(20, 45)]
+
+    def test_matches_linear_scan(self):
+        queries = [
+            Interval(start, start + size)
+            for start in range(0, 210, 7)
+            for size in (0, 5, 30, 120)
+        ]
+        for query in queries:
+            expected_spanning = sorted(
+                cand for cand in self.intervals if cand.spans(query)
+            )
+            expected_spanned = sorted(
+                cand for cand in self.intervals if query.spans(cand)
+            )
+            assert self.index.spanning(query) == expected_spanning
+            assert self.index.spanned_by(query) == expected_spanned
+
+
+class TestSweepOverlaps:
+    def test_no_targets_yields_all_queries(self):
+        queries = [Interval(20, 30), Interval(1, 10)]
+        result = list(sweep_overlaps(queries, []))
+        assert result == [(Interval(1, 10), []), (Interval(20, 30), [])]
+
+    def test_target_containing_query_endpoint(self):
+        queries = [Interval(10, 20)]
+        targets = [Interval(1, 12), Interval(15, 25), Interval(30, 40)]
+        result = list(sweep_overlaps(queries, targets))
+        assert result == [(Interval(10, 20), [Interval(1, 12), Interval(15, 25)])]
+
+    def test_target_nested_in_query_does_not_overlap(self):
+        # Same semantics as Interval.overlaps: a query endpoint must fall in the target
+        result = list(sweep_overlaps([Interval(10, 50)], [Interval(20, 30)]))
+        assert result == [(Interval(10, 50), [])]
+
+    def test_targets_can_be_streamed(self):
+        targets = (Interval(start, start + 5) for start in range(0, 100, 10))
+        result = list(sweep_overlaps([Interval(12, 22), Interval(70, 72)], targets))
+        assert result[0][1] == [Interval(10, 15), Interval(20, 25)]
+        assert result[1][1] == [Interval(70, 75)]
+
+    def test_unsorted_targets_fails(self):
+        targets = [Interval(30, 40), Interval(1, 10)]
+        with pytest.raises(ValueError):
+            list(sweep_overlaps([Interval(1, 50)], targets))
+
+    def test_matches_pairwise_overlaps(self):
+        queries = [Interval(start, start + 40) for start in range(0, 300, 25)]
+        targets = [Interval(start, start + 60) for start in range(5, 300, 17)]
+        for query, found in sweep_overlaps(queries, targets):
+            assert found == [target for target in targets if target.overlaps(query)]
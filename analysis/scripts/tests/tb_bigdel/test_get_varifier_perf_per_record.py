@@ -0,0 +1,142 @@
+import pytest
+from click.testing import CliRunner
+
+from tb_bigdel.get_varifier_perf_per_record import (
+    get_format_value,
+    is_in_regions,
+    load_regions,
+    main,
+    per_record_stats_from_vcf_file,
+)
+
+VCF_HEADER = """##fileformat=VCFv4.2
+##contig=<ID=chr1,length=1000>
+##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">
+##FORMAT=<ID=DP,Number=1,Type=Integer,Description="Depth">
+##FORMAT=<ID=COV,Number=R,Type=Integer,Description="Allele coverages">
+##FORMAT=<ID=FRS,Number=1,Type=Float,Description="Fraction of reads supporting the call">
+##FORMAT=<ID=GT_CONF,Number=1,Type=Float,Description="Genotype confidence">
+##FORMAT=<ID=VFR_ED_RA,Number=1,Type=Integer,Description="Edit distance ref to alt">
+##FORMAT=<ID=VFR_ED_TR,Number=1,Type=Integer,Description="Edit distance truth to ref">
+##FORMAT=<ID=VFR_ED_TA,Number=1,Type=Integer,Description="Edit distance truth to alt">
+##FORMAT=<ID=VFR_RESULT,Number=1,Type=String,Description="Varifier result">
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tsample
+"""
+
+
+def vcf_line(pos, ref, alt, fmt, values):
+    return f"chr1\t{pos}\t.\t{ref}\t{alt}\t.\tPASS\t.\t{fmt}\t{values}\n"
+
+
+VARIFIER_FORMAT = "GT:DP:COV:GT_CONF:VFR_ED_RA:VFR_ED_TR:VFR_ED_TA:VFR_RESULT"
+
+
+def require_varifier():
+    """varifier fails to import, with an ImportError, if MUMmer is not installed"""
+    try:
+        import varifier.vcf_stats  # noqa: F401
+    except ImportError as err:
+        pytest.skip(f"varifier not importable: {err}")
+
+
+def write_vcf(fname, lines):
+    fname.parent.mkdir(parents=True, exist_ok=True)
+    fname.write_text(VCF_HEADER + "".join(lines))
+    return fname
+
+
+@pytest.fixture
+def records(tmp_path):
+    """One record per case, in file order"""
+    lines = [
+        vcf_line(10, "A", "C", "GT:DP:COV", "1:8:2,6"),  # FRS from COV
+        vcf_line(20, "A", "C", "GT:DP:COV:FRS", "1:8:2,6:0.9"),  # FRS tag wins
+        vcf_line(30, "A", "C", "GT:DP:COV", ".:.:.,3"),  # Missing values
+        vcf_line(40, "A", "C", "GT:COV", "0:0,0"),  # No coverage
+        vcf_line(50, "A", "C", "GT:DP", "0:5"),  # No coverage key
+    ]
+    vcf = write_vcf(tmp_path / "records.vcf", lines)
+    return list(per_record_stats_from_vcf_file(str(vcf)))
+
+
+class TestPerRecordStats:
+    def test_records_in_file_order(self, records):
+        assert [record["POS"] for record in records] == [10, 20, 30, 40, 50]
+        assert records[0]["CHROM"] == "chr1"
+        assert records[0]["ALS"] == ["A", "C"]
+        assert records[0]["GT"] == (1,)
+
+    def test_frs_inferred_from_cov(self, records):
+        assert records[0]["FRS"] == pytest.approx(0.75)
+        assert records[3]["FRS"] == 0
+        assert records[4]["FRS"] == "NA"
+
+    def test_frs_tag_used_if_present(self, records):
+        assert records[1]["FRS"] == pytest.approx(0.9)
+
+    def test_missing_genotype_gives_no_frs(self, records):
+        assert records[2]["FRS"] == "NA"
+        assert records[2]["GT"] == (None,)
+
+    def test_typed_and_missing_format_values(self, records):
+        assert records[0]["DP"] == 8
+        # As in vcf text: "." if missing, "NA" if the key is absent
+        assert records[2]["DP"] == "."
+        assert records[3]["DP"] == "NA"
+        assert records[0]["GT_CONF"] == "NA"
+
+
+def test_format_value_of_missing_list_entries(tmp_path):
+    pysam = pytest.importorskip("pysam")
+    vcf = write_vcf(tmp_path / "one.vcf", [vcf_line(30, "A", "C", "GT:COV", "1:.,3")])
+    with pysam.VariantFile(str(vcf)) as vcf_in:
+        sample = next(iter(vcf_in)).samples[0]
+    assert get_format_value(sample, "COV") == ".,3"
+    assert get_format_value(sample, "DP") == "NA"
+
+
+def test_region_filtering(tmp_path):
+    bed = tmp_path / "regions.bed"
+    bed.write_text("chr1\t9\t20\tgene1\nchr1\t100\t200\tgene2\n")
+    regions = load_regions(bed)
+    in_regions = {
+        pos: is_in_regions({"CHROM": "chr1", "POS": pos}, regions)
+        for pos in [9, 10, 20, 21, 150]
+    }
+    # Bed intervals are 0-based, half-open; vcf positions 1-based
+    assert in_regions == {9: False, 10: True, 20: True, 21: False, 150: True}
+    assert not is_in_regions({"CHROM": "chr2", "POS": 10}, regions)
+    assert is_in_regions({"CHROM": "chr2", "POS": 10}, load_regions(None))
+
+
+def test_precision_then_recall_in_output(tmp_path):
+    require_varifier()
+    input_dir = tmp_path / "varifier"
+    records = {
+        "precision": [
+            vcf_line(10, "A", "C", VARIFIER_FORMAT, "1:8:2,6:10:1:1:0:TP"),
+            vcf_line(500, "A", "G", VARIFIER_FORMAT, "1:8:2,6:10:1:1:0:TP"),
+        ],
+        "recall": [
+            vcf_line(15, "A", "T", VARIFIER_FORMAT, "1:8:2,6:10:1:1:0:TP"),
+        ],
+    }
+    write_vcf(input_dir / "precision.vcf", records["precision"])
+    write_vcf(input_dir / "recall" / "recall.vcf", records["recall"])
+    bed = tmp_path / "regions.bed"
+    bed.write_text("chr1\t0\t100\n")
+    output = tmp_path / "stats" / "stats.tsv"
+
+    result = CliRunner().invoke(
+        main,
+        [str(input_dir), str(output), "--sample_name", "s1", "--tool_name", "tool"]
+        + ["--region_file", str(bed)],
+    )
+    assert result.exit_code == 0, result.output
+    lines = [line.split("\t") for line in output.read_text().splitlines()]
+    assert [(line[0], line[6]) for line in lines] == [
+        ("10", "precision"),
+        ("15", "recall"),
+    ]
+    assert "precision:Skipped 1 variants" in result.output
+    assert list(output.parent.iterdir()) == [output]
@@ -0,0 +1,109 @@
+import pytest
+from click.testing import CliRunner
+
+pysam = pytest.importorskip("pysam")
+
+from tb_bigdel.postprocess_vcf import main
+
+REF_SEQ = "ACGTACGTACGTACGTACGT"
+VCF_HEADER = """##fileformat=VCFv4.2
+##contig=<ID=chr1,length=20>
+##INFO=<ID=SVLEN,Number=1,Type=Integer,Description="SV length">
+##INFO=<ID=SEQ,Number=1,Type=String,Description="Inserted sequence">
+##INFO=<ID=SVMODEL,Number=1,Type=String,Description="SV model">
+##ALT=<ID=DEL,Description="Deletion">
+##ALT=<ID=INS,Description="Insertion">
+##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\toriginal
+"""
+# Graphtyper2-style: an AGGREGATED record per SV, followed by its BREAKPOINT records
+VCF_RECORDS = [
+    ("2", "snp0", "C", "G", "SVMODEL=none", "0"),
+    ("3", "snp1", "G", "T", "SVMODEL=none", "1"),
+    ("5", "sv1", "A", "<DEL:SVSIZE=3:AGGREGATED>", "SVLEN=3;SVMODEL=AGGREGATED", "1"),
+    ("5", "sv1.1", "A", "<DEL:SVSIZE=3:BREAKPOINT>", "SVLEN=3;SVMODEL=BREAKPOINT", "1"),
+    ("13", "sv2", "A", "<INS:SVSIZE=2:AGGREGATED>", "SVLEN=2;SEQ=TT;SVMODEL=AGG", "1"),
+    ("17", "snp2", "A", "C", "SVMODEL=none", "."),
+]
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    fasta = tmp_path / "ref.fa"
+    fasta.write_text(f">chr1\n{REF_SEQ}\n")
+    vcf = tmp_path / "input.vcf"
+    lines = [
+        f"chr1\t{pos}\t{rec_id}\t{ref}\t{alt}\t.\tPASS\t{info}\tGT\t{gt}\n"
+        for pos, rec_id, ref, alt, info, gt in VCF_RECORDS
+    ]
+    vcf.write_text(VCF_HEADER + "".join(lines))
+    return fasta, vcf
+
+
+def run_postprocess(inputs, output_vcf, *options):
+    fasta, vcf = inputs
+    return CliRunner().invoke(
+        main, [str(fasta), str(vcf), str(output_vcf)] + list(options)
+    )
+
+
+@pytest.fixture
+def output_vcf(inputs, tmp_path):
+    output_vcf = tmp_path / "output" / "processed.vcf.gz"
+    result = run_postprocess(
+        inputs,
+        output_vcf,
+        "--remove_ref_and_null",
+        "--sample_name",
+        "renamed",
+        "--drop_info",
+        "SVMODEL",
+    )
+    assert result.exit_code == 0, result.output
+    assert "Processed 2 symbolically encoded structural variants" in result.output
+    return output_vcf
+
+
+def test_symbolic_alleles_expanded_from_fasta(output_vcf):
+    with pysam.VariantFile(str(output_vcf)) as vcf_in:
+        records = [(rec.id, rec.pos, rec.alleles) for rec in vcf_in]
+    assert records == [
+        ("snp1", 3, ("G", "T")),
+        # Base before the deletion + the 3 deleted bases
+        ("sv1", 4, ("TACG", "T")),
+        ("sv2", 13, ("A", "ATT")),
+    ]
+
+
+def test_sample_renamed_and_info_dropped(output_vcf):
+    with pysam.VariantFile(str(output_vcf)) as vcf_in:
+        assert list(vcf_in.header.samples) == ["renamed"]
+        assert set(vcf_in.header.info) == {"SVLEN", "SEQ"}
+        records = list(vcf_in)
+    assert all("SVMODEL" not in record.info for record in records)
+    assert records[2].info["SEQ"] == "TT"
+
+
+def test_output_is_indexed(output_vcf):
+    assert output_vcf.with_name(output_vcf.name + ".csi").exists()
+    with pysam.VariantFile(str(output_vcf)) as vcf_in:
+        assert [record.id for record in vcf_in.fetch("chr1", 10, 20)] == ["sv2"]
+
+
+def test_ref_and_null_calls_kept_by_default(inputs, tmp_path):
+    output_vcf = tmp_path / "processed.vcf.gz"
+    assert run_postprocess(inputs, output_vcf).exit_code == 0
+    with pysam.VariantFile(str(output_vcf)) as vcf_in:
+        assert list(vcf_in.header.samples) == ["original"]
+        assert [record.id for record in vcf_in] == [
+            "snp0",
+            "snp1",
+            "sv1",
+            "sv2",
+            "snp2",
+        ]
+
+
+def test_uncompressed_output_refused(inputs, tmp_path):
+    result = run_postprocess(inputs, tmp_path / "processed.vcf")
+    assert isinstance(result.exception, ValueError)
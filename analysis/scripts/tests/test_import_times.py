@@ -0,0 +1,89 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, Tuple
+
+import pytest
+
+from lazy_imports import lazy_import
+from nocond_simulations.evaluate import columns as simulation_columns
+from pacb_ilmn_prg_closest.evaluate_jvcf import result_fields as jvcf_columns
+from tb_bigdel.get_varifier_perf_per_record import headers as varifier_columns
+
+SCRIPTS_DIR = Path(__file__).resolve().parents[1]
+HEAVY_MODULES = {
+    "pandas",
+    "numpy",
+    "scipy",
+    "edlib",
+    "pysam",
+    "varifier",
+    "cluster_vcf_records",
+}
+# Upper bound on the cumulative import time of all top-level imports, as reported by
+# `python -X importtime`. Startup is checked by the absence of HEAVY_MODULES; this bound is
+# generous, at about ten times a typical run, so that it only catches gross regressions
+# (e.g. a new eager import of a heavy module not listed above) even on a loaded machine.
+IMPORT_BUDGET_MS = 2000
+
+# Commands that workflows run only to print a header. They must not import heavy
+# dependencies, which lazy_imports defers until needed.
+HEADER_COMMANDS = {
+    "simulation_evaluate": (
+        ["nocond_simulations/evaluate.py", "-p"],
+        simulation_columns,
+    ),
+    "evaluate_jvcf": (["pacb_ilmn_prg_closest/evaluate_jvcf.py", "-p"], jvcf_columns),
+    "varifier_perf_per_record": (
+        ["tb_bigdel/get_varifier_perf_per_record.py", "--header_only"],
+        varifier_columns,
+    ),
+}
+
+
+def run_with_importtime(args) -> Tuple[str, Dict[str, int]]:
+    """Stdout of the command, and the cumulative import time (us) of each imported module"""
+    env = dict(os.environ, PYTHONPATH=str(SCRIPTS_DIR))
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime"] + args,
+        cwd=SCRIPTS_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    import_times = dict()
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line.split("|")
+        # Nested imports are indented: keep top-level ones, whose times include them
+        import_times[module.rstrip()] = int(cumulative)
+    return completed.stdout, import_times
+
+
+@pytest.mark.parametrize("command", HEADER_COMMANDS)
+def test_header_commands_start_fast(command):
+    args, expected_columns = HEADER_COMMANDS[command]
+    stdout, import_times = run_with_importtime(args)
+    assert stdout.rstrip("\n").split("\t") == expected_columns
+
+    imported = {module.strip().split(".")[0] for module in import_times}
+    assert imported & HEAVY_MODULES == set()
+    top_level_us = sum(
+        cumulative
+        for module, cumulative in import_times.items()
+        if not module.startswith("  ")
+    )
+    assert top_level_us / 1000 < IMPORT_BUDGET_MS
+
+
+def test_lazy_import_defers_loading(tmp_path, monkeypatch):
+    (tmp_path / "lazy_probe.py").write_text("VALUE = 42\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.delitem(sys.modules, "lazy_probe", raising=False)
+    probe = lazy_import("lazy_probe")
+    assert "lazy_probe" not in sys.modules
+    assert probe.VALUE == 42
+    assert "lazy_probe" in sys.modules
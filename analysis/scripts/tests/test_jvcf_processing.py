@@ -1,6 +1,13 @@
 import pytest
 
-from jvcf_processing import Region, is_in_region, num_sites_under
+from jvcf_processing import (
+    Region,
+    SitesIndex,
+    first_idx_in_region,
+    is_in_region,
+    num_sites_under,
+    site_nesting_depths,
+)
 
 
 @pytest.fixture(scope="class")
@@ -25,6 +32,34 @@ class TestRegion:
             assert is_in_region(site_json_data, region)
 
 
+class TestSitesIndex:
+    # Nested sites (here 2 and 3) can have a smaller POS than the site before them
+    sites = [
+        {"SEG": "seg1", "POS": "5"},
+        {"SEG": "seg1", "POS": "20"},
+        {"SEG": "seg1", "POS": "12"},
+        {"SEG": "seg1", "POS": "25"},
+        {"SEG": "seg2", "POS": "3"},
+    ]
+
+    def test_same_first_idx_as_scan(self):
+        sites_index = SitesIndex(self.sites)
+        for region in [
+            Region(),
+            Region("seg1", 1, 100),
+            Region("seg1", 10, 22),
+            Region("seg1", 21, 30),
+            Region("seg2", 3, 3),
+        ]:
+            assert sites_index.first_idx_in_region(region) == first_idx_in_region(
+                self.sites, region
+            )
+
+    def test_no_sites_in_region(self):
+        with pytest.raises(IndexError):
+            SitesIndex(self.sites).first_idx_in_region(Region("seg1", 6, 11))
+
+
 @pytest.fixture(scope="class")
 def child_map_data():
     return {"0": {"0": [1, 2], "1": [3, 4]}, "1": {"0": [5, 6, 7]}}
@@ -39,3 +74,8 @@ class TestSitesUnder:
 
     def test_parentsite_returns_allchildren_recursively(self, child_map_data):
         assert num_sites_under(child_map_data, "0") == 7
+
+
+def test_site_nesting_depths(child_map_data):
+    jvcf = {"Sites": [{}] * 9, "Lvl1_Sites": [0, 8], "Child_Map": child_map_data}
+    assert site_nesting_depths(jvcf) == [0, 1, 1, 1, 1, 2, 2, 2, 0]
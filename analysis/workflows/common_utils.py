@@ -1,43 +1,253 @@
+import json
+import os
+import shutil
+import tempfile
+import time
 from pathlib import Path
-from typing import List
-from subprocess import run as sp_run, PIPE
+from typing import Dict, List, Optional
+from subprocess import run as sp_run, PIPE, Popen, DEVNULL, CalledProcessError
 from glob import glob
 
 
-def get_gmtools_commit():
-    """Get gramtools commit version through venv/singularity container it is installed in"""
+GMTOOLS_COMMIT_CACHE = Path(".snakemake") / "gmtools_commit_cache.json"
+# Prints where gramtools is installed and when any of its files last changed, without importing it
+GRAMTOOLS_INSTALL_KEY_SCRIPT = """
+import importlib.util
+from pathlib import Path
+
+spec = importlib.util.find_spec("gramtools")
+if spec is not None and spec.origin is not None:
+    package_dir = Path(spec.origin).parent.resolve()
+    last_modified = max(entry.stat().st_mtime_ns for entry in package_dir.rglob("*"))
+    print(f"{package_dir}:{last_modified}")
+"""
+
+
+def get_venv_gramtools_key() -> Optional[str]:
+    """
+    Identifies the gramtools that `python3` on the PATH, which reports the commit, imports:
+    the interpreter, gramtools' package directory and the latest modification time of
+    all files under it. Computed by that interpreter, which need not be Snakemake's own.
+    """
+    python = shutil.which("python3")
+    if python is None:
+        return None
+    result = sp_run(
+        [python, "-c", GRAMTOOLS_INSTALL_KEY_SCRIPT],
+        stdout=PIPE,
+        stderr=DEVNULL,
+        universal_newlines=True,
+    )
+    install_key = result.stdout.strip()
+    if result.returncode != 0 or install_key == "":
+        return None
+    return f"{python}:{install_key}"
+
+
+def get_container_key() -> str:
+    container = Path(config["container"]).resolve()
+    container_stat = container.stat()
+    return f"{container}:{container_stat.st_size}:{container_stat.st_mtime_ns}"
+
+
+def load_gmtools_commit_cache() -> Dict[str, Dict[str, str]]:
+    """Maps each source of the commit ('venv', 'container') to the key it was cached under, and the commit"""
+    try:
+        with GMTOOLS_COMMIT_CACHE.open() as fin:
+            return json.load(fin)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return dict()
+
+
+def get_cached_gmtools_commit(source: str, key: str) -> Optional[str]:
+    entry = load_gmtools_commit_cache().get(source, dict())
+    if entry.get("key") != key:
+        return None
+    return entry.get("commit")
+
+
+def cache_gmtools_commit(source: str, key: str, commit: str):
+    """Concurrently parsed workflows (e.g. cluster jobs) may write the cache: replace it atomically"""
+    cache = load_gmtools_commit_cache()
+    cache[source] = {"key": key, "commit": commit}
+    GMTOOLS_COMMIT_CACHE.parent.mkdir(parents=True, exist_ok=True)
+    tmp_cache = GMTOOLS_COMMIT_CACHE.with_suffix(f".{os.getpid()}.tmp")
+    with tmp_cache.open("w") as fout:
+        json.dump(cache, fout, indent=2)
+    os.replace(tmp_cache, GMTOOLS_COMMIT_CACHE)
+
+
+def run_gmtools_commit_script(command_prefix: List[str]) -> str:
     gmtools_commit_script = Path(config["scripts"]) / "gmtools_commit.py"
     gmtools_commit_script = str(gmtools_commit_script.resolve())
-    try:  # Try in virtual environment first
-        GMTOOLS_COMMIT = sp_run(
-            ["python3", gmtools_commit_script],
-            capture_output=True,
-            text=True,
-            check=True,
-        )
-    except:
-        GMTOOLS_COMMIT = sp_run(
-            [
-                "singularity",
-                "exec",
-                str(Path(config["container"]).resolve()),
-                "python3",
-                gmtools_commit_script,
-            ],
-            capture_output=True,
-            text=True,
-            check=True,
-        )
-    GMTOOLS_COMMIT = GMTOOLS_COMMIT.stdout.strip()
+    result = sp_run(
+        command_prefix + ["python3", gmtools_commit_script],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return result.stdout.strip()
+
+
+def get_gmtools_commit():
+    """
+    Get gramtools commit version through venv/singularity container it is installed in.
+    Snakefiles are parsed at each workflow start and cluster job submission, so the commit
+    is cached, keyed by the venv's gramtools install or the container image: rebuilding
+    either invalidates the cached commit.
+    """
+    venv_key = get_venv_gramtools_key()
+    if venv_key is not None:
+        GMTOOLS_COMMIT = get_cached_gmtools_commit("venv", venv_key)
+        if GMTOOLS_COMMIT is not None:
+            return GMTOOLS_COMMIT
+        try:  # Try in virtual environment first
+            GMTOOLS_COMMIT = run_gmtools_commit_script([])
+            cache_gmtools_commit("venv", venv_key, GMTOOLS_COMMIT)
+            return GMTOOLS_COMMIT
+        except (CalledProcessError, FileNotFoundError):
+            pass
+
+    container_key = get_container_key()
+    GMTOOLS_COMMIT = get_cached_gmtools_commit("container", container_key)
+    if GMTOOLS_COMMIT is not None:
+        return GMTOOLS_COMMIT
+    container = str(Path(config["container"]).resolve())
+    GMTOOLS_COMMIT = run_gmtools_commit_script(["singularity", "exec", container])
+    cache_gmtools_commit("container", container_key, GMTOOLS_COMMIT)
     return GMTOOLS_COMMIT
 
 
+def get_script_worker_socket() -> Path:
+    """
+    One worker per Snakemake run, keyed by the workflow name and Snakemake's pid, in
+    a temporary directory the container also sees. Jobs of another process, e.g. cluster
+    jobs, find no worker there and run scripts in a fresh interpreter.
+    """
+    workflow_name = Path(workflow.snakefile).resolve().parent.name
+    worker_dir = Path(tempfile.gettempdir()) / f"script_worker_{os.getuid()}"
+    return worker_dir / f"{workflow_name}_{os.getpid()}.sock"
+
+
+def get_script_runner() -> str:
+    """
+    Command to use in place of `python3` to run scripts in the warm script worker.
+    Jobs that cannot reach the worker (e.g. cluster jobs on other nodes) run the script in
+    a fresh interpreter instead.
+    """
+    client = (Path(config["scripts"]) / "script_worker" / "client.py").resolve()
+    return f"python3 {client} {get_script_worker_socket()}"
+
+
+def get_script_worker_identity(scripts_dir: Path, python_path: str) -> Dict:
+    """
+    What the worker's preloaded code and environment depend on. A worker with another
+    identity must not serve this run's jobs.
+    """
+    return {
+        "owner_pid": os.getpid(),
+        "container": get_container_key() if workflow.use_singularity else None,
+        "scripts_mtime": max(
+            fname.stat().st_mtime_ns for fname in scripts_dir.rglob("*.py")
+        ),
+        "python_path": python_path,
+    }
+
+
+def ping_script_worker() -> Optional[Dict]:
+    """The identity of the worker listening on this run's socket, if any"""
+    result = sp_run(
+        get_script_runner().split() + ["--ping"], stdout=PIPE, universal_newlines=True
+    )
+    if result.returncode != 0:
+        return None
+    try:
+        return json.loads(result.stdout)["identity"]
+    except (ValueError, KeyError):
+        return None
+
+
+def start_script_worker(log_file: Path, timeout: int = 60):
+    """
+    Starts the script worker (analysis/scripts/script_worker/server.py) in the background,
+    inside the container if the workflow uses singularity, and waits until it answers pings.
+    A worker already listening with another identity is stopped and replaced.
+    The worker stops by itself if Snakemake exits without stopping it.
+    """
+    socket_path = get_script_worker_socket()
+    scripts_dir = Path(config["scripts"]).resolve()
+    python_path = os.pathsep.join(
+        filter(None, [str(scripts_dir), os.environ.get("PYTHONPATH", "")])
+    )
+    identity = get_script_worker_identity(scripts_dir, python_path)
+    running_identity = ping_script_worker()
+    if running_identity == identity:
+        return
+    if running_identity is not None:
+        print(f"Replacing the script worker listening on {socket_path}")
+        stop_script_worker()
+
+    command = ["python3", str(scripts_dir / "script_worker" / "server.py")]
+    command += [str(socket_path), "--identity", json.dumps(identity)]
+    command += ["--owner_pid", str(os.getpid())]
+    if workflow.use_singularity:
+        container = str(Path(config["container"]).resolve())
+        command = ["singularity", "exec", container] + command
+    env = dict(os.environ, PYTHONPATH=python_path)
+
+    log_file.parent.mkdir(parents=True, exist_ok=True)
+    start = time.time()
+    while socket_path.exists():  # Wait for a replaced worker to release the socket
+        if time.time() - start > timeout:
+            print(f"Warning: script worker at {socket_path} did not stop")
+            return
+        time.sleep(0.1)
+    with log_file.open("w") as log:
+        worker = Popen(
+            command,
+            stdin=DEVNULL,
+            stdout=log,
+            stderr=log,
+            env=env,
+            start_new_session=True,
+        )
+    while ping_script_worker() != identity:
+        if worker.poll() is not None:
+            print(f"Warning: script worker did not start, see {log_file}")
+            return
+        if time.time() - start > timeout:
+            print(f"Warning: script worker not listening after {timeout}s")
+            return
+        time.sleep(0.1)
+
+
+def stop_script_worker():
+    sp_run(get_script_runner().split() + ["--stop"], check=False)
+
+
 def mk_output_dirs(variables):
     """For each variable starting with 'output', makes the directory name it holds"""
     for variable in filter(lambda name: name.startswith("output"), variables):
         Path(eval(variable)).mkdir(exist_ok=True, parents=True)
 
 
+def write_file_list(fnames: List[str], fofn: str):
+    """
+    Writes one file name per line, for scripts taking a file of file names.
+    Done from Python rather than the shell, whose command line cannot hold thousands of names.
+    """
+    Path(fofn).parent.mkdir(exist_ok=True, parents=True)
+    with open(fofn, "w") as fout:
+        fout.writelines(f"{fname}\n" for fname in fnames)
+
+
+def write_tsv_rows(rows: List[List[str]], fname: str):
+    """As `write_file_list`, for lines of several tab-separated fields"""
+    Path(fname).parent.mkdir(exist_ok=True, parents=True)
+    with open(fname, "w") as fout:
+        fout.writelines("\t".join(row) + "\n" for row in rows)
+
+
 def get_reads(wildcards) -> List[str]:
     reads_dir = f'{config["ilmn_reads_dir"]}/{wildcards.sample}'
     reads_files = glob(f"{reads_dir}/**/**/*.fastq.gz")
@@ -177,15 +177,7 @@ rule tb_graphtyper_postprocess:
         postprocess_vcf=f'{config["scripts"]}/{WORKFLOW}/postprocess_vcf.py',
     shell:
         """
-         # Process symbolic alleles for use by bcftools consensus and varifier downstream
-        python3 {params.postprocess_vcf} {input.fasta_ref} {input.vcf} tmp.vcf
-
-        # Remove OLD_VARIANT_ID INFO field as it prevents merging
-        sed -r 's/OLD_VARIANT_ID=(UNION_BC[0-9a-zA-Z_]+;)+//g' tmp.vcf > no_INFO.vcf
-
-        # Change sample name
-        echo "$(bcftools query -l no_INFO.vcf) {wildcards.sample}" > rename.txt
-        bcftools reheader -s rename.txt no_INFO.vcf > renamed.vcf
-        bgzip -c renamed.vcf > {output.gzipped}
-        bcftools index -f {output.gzipped}
+        # Process symbolic alleles for use by bcftools consensus and varifier downstream,
+        # removing OLD_VARIANT_ID INFO field as it prevents merging, and changing sample name
+        python3 {params.postprocess_vcf} {input.fasta_ref} {input.vcf} {output.gzipped} --sample_name {wildcards.sample} --drop_info OLD_VARIANT_ID
         """